@@ -1,12 +1,14 @@
 from qgis.core import QgsProcessingProvider
 
 from PortlandTransitServiceAreaTool import TransitServiceArea
+from PortlandTransitTravelTimeMatrix import TransitTravelTimeMatrix
 
 
 class AlgorithmProvider(QgsProcessingProvider):
 
     def loadAlgorithms(self, *args, **kwargs):
         self.addAlgorithm(TransitServiceArea())
+        self.addAlgorithm(TransitTravelTimeMatrix())
 
     def id(self, *args, **kwargs):
         """Used for identifying the provider.
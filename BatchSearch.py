@@ -0,0 +1,259 @@
+import concurrent.futures
+import math
+import multiprocessing
+import os
+import sys
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from GtfsTimetable import ConnectionScan
+from RaptorSearch import RaptorSearch, ReverseRaptorSearch
+from TransitNetwork import network_arrays, network_from_arrays
+
+# Byte alignment of each array within the shared memory block
+shared_alignment = 64
+
+
+# Result of searching from one origin, small enough to send back from a worker
+#   stop_arrivals:  stop fid -> arrival time in hours
+#   boardings:      route stop fid -> departure time in hours
+#   reached_edges:  (edge ids, start distances, end distances) of the street graph covered on foot,
+#                   one per time band in ascending order (a single entry for the whole time limit by default)
+#   ridden_spans:   (from route stop fid, to route stop fid) of each route ridden
+#   counters:       the engine's work counters
+#   block_minutes:  minutes to every census block (see BlockReach.block_minutes), if asked for
+#   block_sums:     (sums, counts) of the census blocks' fields within each band (see BlockColumns.sums_within),
+#                   if asked for
+#   block_sources:  the origin each census block is reached from first within each band, -1 where it is not
+#                   reached, one array per band, for searches from several labeled origins at once
+class OriginResult:
+    def __init__(self, index, stop_arrivals, boardings, reached_edges, ridden_spans, counters, block_minutes=None,
+                 block_sums=None, block_sources=None):
+        self.index = index
+        self.stop_arrivals = stop_arrivals
+        self.boardings = boardings
+        self.reached_edges = reached_edges
+        self.ridden_spans = ridden_spans
+        self.counters = counters
+        self.block_minutes = block_minutes
+        self.block_sums = block_sums
+        self.block_sources = block_sources
+
+
+
+# Runs a table-driven engine ('raptor' or 'timetable') from one origin, given as street graph seeds
+#   (see StreetGraph.snap)
+#   The 'reverse' engine searches back from the seeds instead (see ReverseRaptorSearch), which may join the seeds
+#   of several destinations; its result covers the catchment the destinations can be reached from, with
+#   stop_arrivals and boardings holding the time still to go
+#   departure (seconds after midnight) and timetable are only used by the timetable engine
+#   bands (hours, ascending, the last equal to time_limit) splits the covered streets by time limit
+#   block_times finds the minutes to every census block instead of the covered streets, from the network's
+#   block_reach; block_sums sums the network's block_columns over the blocks reached within each band instead
+#   sources, the origin index of each seed, searches from several origins at once with the 'raptor' engine and
+#   also finds the block_sources of the union of their service areas, from the network's block_reach
+def search_origin(network, index, seeds, time_limit, engine, max_transfers=None, timetable=None, departure=None,
+                  bands=None, block_times=False, block_sums=False, sources=None):
+    if sources is not None and engine != 'raptor':
+        raise ValueError("Only the round-based engine labels blocks with the origin they are reached from")
+    if engine == 'timetable':
+        search = ConnectionScan(network, timetable, departure, time_limit)
+    elif engine == 'reverse':
+        search = ReverseRaptorSearch(network, time_limit, max_transfers)
+    else:
+        search = RaptorSearch(network, time_limit, max_transfers)
+    if sources is not None:
+        search.track_sources(sources)
+    search.run_from_seeds(seeds)
+
+    graph = network.graph
+    max_distance = time_limit * network.walk_speed
+    block_sources = None
+    if sources is None and not block_times and not block_sums:
+        # The streets walked, merged from the origin's walk and the cached walks from every stop reached
+        spans = network.walked_edge_spans(*search.walk_sources(), time_limit)
+        return OriginResult(index, search.stop_arrivals, search.boardings(),
+                            band_edges(network, spans, bands, time_limit), search.ridden_spans(), search.counters())
+    if sources is None:
+        distances = graph.reach(search.walking_seeds(), max_distance)
+    else:
+        distances, vertex_sources = graph.reach_sources(search.walking_seeds(), search.walking_seed_sources(),
+                                                        max_distance)
+        block_distances, fastest = network.block_reach.block_sources(graph, graph.distance_array(distances),
+                                                                     graph.source_array(vertex_sources),
+                                                                     max_distance)
+        block_sources = [np.where(block_distances <= band * network.walk_speed, fastest, -1)
+                         for band in bands or [time_limit]]
+    if block_times:
+        minutes = network.block_reach.block_minutes(graph, graph.distance_array(distances), max_distance,
+                                                    network.walk_speed)
+        return OriginResult(index, search.stop_arrivals, search.boardings(), [], search.ridden_spans(),
+                            search.counters(), minutes)
+    if block_sums:
+        block_distances = network.block_reach.block_distances(graph, graph.distance_array(distances), max_distance)
+        sums = network.block_columns.sums_within(block_distances,
+                                                 [band * network.walk_speed for band in bands or [time_limit]])
+        return OriginResult(index, search.stop_arrivals, search.boardings(), [], search.ridden_spans(),
+                            search.counters(), block_sums=sums)
+
+    return OriginResult(index, search.stop_arrivals, search.boardings(),
+                        band_edges(network, graph.edge_spans(distances), bands, time_limit),
+                        search.ridden_spans(), search.counters(), block_sources=block_sources)
+
+
+# reached_edges of an OriginResult from the edge spans of the walk of a search (see StreetGraph.edge_spans)
+def band_edges(network, spans, bands, time_limit):
+    reached_edges = []
+    for band in bands or [time_limit]:
+        edges, starts, ends = network.graph.covered_edges(*spans, band * network.walk_speed)
+        reached_edges.append((edges.astype(np.int32), starts, ends))
+    return reached_edges
+
+
+# Time limits in hours from a comma separated list of minutes, together with the search time limit
+#   Returns None when only the search time limit is given, otherwise the limits in ascending order
+#   Raises ValueError for entries that are not positive numbers of minutes or are not listed in ascending order
+def parse_time_bands(bands_text, search_time_min):
+    minutes = {search_time_min}
+    previous = 0
+    for part in (bands_text or '').split(','):
+        if part.strip():
+            value = float(part)
+            if not math.isfinite(value) or value <= 0:
+                raise ValueError(f"Time limit must be a positive number of minutes: {part.strip()}")
+            if value <= previous:
+                raise ValueError(f"Time limits must be listed in ascending order: {part.strip()}")
+            previous = value
+            minutes.add(value)
+    if len(minutes) < 2:
+        return None
+    return [m / 60 for m in sorted(minutes)]
+
+
+
+# Copies a network's arrays into a single shared memory block that worker processes attach to
+class SharedNetwork:
+    def __init__(self, network, timetable=None):
+        arrays = network_arrays(network, timetable)
+        layout = {}
+        size = 0
+        for name, array in arrays.items():
+            size = -(-size // shared_alignment) * shared_alignment
+            layout[name] = (array.dtype.str, array.shape, size)
+            size += array.nbytes
+
+        self.memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for name, array in arrays.items():
+            dtype, shape, offset = layout[name]
+            np.ndarray(shape, dtype=dtype, buffer=self.memory.buf, offset=offset)[...] = array
+        self.layout = layout
+        self.meta = (network.walk_speed, network.stops_set, network.route_stops_set)
+
+    # Everything a worker needs to attach, small enough to pickle
+    def descriptor(self):
+        return self.memory.name, self.layout, self.meta
+
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+# Attaches to a SharedNetwork from another process, returning (memory, network, timetable)
+#   The memory block must be kept alive for as long as the network is used
+def attach_network(descriptor):
+    name, layout, meta = descriptor
+    # Spawned workers share the parent's resource tracker, so the block stays registered once
+    #   and is only unlinked by SharedNetwork.close in the parent
+    memory = shared_memory.SharedMemory(name=name)
+
+    arrays = {key: np.ndarray(shape, dtype=dtype, buffer=memory.buf, offset=offset)
+              for key, (dtype, shape, offset) in layout.items()}
+    for array in arrays.values():
+        array.flags.writeable = False
+    network, timetable = network_from_arrays(arrays, *meta, materialize=False)
+    return memory, network, timetable
+
+
+
+# Worker process state, set up once per worker by _init_worker
+_worker = {}
+
+
+def _init_worker(descriptor):
+    _worker['memory'], _worker['network'], _worker['timetable'] = attach_network(descriptor)
+
+
+def _search_task(task):
+    index, seeds, time_limit, engine, max_transfers, departure, bands, block_times, block_sums = task
+    return search_origin(_worker['network'], index, seeds, time_limit, engine, max_transfers,
+                         _worker['timetable'], departure, bands, block_times, block_sums)
+
+
+# Process pool whose workers attach to a SharedNetwork, for callers handing out searches one at a time
+#   (see submit_search) rather than as a batch
+def shared_executor(shared, workers):
+    return concurrent.futures.ProcessPoolExecutor(workers, mp_context=pool_context(), initializer=_init_worker,
+                                                  initargs=(shared.descriptor(),))
+
+
+# Submits a search_origin to a shared_executor, returning a concurrent.futures.Future of its OriginResult
+def submit_search(executor, index, seeds, time_limit, engine, max_transfers=None, departure=None, bands=None):
+    return executor.submit(_search_task, (index, seeds, time_limit, engine, max_transfers, departure, bands, False,
+                                          False))
+
+
+# Multiprocessing context for worker processes
+#   Inside QGIS sys.executable is the QGIS application rather than a Python interpreter,
+#   so spawned workers are pointed at the interpreter QGIS ships with
+def pool_context():
+    context = multiprocessing.get_context('spawn')
+    if not os.path.basename(sys.executable).lower().startswith('python'):
+        if os.name == 'nt':
+            context.set_executable(os.path.join(sys.exec_prefix, 'python.exe'))
+        else:
+            context.set_executable(os.path.join(sys.exec_prefix, 'bin', 'python3'))
+    return context
+
+
+# Searches from every origin (a list of (x, y) in the street graph's coordinates) on a pool of workers
+#   sharing one read-only copy of the network. Yields an OriginResult per origin in input order.
+#   Origins are snapped to the street graph together before any work is handed out.
+#   is_canceled is polled between results; progress is called with the fraction of origins done.
+#   block_times and block_sums are passed on to search_origin.
+def run_batch(network, origins, time_limit, engine, workers, max_transfers=None, timetable=None, departure=None,
+              bands=None, is_canceled=None, progress=None, block_times=False, block_sums=False):
+    shared = SharedNetwork(network, timetable)
+    try:
+        seeds = network.graph.snap_many([x for x, _ in origins], [y for _, y in origins])
+        tasks = [(index, origin_seeds, time_limit, engine, max_transfers, departure, bands, block_times, block_sums)
+                 for index, origin_seeds in enumerate(seeds)]
+        with pool_context().Pool(workers, initializer=_init_worker, initargs=(shared.descriptor(),)) as pool:
+            for done, result in enumerate(pool.imap(_search_task, tasks), start=1):
+                yield result
+                if progress:
+                    progress(done / len(tasks))
+                if is_canceled and is_canceled():
+                    pool.terminate()
+                    return
+    finally:
+        shared.close()
+
+
+# Yields an OriginResult for every origin (a list of (x, y) in the street graph's coordinates), in input order,
+#   searching in this process or, with more than one worker, on a pool of workers (see run_batch)
+def batch_results(network, origins, time_limit, engine, workers=1, max_transfers=None, timetable=None,
+                  departure=None, bands=None, is_canceled=None, progress=None, block_times=False, block_sums=False):
+    if workers > 1:
+        yield from run_batch(network, origins, time_limit, engine, workers, max_transfers, timetable, departure,
+                             bands, is_canceled, progress, block_times, block_sums)
+        return
+
+    seeds = network.graph.snap_many([x for x, _ in origins], [y for _, y in origins])
+    for index, origin_seeds in enumerate(seeds):
+        if is_canceled and is_canceled():
+            return
+        yield search_origin(network, index, origin_seeds, time_limit, engine, max_transfers, timetable, departure,
+                            bands, block_times, block_sums)
+        if progress:
+            progress((index + 1) / len(seeds))
@@ -0,0 +1,324 @@
+import argparse
+import collections
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from BatchSearch import pool_context, run_batch
+from GeoPackage import GeoPackageWriter
+from GtfsTimetable import load_gtfs_timetable, seconds_after_midnight
+from HeadlessEngine import HeadlessEngine, NetworkSources
+
+# Synthetic city sizes: (streets along each side of the grid, transit lines along each axis)
+city_sizes = {'small': (40, 2), 'medium': (100, 5), 'large': (200, 10)}
+street_spacing = 264  # feet between parallel streets, twenty blocks to the mile
+stop_spacing = 4  # streets between the stops of a transit line
+line_speeds = (40, 60, 80)  # KILO_FT_PER_HOUR, cycled over the lines
+line_trips = (4, 6, 12)  # TRIPS_PER_HOUR, cycled over the lines
+service_date = datetime.date(2024, 1, 3)
+departure_time = datetime.datetime(2024, 1, 3, 7, 0)
+
+scenarios = ['single', 'bands', 'batch']
+engines = ['raptor', 'timetable']
+band_fractions = (0.25, 0.5, 0.75, 1)  # time limits of the bands scenario, as fractions of the time limit
+
+# Engine counters making up an engine's expansions: the transit and walking searches it ran,
+#   the counterparts of the nodes the Dijkstra engine searches from
+expansion_counters = {'raptor': ('route_scans', 'transfer_walks'), 'timetable': ('trips_boarded', 'footpath_walks')}
+
+
+# Writes a synthetic city to a directory:
+#   city.gpkg       streets, trimet_route_stops, trimet_stops, trimet_routes and census_blocks_land_only
+#   gtfs/           a GTFS feed of the same lines, running every day of service_date's year
+def write_synthetic_city(directory, streets, lines, seed=0):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'city.gpkg')
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    writer = GeoPackageWriter(path, 2913)
+
+    def point(i, j):
+        return float(i * street_spacing), float(j * street_spacing)
+
+    writer.create_layer('streets', 'MULTILINESTRING', [])
+    writer.add_features('streets', ((None, ('MultiLineString', [[point(i, j), point(i + 1, j)]]))
+                                    for j in range(streets) for i in range(streets - 1)))
+    writer.add_features('streets', ((None, ('MultiLineString', [[point(i, j), point(i, j + 1)]]))
+                                    for i in range(streets) for j in range(streets - 1)))
+
+    # Lines run along evenly spaced rows and columns, with shared stops where they cross
+    positions = [int((k + 0.5) * streets / lines) for k in range(lines)]
+    routes = []
+    for k, j in enumerate(positions):
+        routes.append((100 + k, [(i, j) for i in range(streets)]))
+    for k, i in enumerate(positions):
+        routes.append((200 + k, [(i, j) for j in range(streets)]))
+
+    stop_ids = {}
+    route_stops = []
+    route_rows = []
+    for n, (rte, cells) in enumerate(routes):
+        speed = line_speeds[n % len(line_speeds)]
+        trips = line_trips[n % len(line_trips)]
+        for dir, ordered in ((0, cells), (1, cells[::-1])):
+            stops = [cell for m, cell in enumerate(ordered) if m % stop_spacing == 0 or m == len(ordered) - 1]
+            for cell in stops:
+                stop_ids.setdefault(cell, 10000 + len(stop_ids))
+                route_stops.append((cell, stop_ids[cell], rte, dir))
+            route_rows.append((rte, dir, speed, trips, [point(*cell) for cell in ordered], stops))
+
+    writer.create_layer('trimet_stops', 'POINT', [('stop_id', 'INTEGER')])
+    writer.add_features('trimet_stops', ((None, ('Point', point(*cell)), stop_id) for cell, stop_id in stop_ids.items()))
+    writer.create_layer('trimet_route_stops', 'POINT', [('stop_id', 'INTEGER'), ('rte', 'INTEGER'), ('dir', 'INTEGER')])
+    writer.add_features('trimet_route_stops', ((None, ('Point', point(*cell)), stop_id, rte, dir)
+                                               for cell, stop_id, rte, dir in route_stops))
+    writer.create_layer('trimet_routes', 'MULTILINESTRING', [('rte', 'INTEGER'), ('dir', 'INTEGER'),
+                                                             ('KILO_FT_PER_HOUR', 'REAL'), ('TRIPS_PER_HOUR', 'REAL')])
+    writer.add_features('trimet_routes', ((None, ('MultiLineString', [line]), rte, dir, speed, trips)
+                                          for rte, dir, speed, trips, line, _ in route_rows))
+
+    # One census block inside every square of the grid
+    inset = 5
+    writer.create_layer('census_blocks_land_only', 'MULTIPOLYGON', [('GEOID10', 'TEXT'), ('POP10', 'INTEGER')])
+    writer.add_features('census_blocks_land_only', (
+        (None, ('MultiPolygon', [[[(x + inset, y + inset), (x + street_spacing - inset, y + inset),
+                                   (x + street_spacing - inset, y + street_spacing - inset),
+                                   (x + inset, y + street_spacing - inset), (x + inset, y + inset)]]]),
+         f"41051{block:010d}", rng.randint(0, 200))
+        for block, (x, y) in enumerate(point(i, j) for j in range(streets - 1) for i in range(streets - 1))))
+    writer.close()
+
+    write_synthetic_gtfs(os.path.join(directory, 'gtfs'), stop_ids, route_rows)
+
+
+# GTFS feed of the synthetic lines, with trips from 05:00 to 10:00 at each line's speed and frequency
+def write_synthetic_gtfs(directory, stop_ids, route_rows):
+    os.makedirs(directory, exist_ok=True)
+
+    def write(name, header, rows):
+        with open(os.path.join(directory, name), 'w', newline='', encoding='utf-8') as f:
+            f.write(','.join(header) + '\n')
+            for row in rows:
+                f.write(','.join(str(value) for value in row) + '\n')
+
+    def clock(seconds):
+        return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+    write('stops.txt', ['stop_id', 'stop_name', 'stop_lat', 'stop_lon'],
+          [(stop_id, stop_id, 0, 0) for stop_id in stop_ids.values()])
+    write('routes.txt', ['route_id', 'route_short_name', 'route_type'],
+          sorted({(rte, rte, 3) for rte, *_ in route_rows}))
+    write('calendar.txt', ['service_id', 'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday',
+                           'sunday', 'start_date', 'end_date'],
+          [('all', 1, 1, 1, 1, 1, 1, 1, f"{service_date.year}0101", f"{service_date.year}1231")])
+
+    trips = []
+    stop_times = []
+    for rte, dir, speed, trips_per_hour, line, stops in route_rows:
+        start = line[0]
+        offsets = [round(math.hypot(stop[0] * street_spacing - start[0], stop[1] * street_spacing - start[1])
+                         / (speed * 1000) * 3600) for stop in stops]
+        headway = round(3600 / trips_per_hour)
+        for departure in range(5 * 3600, 10 * 3600, headway):
+            trip_id = f"{rte}_{dir}_{departure}"
+            trips.append((rte, 'all', trip_id, dir))
+            for sequence, (stop, offset) in enumerate(zip(stops, offsets)):
+                stop_times.append((trip_id, clock(departure + offset), clock(departure + offset),
+                                   stop_ids[stop], sequence))
+    write('trips.txt', ['route_id', 'service_id', 'trip_id', 'direction_id'], trips)
+    write('stop_times.txt', ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence'], stop_times)
+
+
+def city_sources(directory):
+    path = os.path.join(directory, 'city.gpkg')
+    return NetworkSources(streets=(path, 'streets'), route_stops=(path, 'trimet_route_stops'),
+                          stops=(path, 'trimet_stops'), routes=(path, 'trimet_routes'),
+                          blocks=(path, 'census_blocks_land_only'))
+
+
+def city_engine(directory):
+    return HeadlessEngine(city_sources(directory), os.path.join(directory, 'network_cache'))
+
+
+# Origins spread at random over a city of the given number of streets, the same for every run
+def city_origins(streets, count, seed=1):
+    rng = random.Random(seed)
+    extent = (streets - 1) * street_spacing
+    return [(rng.uniform(0, extent), rng.uniform(0, extent)) for _ in range(count)]
+
+
+
+# Runs one scenario in the current process, returning its measurements
+#   single: one search per origin per repeat
+#   bands:  as single, with service areas for each fraction of the time limit in band_fractions
+#   batch:  one run_batch over every origin per repeat, on workers processes
+def run_scenario(directory, scenario, engine_name, minutes, origins, repeats, workers):
+    start_time = time.perf_counter()
+    engine = city_engine(directory)
+    network = engine.network()
+    engine.block_index()
+    timetable = None
+    departure = None
+    if engine_name == 'timetable':
+        timetable = load_gtfs_timetable(os.path.join(directory, 'gtfs'), service_date)
+        departure = seconds_after_midnight(departure_time)
+    load_seconds = time.perf_counter() - start_time
+
+    time_limit = minutes / 60
+    bands = [time_limit * f for f in band_fractions] if scenario == 'bands' else None
+    walls = []
+    counters = collections.Counter()
+    searches = 0
+    blocks = 0
+    for _ in range(repeats):
+        if scenario == 'batch':
+            start_time = time.perf_counter()
+            for result in run_batch(network, origins, time_limit, engine_name, workers, timetable=timetable,
+                                    departure=departure):
+                counters.update(result.counters)
+                searches += 1
+            walls.append(time.perf_counter() - start_time)
+            continue
+        for x, y in origins:
+            start_time = time.perf_counter()
+            result, reached = engine.search(x, y, time_limit, engine_name, bands, timetable=timetable,
+                                            departure=departure, network=network)
+            walls.append(time.perf_counter() - start_time)
+            counters.update(result.counters)
+            searches += 1
+            blocks += len(reached[-1][1])
+    engine.close()
+
+    expansions = sum(counters[name] for name in expansion_counters[engine_name])
+    return {
+        'load_seconds': load_seconds,
+        'wall_seconds': {'min': min(walls), 'median': statistics.median(walls), 'mean': statistics.mean(walls),
+                         'max': max(walls), 'total': sum(walls), 'count': len(walls)},
+        'searches': searches,
+        'expansions': expansions,
+        'expansions_per_search': expansions / searches if searches else 0,
+        'repeat_walks': counters['repeat_walks'],
+        'counters': dict(counters),
+        'blocks_reached_per_search': blocks / searches if searches and scenario != 'batch' else None,
+        'peak_rss_bytes': peak_rss(),
+        'workers_peak_rss_bytes': peak_rss(children=True) if scenario == 'batch' else None,
+    }
+
+
+def _scenario_process(queue, *args):
+    try:
+        queue.put(run_scenario(*args))
+    except Exception as e:
+        queue.put({'error': f"{type(e).__name__}: {e}"})
+
+
+# Runs a scenario in a fresh process, so its peak memory is not that of earlier scenarios
+def run_scenario_process(*args):
+    context = pool_context()
+    queue = context.Queue()
+    process = context.Process(target=_scenario_process, args=(queue, *args))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+# Peak resident memory of this process (or of its largest finished child) in bytes,
+#   or None where the resource module is missing (Windows)
+def peak_rss(children=False):
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    return usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+
+# Adds the speedup over a baseline run to each result with a matching size, scenario and engine
+def compare_with_baseline(results, baseline):
+    previous = {(r['size'], r['scenario'], r['engine']): r for r in baseline.get('results', []) if 'wall_seconds' in r}
+    for result in results:
+        match = previous.get((result['size'], result['scenario'], result['engine']))
+        if match is None or 'wall_seconds' not in result:
+            continue
+        result['baseline_median_seconds'] = match['wall_seconds']['median']
+        result['speedup'] = match['wall_seconds']['median'] / result['wall_seconds']['median']
+
+
+# Performance benchmarks on synthetic cities, run without QGIS
+#   Each city is a square street grid with transit lines along some of its rows and columns,
+#   written as the GeoPackage layers (and GTFS feed) the tools read, so every benchmark runs the
+#   same code a real project does. Every scenario runs in a fresh process so its peak memory is its own.
+#   Results are printed as JSON, and can be compared with an earlier run given as a baseline.
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Search benchmarks on synthetic cities, without QGIS')
+    parser.add_argument('--sizes', nargs='+', choices=list(city_sizes), default=['small', 'medium'])
+    parser.add_argument('--scenarios', nargs='+', choices=scenarios, default=scenarios)
+    parser.add_argument('--engines', nargs='+', choices=engines, default=engines)
+    parser.add_argument('--minutes', type=float, default=30, help='search time limit in minutes')
+    parser.add_argument('--origins', type=int, default=10, help='origins searched per repeat')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=2, help='worker processes of the batch scenario')
+    parser.add_argument('--directory', default=os.path.join(tempfile.gettempdir(), 'transit_benchmark'),
+                        help='where the synthetic cities are written and kept between runs')
+    parser.add_argument('--rebuild', action='store_true', help='write the synthetic cities again')
+    parser.add_argument('--baseline', help='JSON output of an earlier run to compare with')
+    parser.add_argument('--output', help='file to write the JSON results to (default: standard output)')
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        streets, lines = city_sizes[size]
+        directory = os.path.join(args.directory, size)
+        if args.rebuild or not os.path.exists(os.path.join(directory, 'city.gpkg')):
+            print(f"Writing the {size} city", file=sys.stderr)
+            write_synthetic_city(directory, streets, lines)
+
+        # Structures are built (or loaded) once up front, so scenarios load them from the network cache
+        start_time = time.perf_counter()
+        engine = city_engine(directory)
+        network = engine.network()
+        engine.block_index()
+        prepare_seconds = time.perf_counter() - start_time
+        city = {'streets': streets, 'lines': lines, 'vertices': network.graph.vertex_count(),
+                'edges': network.graph.edge_count(), 'patterns': network.patterns.pattern_count(),
+                'prepare_seconds': prepare_seconds}
+        engine.close()
+
+        origins = city_origins(streets, args.origins)
+        for scenario in args.scenarios:
+            for engine_name in args.engines:
+                print(f"Running {scenario} {engine_name} on the {size} city", file=sys.stderr)
+                result = {'size': size, 'scenario': scenario, 'engine': engine_name, 'city': city,
+                          'minutes': args.minutes, 'origins': len(origins), 'repeats': args.repeats,
+                          'workers': args.workers if scenario == 'batch' else 1}
+                result.update(run_scenario_process(directory, scenario, engine_name, args.minutes, origins,
+                                                   args.repeats, args.workers))
+                results.append(result)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare_with_baseline(results, json.load(f))
+
+    report = {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(), 'platform': platform.platform(),
+              'cpus': os.cpu_count(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
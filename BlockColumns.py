@@ -0,0 +1,36 @@
+import numpy as np
+
+default_fields = ['POP10', 'HU10']
+
+
+# Numeric fields of the census blocks held as a column store, for summing over the blocks an origin reaches
+#   Stored as arrays:
+#       fids        block fid of each row, ascending, as the columns of BlockReach
+#       values      (block, field) values as float64, with missing values as 0
+#       names       field names, in column order
+class BlockColumns:
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.fids = arrays['fids']
+        self.values = arrays['values']
+        self.names = arrays['names'].tolist()
+
+    # Sums of every field over the blocks reached within each limit, as a (limit, field) array,
+    #   and the number of blocks reached within each limit
+    #   block_distances is the walking distance at which each block is reached (see BlockReach.block_distances)
+    def sums_within(self, block_distances, limits):
+        reached = block_distances[None, :] <= np.asarray(limits, dtype=np.float64)[:, None]
+        return reached.astype(np.float64) @ self.values, reached.sum(axis=1)
+
+
+# Builds BlockColumns from (fid, {field: value}) of every census block
+def build_block_columns(rows, names):
+    rows = sorted(rows, key=lambda row: row[0])
+    values = np.zeros((len(rows), len(names)), dtype=np.float64)
+    for i, (_, fields) in enumerate(rows):
+        values[i] = [fields[name] or 0 for name in names]
+    return BlockColumns({
+        'fids': np.array([fid for fid, _ in rows], dtype=np.int64),
+        'values': values,
+        'names': np.array(names, dtype=np.str_),
+    })
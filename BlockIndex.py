@@ -0,0 +1,328 @@
+import numpy as np
+
+unreached_minutes = np.iinfo(np.uint16).max  # travel time matrix entry of blocks not reached within the time limit
+
+
+# Census blocks within a fixed distance of every street graph edge
+#   Stored as one CSR structure over the edges:
+#       offsets     edge e is near blocks[offsets[e]:offsets[e + 1]]
+#       blocks      fids of the blocks near each edge, ascending within a row
+#       distance    the distance the index was built with
+class BlockIndex:
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.offsets = arrays['offsets']
+        self.blocks = arrays['blocks']
+        self.distance = float(arrays['distance'][0])
+
+    def blocks_near(self, edge):
+        return self.blocks[self.offsets[edge]:self.offsets[edge + 1]].tolist()
+
+    # Fids of every block near any of the edges, ascending and without repeats
+    def blocks_near_edges(self, edges):
+        edges = np.asarray(edges, dtype=np.int64)
+        starts = self.offsets[edges]
+        counts = self.offsets[edges + 1] - starts
+        if not counts.sum():
+            return np.empty(0, dtype=self.blocks.dtype)
+        # Position of every block in every row, without a Python loop over the edges
+        row_starts = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        return np.unique(self.blocks[row_starts + np.arange(counts.sum())])
+
+
+
+# (edge, block fid) for every street graph edge within distance of a block
+#   polygons: iterable of (fid, [polygon, ...]) with each polygon a list of rings of (x, y)
+#   Candidate edges are taken from the graph's snap grid cells under each block's bounding box
+def edge_block_pairs(graph, polygons, distance):
+    min_x, min_y, cell_size, nx, ny = graph.arrays['grid_meta'].tolist()
+    nx = int(nx)
+    ny = int(ny)
+    offsets = graph.arrays['grid_offsets']
+    grid_edges = graph.arrays['grid_edges']
+    pairs = []
+    if nx == 0 or ny == 0:
+        return pairs
+
+    for fid, parts in polygons:
+        rings = ring_segments(parts)
+        if not len(rings[0]):
+            continue
+        cx1 = max(int((min(rings[0].min(), rings[2].min()) - distance - min_x) // cell_size), 0)
+        cx2 = min(int((max(rings[0].max(), rings[2].max()) + distance - min_x) // cell_size), nx - 1)
+        cy1 = max(int((min(rings[1].min(), rings[3].min()) - distance - min_y) // cell_size), 0)
+        cy2 = min(int((max(rings[1].max(), rings[3].max()) + distance - min_y) // cell_size), ny - 1)
+        if cx1 > cx2 or cy1 > cy2:
+            continue
+        cells = [grid_edges[offsets[cy * nx + cx]:offsets[cy * nx + cx + 1]]
+                 for cy in range(cy1, cy2 + 1) for cx in range(cx1, cx2 + 1)]
+        candidates = np.unique(np.concatenate(cells))
+        if not len(candidates):
+            continue
+        near = segments_near_rings(*edge_coordinates(graph, candidates), rings, distance)
+        pairs.extend((edge, fid) for edge in candidates[near].tolist())
+    return pairs
+
+
+# (x1, y1, x2, y2) arrays of the full length of the given edges
+def edge_coordinates(graph, edges):
+    u = graph.edge_u[edges]
+    v = graph.edge_v[edges]
+    return graph.x[u], graph.y[u], graph.x[v], graph.y[v]
+
+
+# (x1, y1, x2, y2) arrays of every boundary segment of a list of polygons
+def ring_segments(parts):
+    segments = []
+    for rings in parts:
+        for ring in rings:
+            coords = np.asarray(ring, dtype=np.float64).reshape(-1, 2)
+            if len(coords) > 1:
+                segments.append(np.hstack((coords[:-1], coords[1:])))
+    if not segments:
+        return tuple(np.empty(0) for _ in range(4))
+    segments = np.vstack(segments)
+    return segments[:, 0], segments[:, 1], segments[:, 2], segments[:, 3]
+
+
+# Whether each segment (x1, y1)-(x2, y2) lies within distance of polygons given by their boundary segments
+#   A segment is within distance if it comes that close to a boundary, or lies inside a polygon
+def segments_near_rings(x1, y1, x2, y2, rings, distance, chunk=256):
+    rx1, ry1, rx2, ry2 = (r[None, :] for r in rings)
+    near = np.zeros(len(x1), dtype=bool)
+    for start in range(0, len(x1), chunk):
+        part = slice(start, start + chunk)
+        ax1, ay1, ax2, ay2 = (a[part, None] for a in (x1, y1, x2, y2))
+        gap = np.minimum(np.minimum(_point_segment_distance(ax1, ay1, rx1, ry1, rx2, ry2),
+                                    _point_segment_distance(ax2, ay2, rx1, ry1, rx2, ry2)),
+                         np.minimum(_point_segment_distance(rx1, ry1, ax1, ay1, ax2, ay2),
+                                    _point_segment_distance(rx2, ry2, ax1, ay1, ax2, ay2)))
+        crossing = _segments_cross(ax1, ay1, ax2, ay2, rx1, ry1, rx2, ry2)
+        gap = np.where(crossing, 0.0, gap).min(axis=1)
+
+        # Even-odd rule over every ring: a segment clear of the boundary is inside if either end is
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crosses_ray = ((ry1 > ay1) != (ry2 > ay1)) & (ax1 < (rx2 - rx1) * (ay1 - ry1) / (ry2 - ry1) + rx1)
+        inside = crosses_ray.sum(axis=1) % 2 == 1
+        near[part] = (gap <= distance) | inside
+    return near
+
+
+def _point_segment_distance(px, py, x1, y1, x2, y2):
+    dx = x2 - x1
+    dy = y2 - y1
+    length_sq = dx * dx + dy * dy
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(length_sq > 0, ((px - x1) * dx + (py - y1) * dy) / length_sq, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    return np.hypot(px - (x1 + dx * t), py - (y1 + dy * t))
+
+
+def _segments_cross(ax1, ay1, ax2, ay2, bx1, by1, bx2, by2):
+    d1 = (bx2 - bx1) * (ay1 - by1) - (by2 - by1) * (ax1 - bx1)
+    d2 = (bx2 - bx1) * (ay2 - by1) - (by2 - by1) * (ax2 - bx1)
+    d3 = (ax2 - ax1) * (by1 - ay1) - (ay2 - ay1) * (bx1 - ax1)
+    d4 = (ax2 - ax1) * (by2 - ay1) - (ay2 - ay1) * (bx2 - ax1)
+    return (d1 * d2 < 0) & (d3 * d4 < 0)
+
+
+
+# Builds a BlockIndex over edge_count edges from (edge, block fid) pairs
+def build_block_index(edge_blocks, edge_count, distance):
+    pairs = np.array(sorted(set(edge_blocks)), dtype=np.int64).reshape(-1, 2)
+    offsets = np.zeros(edge_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pairs[:, 0], minlength=edge_count), out=offsets[1:])
+    return BlockIndex({
+        'offsets': offsets,
+        'blocks': pairs[:, 1].copy(),
+        'distance': np.array([distance], dtype=np.float64),
+    })
+
+
+
+# Earliest walking distance at which each census block is reached, for a travel time matrix
+#   A block is reached once any part of a street edge within the index distance of it is reached (as in
+#   HeadlessEngine.reached_blocks); for each such (edge, block) pair, the part of the edge near the block
+#   starts from_u along the edge from edge_u and ends from_v before edge_v, so the block is reached
+#   at min(distance to edge_u + from_u, distance to edge_v + from_v)
+#   Stored as arrays, with pairs grouped by column:
+#       fids            block fid of each column, ascending, including blocks near no edge
+#       pair_edges      edge of each pair
+#       pair_from_u     distance along the edge from edge_u to the first point near the block
+#       pair_from_v     distance along the edge from edge_v to the last point near the block
+#       column_starts   column c's pairs are pair_*[column_starts[c]:column_starts[c + 1]]
+class BlockReach:
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.fids = arrays['fids']
+        self.pair_edges = arrays['pair_edges']
+        self.pair_from_u = arrays['pair_from_u']
+        self.pair_from_v = arrays['pair_from_v']
+        self.column_starts = arrays['column_starts']
+
+    def column_count(self):
+        return len(self.fids)
+
+    # Walking distance at which each block is reached, given an array of the distance to every graph
+    #   vertex (inf where unreached), or inf for blocks beyond max_distance
+    def block_distances(self, graph, vertex_distances, max_distance):
+        edges = self.pair_edges
+        reached = np.minimum(vertex_distances[graph.edge_u[edges]] + self.pair_from_u,
+                             vertex_distances[graph.edge_v[edges]] + self.pair_from_v)
+        distances = np.full(len(self.fids), np.inf)
+        counts = np.diff(self.column_starts)
+        columns = np.flatnonzero(counts)
+        if len(columns):
+            distances[columns] = np.minimum.reduceat(reached, self.column_starts[columns])
+        distances[distances > max_distance] = np.inf
+        return distances
+
+    # block_distances along with the label of the source each block is reached from first, or -1,
+    #   given the labels of every graph vertex (see StreetGraph.source_array)
+    def block_sources(self, graph, vertex_distances, vertex_sources, max_distance):
+        distances = self.block_distances(graph, vertex_distances, max_distance)
+        edges = self.pair_edges
+        u = graph.edge_u[edges]
+        v = graph.edge_v[edges]
+        via_u = vertex_distances[u] + self.pair_from_u
+        via_v = vertex_distances[v] + self.pair_from_v
+        pair_sources = np.where(via_u <= via_v, vertex_sources[u], vertex_sources[v])
+        pair_columns = np.repeat(np.arange(len(self.fids)), np.diff(self.column_starts))
+        first = np.isfinite(distances[pair_columns]) & (np.minimum(via_u, via_v) == distances[pair_columns])
+        sources = np.full(len(self.fids), -1, dtype=np.int64)
+        sources[pair_columns[first]] = pair_sources[first]
+        return distances, sources
+
+    # Minutes after which each block is reached, rounded up, as uint16 with unreached_minutes
+    #   for blocks beyond max_distance; distances walk at walk_speed graph units per hour
+    #   A block is within a time limit of m whole minutes exactly when its minutes are at most m
+    def block_minutes(self, graph, vertex_distances, max_distance, walk_speed):
+        minutes = self.block_distances(graph, vertex_distances, max_distance) * (60 / walk_speed)
+        reached = np.isfinite(minutes)
+        # Times a hair over a whole minute from floating point error round down to it
+        rounded = np.ceil(np.where(reached, minutes, 0) - 1e-9)
+        return np.where(reached, np.clip(rounded, 0, unreached_minutes - 1), unreached_minutes).astype(np.uint16)
+
+
+
+# Builds a BlockReach from a BlockIndex and the polygons of every census block
+#   polygons: iterable of (fid, [polygon, ...]) as for edge_block_pairs, in the street graph's crs
+def build_block_reach(graph, index, polygons):
+    counts = np.diff(index.offsets)
+    pair_edges = np.repeat(np.arange(len(counts), dtype=np.int64), counts)
+    by_block = np.argsort(index.blocks, kind='stable')
+    block_fids = index.blocks[by_block]
+    block_edges = pair_edges[by_block]
+
+    fids = []
+    edges = []
+    from_u = []
+    from_v = []
+    column_starts = [0]
+    for fid, parts in sorted(polygons, key=lambda block: block[0]):
+        fids.append(fid)
+        lo, hi = np.searchsorted(block_fids, [fid, fid + 1])
+        near = block_edges[lo:hi]
+        rings = ring_segments(parts)
+        if len(near) and len(rings[0]):
+            starts, ends = near_spans(*edge_coordinates(graph, near), rings, index.distance)
+            keep = starts <= ends
+            length = graph.edge_length[near[keep]]
+            edges.append(near[keep])
+            from_u.append(starts[keep] * length)
+            from_v.append((1 - ends[keep]) * length)
+            column_starts.append(column_starts[-1] + int(keep.sum()))
+        else:
+            column_starts.append(column_starts[-1])
+
+    def joined(parts, dtype):
+        return np.concatenate(parts).astype(dtype) if parts else np.empty(0, dtype=dtype)
+
+    return BlockReach({
+        'fids': np.array(fids, dtype=np.int64),
+        'pair_edges': joined(edges, np.int64),
+        'pair_from_u': joined(from_u, np.float64),
+        'pair_from_v': joined(from_v, np.float64),
+        'column_starts': np.array(column_starts, dtype=np.int64),
+    })
+
+
+# (start, end) as fractions along each segment (x1, y1)-(x2, y2) of the part of it within distance
+#   of polygons given by their boundary segments, with start > end for segments nowhere near them
+#   The points of a segment within distance of one boundary segment form a single interval, as a line meets
+#   the convex region around a boundary segment in one piece; the first and last point near the polygons
+#   are the earliest start and latest end over every boundary segment, or the segment's ends if inside.
+#   Every ring vertex starts a boundary segment, so only the circles around segment starts are tested.
+def near_spans(x1, y1, x2, y2, rings, distance, chunk=256):
+    rx1, ry1, rx2, ry2 = (r[None, :] for r in rings)
+    sx = rx2 - rx1
+    sy = ry2 - ry1
+    side = np.hypot(sx, sy)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ex = np.where(side > 0, sx / side, 0.0)
+        ey = np.where(side > 0, sy / side, 0.0)
+
+    starts = np.full(len(x1), np.inf)
+    ends = np.full(len(x1), -np.inf)
+    for first in range(0, len(x1), chunk):
+        part = slice(first, first + chunk)
+        ax, ay, bx, by = (a[part, None] for a in (x1, y1, x2, y2))
+        dx = bx - ax
+        dy = by - ay
+
+        # Circle of radius distance around each boundary segment's start
+        fx = ax - rx1
+        fy = ay - ry1
+        qa = dx * dx + dy * dy
+        qb = 2 * (dx * fx + dy * fy)
+        qc = fx * fx + fy * fy - distance * distance
+        with np.errstate(divide='ignore', invalid='ignore'):
+            root = np.sqrt(np.maximum(qb * qb - 4 * qa * qc, 0.0))
+            circle_lo = np.where(qa > 0, (-qb - root) / (2 * qa), np.where(qc <= 0, 0.0, np.inf))
+            circle_hi = np.where(qa > 0, (-qb + root) / (2 * qa), np.where(qc <= 0, 1.0, -np.inf))
+        missed = (qa > 0) & (qb * qb - 4 * qa * qc < 0)
+        circle_lo = np.where(missed, np.inf, circle_lo)
+        circle_hi = np.where(missed, -np.inf, circle_hi)
+
+        # Band of half width distance alongside each boundary segment
+        u0 = fx * ex + fy * ey
+        du = dx * ex + dy * ey
+        v0 = fx * -ey + fy * ex
+        dv = dx * -ey + dy * ex
+        band_lo, band_hi = _slab(u0, du, 0.0, side)
+        lo, hi = _slab(v0, dv, -distance, distance)
+        band_lo = np.maximum(band_lo, lo)
+        band_hi = np.where(side > 0, np.minimum(band_hi, hi), -np.inf)
+
+        circle = (circle_lo <= 1) & (circle_hi >= 0) & (circle_lo <= circle_hi)
+        band = (band_lo <= 1) & (band_hi >= 0) & (band_lo <= band_hi)
+        lo = np.minimum(np.where(circle, np.maximum(circle_lo, 0.0), np.inf),
+                        np.where(band, np.maximum(band_lo, 0.0), np.inf))
+        hi = np.maximum(np.where(circle, np.minimum(circle_hi, 1.0), -np.inf),
+                        np.where(band, np.minimum(band_hi, 1.0), -np.inf))
+        starts[part] = lo.min(axis=1)
+        ends[part] = hi.max(axis=1)
+
+        # Segments starting or ending inside a polygon are near it from that end
+        starts[part] = np.where(_inside(ax, ay, rx1, ry1, rx2, ry2), 0.0, starts[part])
+        ends[part] = np.where(_inside(bx, by, rx1, ry1, rx2, ry2), 1.0, ends[part])
+    return starts, ends
+
+
+# Interval of t where lo <= start + t * step <= hi, as (t lo, t hi) arrays, empty when t lo > t hi
+def _slab(start, step, lo, hi):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t1 = (lo - start) / step
+        t2 = (hi - start) / step
+    flat = step == 0
+    inside = (start >= lo) & (start <= hi)
+    t_lo = np.where(flat, np.where(inside, -np.inf, np.inf), np.minimum(t1, t2))
+    t_hi = np.where(flat, np.where(inside, np.inf, -np.inf), np.maximum(t1, t2))
+    return t_lo, t_hi
+
+
+# Whether each point lies inside the polygons given by their boundary segments, by the even-odd rule
+def _inside(px, py, rx1, ry1, rx2, ry2):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crosses_ray = ((ry1 > py) != (ry2 > py)) & (px < (rx2 - rx1) * (py - ry1) / (ry2 - ry1) + rx1)
+    return crosses_ray.sum(axis=1) % 2 == 1
@@ -0,0 +1,95 @@
+import argparse
+import csv
+import datetime
+import os
+import time
+
+from BatchSearch import batch_results
+from BlockColumns import default_fields
+from GtfsTimetable import load_gtfs_timetable, runs_past_midnight, seconds_after_midnight
+from HeadlessEngine import HeadlessEngine, project_sources
+from TravelTimeMatrix import read_origins
+
+
+# Table of the census block sums of many origins, written to a CSV file one row per origin and time limit:
+#   origin, minutes, blocks (the number of blocks reached), then the sum of each field
+class SumsWriter:
+    def __init__(self, path, names):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(['origin', 'minutes', 'blocks'] + list(names))
+        self.written = 0
+
+    # sums and counts are as returned by BlockColumns.sums_within for bands (hours)
+    def add(self, origin, bands, sums, counts):
+        for band, band_sums, count in zip(bands, sums.tolist(), counts.tolist()):
+            self.writer.writerow([origin, band * 60, count] + [_number(value) for value in band_sums])
+        self.written += 1
+
+    def close(self):
+        self.file.close()
+
+
+# Whole numbers without a trailing .0, as sums of counts such as POP10 are
+def _number(value):
+    return int(value) if value.is_integer() else value
+
+
+# Writes the sums of the network's block_columns over the census blocks each origin reaches within each band
+#   to a CSV file (see SumsWriter); origins is a list of (name, x, y) in the street graph's crs
+#   network must have been built with its block_reach and block_columns; see batch_results for the other arguments
+#   Returns the number of origins written
+def write_block_sums(path, network, origins, bands, engine, workers=1, max_transfers=None, timetable=None,
+                     departure=None, is_canceled=None, progress=None):
+    writer = SumsWriter(path, network.block_columns.names)
+    try:
+        for result in batch_results(network, [(x, y) for _, x, y in origins], bands[-1], engine, workers,
+                                    max_transfers, timetable, departure, bands, is_canceled, progress,
+                                    block_sums=True):
+            writer.add(origins[result.index][0], bands, *result.block_sums)
+    finally:
+        writer.close()
+    return writer.written
+
+
+
+# Command line entry point: writes the block sums of the origins in a CSV file
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Census block fields reachable from many origins, without QGIS')
+    parser.add_argument('origins', help='CSV file of origins with name, x and y columns, in the street layer crs')
+    parser.add_argument('output', help='CSV file to write the sums to')
+    parser.add_argument('minutes', type=float, nargs='+', help='one or more time limits in minutes')
+    parser.add_argument('--fields', default=','.join(default_fields),
+                        help='comma separated census block fields to sum (default: %(default)s)')
+    parser.add_argument('--project', default='.', help='directory holding the project GeoPackages')
+    parser.add_argument('--cache', help='network cache directory (default: network_cache in the project directory)')
+    parser.add_argument('--engine', choices=['raptor', 'timetable'], default='raptor')
+    parser.add_argument('--max-transfers', type=int)
+    parser.add_argument('--gtfs', help='GTFS feed directory or zip (timetable engine)')
+    parser.add_argument('--departure', help='departure as YYYY-MM-DDTHH:MM:SS (timetable engine)')
+    parser.add_argument('--workers', type=int, default=1, help='search worker processes')
+    args = parser.parse_args(argv)
+
+    timetable = None
+    departure = None
+    if args.engine == 'timetable':
+        if not args.gtfs or not args.departure:
+            parser.error('the timetable engine needs --gtfs and --departure')
+        moment = datetime.datetime.fromisoformat(args.departure)
+        departure = seconds_after_midnight(moment)
+        timetable = load_gtfs_timetable(args.gtfs, moment.date(), runs_past_midnight(departure, max(args.minutes) / 60))
+
+    engine = HeadlessEngine(project_sources(args.project), args.cache or os.path.join(args.project, 'network_cache'))
+    fields = [field.strip() for field in args.fields.split(',') if field.strip()]
+    origins = read_origins(args.origins)
+    bands = sorted(m / 60 for m in args.minutes)
+    start_time = time.perf_counter()
+    written = write_block_sums(args.output, engine.network(blocks=True, block_fields=fields), origins, bands,
+                               args.engine, args.workers, args.max_transfers, timetable, departure)
+    print(f"Wrote the sums of {', '.join(fields)} for {written} origins to {args.output} "
+          f"in {time.perf_counter() - start_time:.1f}s")
+    engine.close()
+
+
+if __name__ == '__main__':
+    main()
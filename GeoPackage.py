@@ -0,0 +1,334 @@
+import hashlib
+import itertools
+import sqlite3
+import struct
+
+import numpy as np
+
+
+# Read-only access to the vector layers of a GeoPackage through plain SQLite, without QGIS
+#   (see GeoPackageWriter for writing them)
+#   Geometries are decoded from the GeoPackage binary format into nested coordinate lists:
+#       ('Point', (x, y))
+#       ('LineString', [(x, y), ...])
+#       ('Polygon', [ring, ...])                    rings are lists of (x, y), the exterior first
+#       ('MultiPoint' | 'MultiLineString' | 'MultiPolygon', [part, ...])
+#   Z and M values are dropped. Feature ids are the layer's primary key, as QGIS reports them.
+#   The connection may be used from any thread, one thread at a time.
+class GeoPackage:
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+    def close(self):
+        self.connection.close()
+
+    # (geometry column, srs_id) of a layer
+    def geometry_column(self, layer):
+        row = self.connection.execute("SELECT column_name, srs_id FROM gpkg_geometry_columns "
+                                      "WHERE table_name = ?", (layer,)).fetchone()
+        if row is None:
+            raise ValueError(f"{self.path} has no vector layer named {layer}")
+        return row
+
+    # "AUTHORITY:CODE" of a layer's spatial reference system, such as "EPSG:2913"
+    def authid(self, layer):
+        srs_id = self.geometry_column(layer)[1]
+        row = self.connection.execute("SELECT organization, organization_coordsys_id FROM gpkg_spatial_ref_sys "
+                                      "WHERE srs_id = ?", (srs_id,)).fetchone()
+        if row is None:
+            return f"EPSG:{srs_id}"
+        return f"{row[0].upper()}:{row[1]}"
+
+    # WKT definition of a layer's spatial reference system, or 'undefined'
+    def srs_definition(self, layer):
+        srs_id = self.geometry_column(layer)[1]
+        row = self.connection.execute("SELECT definition FROM gpkg_spatial_ref_sys WHERE srs_id = ?",
+                                      (srs_id,)).fetchone()
+        return row[0] if row and row[0] else 'undefined'
+
+    def field_names(self, layer):
+        return [name for _, name, _, _, _, _ in self.connection.execute(f"PRAGMA table_info({_quote(layer)})")]
+
+    # (name, SQLite type) of a layer's attribute fields, without its primary key and geometry column
+    def fields(self, layer):
+        skipped = {self.primary_key(layer), self.geometry_column(layer)[0]}
+        columns = self.connection.execute(f"PRAGMA table_info({_quote(layer)})")
+        return [(name, kind) for _, name, kind, _, _, _ in columns if name not in skipped]
+
+    # SHA-1 of a layer's contents: its spatial reference system, its fields and every row in fid order
+    #   Unlike a checksum of the whole file, it is unchanged by edits to the package's other layers
+    def layer_checksum(self, layer):
+        digest = hashlib.sha1()
+        digest.update(self.srs_definition(layer).encode())
+        digest.update(repr(self.field_names(layer)).encode())
+        for row in self.connection.execute(f"SELECT * FROM {_quote(layer)} ORDER BY {_quote(self.primary_key(layer))}"):
+            for value in row:
+                digest.update(bytes(value) if isinstance(value, (bytes, memoryview)) else repr(value).encode())
+        return digest.hexdigest()
+
+    def primary_key(self, layer):
+        for _, name, _, _, _, pk in self.connection.execute(f"PRAGMA table_info({_quote(layer)})"):
+            if pk:
+                return name
+        return 'rowid'
+
+    # Yields (fid, geometry, {field: value}) for the features of a layer in fid order
+    #   fids, if given, restricts the features read to those fids
+    #   wkb returns each geometry as its WKB, without decoding it
+    def features(self, layer, fields=(), geometry=True, fids=None, wkb=False):
+        columns = [_quote(self.primary_key(layer))]
+        if geometry:
+            columns.append(_quote(self.geometry_column(layer)[0]))
+        columns.extend(_quote(field) for field in fields)
+        sql = f"SELECT {', '.join(columns)} FROM {_quote(layer)}"
+        if fids is not None:
+            fids = list(fids)
+            if not fids:
+                return
+            sql += f" WHERE {columns[0]} IN ({', '.join(str(int(fid)) for fid in fids)})"
+        sql += f" ORDER BY {columns[0]}"
+
+        for row in self.connection.execute(sql):
+            values = row[2:] if geometry else row[1:]
+            if not geometry:
+                yield row[0], None, dict(zip(fields, values))
+            else:
+                yield row[0], geometry_wkb(row[1]) if wkb else decode_geometry(row[1]), dict(zip(fields, values))
+
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+# Decodes a GeoPackage geometry blob, returning None for empty or missing geometries
+def decode_geometry(blob):
+    wkb = geometry_wkb(blob)
+    return None if wkb is None else decode_wkb(wkb)
+
+
+# The WKB inside a GeoPackage geometry blob, or None for empty or missing geometries
+def geometry_wkb(blob):
+    if blob is None:
+        return None
+    blob = bytes(blob)
+    if blob[:2] != b'GP':
+        raise ValueError("Not a GeoPackage geometry")
+    flags = blob[3]
+    if flags & 0x10:
+        return None
+    envelope = (flags >> 1) & 0x07
+    if envelope > 4:
+        raise ValueError(f"Invalid GeoPackage geometry header: envelope code {envelope}")
+    envelope_size = (0, 32, 48, 48, 64)[envelope]
+    return blob[8 + envelope_size:]
+
+
+def decode_wkb(wkb):
+    return _read_wkb(wkb, 0)[0]
+
+
+_wkb_types = {1: 'Point', 2: 'LineString', 3: 'Polygon', 4: 'MultiPoint', 5: 'MultiLineString', 6: 'MultiPolygon'}
+
+
+# Reads one WKB geometry starting at offset, returning (geometry, offset after it)
+def _read_wkb(data, offset):
+    byte_order = '<' if data[offset] == 1 else '>'
+    code = struct.unpack_from(byte_order + 'I', data, offset + 1)[0]
+    offset += 5
+
+    # Extended WKB flags and ISO type codes for Z, M and ZM
+    dims = 2
+    if code & 0x80000000:
+        dims += 1
+    if code & 0x40000000:
+        dims += 1
+    code &= 0x0FFFFFFF
+    if code >= 1000:
+        dims = (2, 3, 3, 4)[code // 1000]
+        code %= 1000
+    if code not in _wkb_types:
+        raise ValueError(f"Unsupported WKB geometry type {code}")
+    kind = _wkb_types[code]
+
+    if kind == 'Point':
+        x, y = struct.unpack_from(byte_order + 'dd', data, offset)
+        return (kind, (x, y)), offset + 8 * dims
+    count = struct.unpack_from(byte_order + 'I', data, offset)[0]
+    offset += 4
+    if kind == 'LineString':
+        return (kind, _read_points(data, offset, count, dims, byte_order)), offset + 8 * dims * count
+    if kind == 'Polygon':
+        rings = []
+        for _ in range(count):
+            points = struct.unpack_from(byte_order + 'I', data, offset)[0]
+            rings.append(_read_points(data, offset + 4, points, dims, byte_order))
+            offset += 4 + 8 * dims * points
+        return (kind, rings), offset
+
+    parts = []
+    for _ in range(count):
+        part, offset = _read_wkb(data, offset)
+        parts.append(part[1])
+    return (kind, parts), offset
+
+
+def _read_points(data, offset, count, dims, byte_order):
+    coords = np.frombuffer(data, dtype=byte_order + 'f8', count=count * dims, offset=offset).reshape(count, dims)
+    return list(zip(coords[:, 0].tolist(), coords[:, 1].tolist()))
+
+
+# GeoPackage geometry blob of a geometry in the nested coordinate form decode_geometry returns,
+#   or already given as WKB, with no envelope
+def encode_geometry(geometry, srs_id):
+    if geometry is None:
+        return None
+    wkb = geometry if isinstance(geometry, bytes) else encode_wkb(geometry)
+    return b'GP' + bytes([0, 0x01]) + struct.pack('<i', srs_id) + wkb
+
+
+# Little-endian WKB of a geometry in the nested coordinate form decode_geometry returns
+def encode_wkb(geometry):
+    return _write_wkb(*geometry)
+
+
+def _write_wkb(kind, coords):
+    code = {name: code for code, name in _wkb_types.items()}[kind]
+    if kind == 'Point':
+        return struct.pack('<BIdd', 1, code, *coords)
+    if kind == 'LineString':
+        return struct.pack('<BII', 1, code, len(coords)) + _write_points(coords)
+    if kind == 'Polygon':
+        return struct.pack('<BII', 1, code, len(coords)) + b''.join(
+            struct.pack('<I', len(ring)) + _write_points(ring) for ring in coords)
+    part_kind = kind[len('Multi'):]
+    return struct.pack('<BII', 1, code, len(coords)) + b''.join(_write_wkb(part_kind, part) for part in coords)
+
+
+def _write_points(points):
+    return np.asarray(points, dtype='<f8').reshape(-1, 2).tobytes()
+
+
+# WKB of each polygon of a two-dimensional Polygon or MultiPolygon WKB, split without decoding
+#   its coordinates, or None for any other geometry
+def wkb_polygons(wkb):
+    byte_order = '<' if wkb[0] == 1 else '>'
+    code = struct.unpack_from(byte_order + 'I', wkb, 1)[0]
+    if code == 3:
+        return [wkb]
+    if code != 6:
+        return None
+    offset = 9
+    parts = []
+    for _ in range(struct.unpack_from(byte_order + 'I', wkb, 5)[0]):
+        start = offset
+        part_order = '<' if wkb[offset] == 1 else '>'
+        part_code, rings = struct.unpack_from(part_order + 'II', wkb, offset + 1)
+        if part_code != 3:
+            return None
+        offset += 9
+        for _ in range(rings):
+            offset += 4 + 16 * struct.unpack_from(part_order + 'I', wkb, offset)[0]
+        parts.append(wkb[start:offset])
+    return parts
+
+
+# MultiPolygon WKB from the WKB of its polygons
+def wkb_multipolygon(parts):
+    return struct.pack('<BII', 1, 6, len(parts)) + b''.join(parts)
+
+
+
+# Writes vector layers to a new or existing GeoPackage through plain SQLite, without QGIS
+#   Every layer shares one spatial reference system, given by its EPSG code and WKT definition
+#   Features are added in batches, each in a single transaction
+class GeoPackageWriter:
+    def __init__(self, path, srs_id, definition='undefined'):
+        self.path = path
+        self.srs_id = srs_id
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA application_id = 1196444487")  # 'GPKG'
+        self.connection.execute("PRAGMA user_version = 10200")
+        with self.connection:
+            self.connection.executescript(_metadata_tables)
+            self.connection.execute("INSERT OR REPLACE INTO gpkg_spatial_ref_sys VALUES (?, ?, 'EPSG', ?, ?, NULL)",
+                                    (f"EPSG:{srs_id}", srs_id, srs_id, definition))
+
+    def close(self):
+        self.connection.close()
+
+    # Creates an empty layer, replacing any layer of the same name
+    #   geometry_type is a WKB type name such as 'MULTIPOLYGON'; fields is a list of (name, SQLite type)
+    def create_layer(self, layer, geometry_type, fields):
+        columns = ''.join(f", {_quote(name)} {kind}" for name, kind in fields)
+        with self.connection:
+            self.drop_layer(layer)
+            self.connection.execute(f"CREATE TABLE {_quote(layer)} "
+                                    f"(fid INTEGER PRIMARY KEY AUTOINCREMENT, geom {geometry_type}{columns})")
+            self.connection.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) "
+                                    "VALUES (?, 'features', ?, ?)", (layer, layer, self.srs_id))
+            self.connection.execute("INSERT INTO gpkg_geometry_columns VALUES (?, 'geom', ?, ?, 0, 0)",
+                                    (layer, geometry_type, self.srs_id))
+
+    def drop_layer(self, layer):
+        self.connection.execute(f"DROP TABLE IF EXISTS {_quote(layer)}")
+        self.connection.execute("DELETE FROM gpkg_contents WHERE table_name = ?", (layer,))
+        self.connection.execute("DELETE FROM gpkg_geometry_columns WHERE table_name = ?", (layer,))
+
+    # Adds features given as (fid, geometry, *values), with fid None for a new fid
+    #   values follow the order of the fields the layer was created with
+    def add_features(self, layer, rows):
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return
+        columns = [name for _, name, _, _, _, _ in self.connection.execute(f"PRAGMA table_info({_quote(layer)})")]
+        sql = (f"INSERT INTO {_quote(layer)} ({', '.join(_quote(c) for c in columns[:len(first)])}) "
+               f"VALUES ({', '.join('?' * len(first))})")
+        with self.connection:
+            self.connection.executemany(sql, ((fid, encode_geometry(geometry, self.srs_id), *values)
+                                              for fid, geometry, *values in itertools.chain([first], rows)))
+
+
+_metadata_tables = """
+CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY,
+    organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL,
+    description TEXT);
+INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', NULL);
+INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', NULL);
+CREATE TABLE IF NOT EXISTS gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL,
+    identifier TEXT UNIQUE, description TEXT DEFAULT '', last_change DATETIME NOT NULL
+    DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')), min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE,
+    srs_id INTEGER);
+CREATE TABLE IF NOT EXISTS gpkg_geometry_columns (table_name TEXT NOT NULL, column_name TEXT NOT NULL,
+    geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL,
+    CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name));
+"""
+
+
+
+# The lines of a LineString or MultiLineString geometry
+def geometry_lines(geometry):
+    if geometry is None:
+        return []
+    kind, coords = geometry
+    return [coords] if kind == 'LineString' else coords
+
+
+# The point of a Point geometry, or the first point of a MultiPoint
+def geometry_point(geometry):
+    if geometry is None:
+        return None
+    kind, coords = geometry
+    if kind == 'Point':
+        return coords
+    return coords[0] if coords else None
+
+
+# The polygons of a Polygon or MultiPolygon geometry, each a list of rings
+def geometry_polygons(geometry):
+    if geometry is None:
+        return []
+    kind, coords = geometry
+    return [coords] if kind == 'Polygon' else coords
@@ -0,0 +1,295 @@
+import csv
+import datetime
+import io
+import math
+import os
+import zipfile
+
+import numpy as np
+
+weekdays = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')  # calendar.txt columns
+
+
+# Elementary connections of one service day of a GTFS feed, sorted by departure time
+#   stop_ids:       GTFS stop_id of every timetable stop (stops are referred to by index into this array)
+#   dep_stop, arr_stop, dep_time, arr_time, trip:
+#                   one entry per connection - a vehicle leaving dep_stop at dep_time and next
+#                   stopping at arr_stop at arr_time, times in seconds after midnight of the service day
+#   trip_route, trip_direction:
+#                   route_id (as a number where possible, else -1) and direction_id of each trip
+class GtfsTimetable:
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.stop_ids = arrays['stop_ids']
+        self.dep_stop = arrays['dep_stop']
+        self.arr_stop = arrays['arr_stop']
+        self.dep_time = arrays['dep_time']
+        self.arr_time = arrays['arr_time']
+        self.trip = arrays['trip']
+
+    def connection_count(self):
+        return len(self.dep_time)
+
+    def trip_count(self):
+        return len(self.arrays['trip_route'])
+
+    # Range of connections departing in [start, end), in seconds after midnight
+    def window(self, start, end):
+        return (int(np.searchsorted(self.dep_time, start, side='left')),
+                int(np.searchsorted(self.dep_time, end, side='left')))
+
+
+
+# Loads the connections running on service_date (a datetime.date) from a GTFS feed
+#   path is a directory holding the feed's text files, or a .zip of them - nothing is downloaded
+#   Stop times without an arrival or departure time are skipped, joining the timed stops either side
+#   Trips of the previous day's services still running after midnight (stop times from 24:00:00 on) are
+#   loaded too, their times shifted back by a day; their connections departing before midnight are dropped.
+#   next_day also loads the trips of the next day's services, their times shifted forward by a day,
+#   for searches running past midnight (see runs_past_midnight)
+def load_gtfs_timetable(path, service_date, next_day=False):
+    feed = _GtfsFeed(path)
+    day_services = [(_active_services(feed, service_date), 0),
+                    (_active_services(feed, service_date - datetime.timedelta(days=1)), -24 * 3600)]
+    if next_day:
+        day_services.append((_active_services(feed, service_date + datetime.timedelta(days=1)), 24 * 3600))
+
+    trip_index = {}     # trip_id -> [(trip, time offset)], a trip running on several days being loaded for each
+    trip_route = []
+    trip_direction = []
+    for row in feed.rows('trips.txt'):
+        for services, offset in day_services:
+            if row['service_id'] in services:
+                trip_index.setdefault(row['trip_id'], []).append((len(trip_route), offset))
+                trip_route.append(_as_int(row.get('route_id')))
+                trip_direction.append(_as_int(row.get('direction_id')))
+
+    stop_index = {}
+    stop_ids = []
+    trip_stops = {}
+    for row in feed.rows('stop_times.txt'):
+        trips = trip_index.get(row['trip_id'])
+        if trips is None:
+            continue
+        arrival = _parse_time(row.get('arrival_time'))
+        departure = _parse_time(row.get('departure_time'))
+        if arrival is None and departure is None:
+            continue
+        stop = stop_index.get(row['stop_id'])
+        if stop is None:
+            stop = len(stop_ids)
+            stop_index[row['stop_id']] = stop
+            stop_ids.append(_as_int(row['stop_id']))
+        arrival = arrival if arrival is not None else departure
+        departure = departure if departure is not None else arrival
+        for trip, offset in trips:
+            trip_stops.setdefault(trip, []).append((int(row['stop_sequence']), stop,
+                                                    arrival + offset, departure + offset))
+
+    dep_stop = []
+    arr_stop = []
+    dep_time = []
+    arr_time = []
+    trips = []
+    for trip, stops in trip_stops.items():
+        stops.sort()
+        for (_, from_stop, _, departure), (_, to_stop, arrival, _) in zip(stops, stops[1:]):
+            if departure < 0:
+                continue
+            dep_stop.append(from_stop)
+            arr_stop.append(to_stop)
+            dep_time.append(departure)
+            arr_time.append(arrival)
+            trips.append(trip)
+
+    dep_time = np.array(dep_time, dtype=np.int32)
+    order = np.argsort(dep_time, kind='stable')
+    return GtfsTimetable({
+        'stop_ids': np.array(stop_ids, dtype=np.int64),
+        'dep_stop': np.array(dep_stop, dtype=np.int32)[order],
+        'arr_stop': np.array(arr_stop, dtype=np.int32)[order],
+        'dep_time': dep_time[order],
+        'arr_time': np.array(arr_time, dtype=np.int32)[order],
+        'trip': np.array(trips, dtype=np.int32)[order],
+        'trip_route': np.array(trip_route, dtype=np.int64),
+        'trip_direction': np.array(trip_direction, dtype=np.int64),
+    })
+
+
+
+# Earliest arrival search over a GtfsTimetable with a single pass over its connections
+#   Walking to, between and from stops uses the network's street graph and transfer table.
+#   departure is in seconds after midnight; times reported in stop_arrivals are hours after departure,
+#   matching the other engines.
+class ConnectionScan:
+    def __init__(self, network, timetable, departure, time_limit):
+        self.network = network
+        self.timetable = timetable
+        self.departure = departure
+        self.time_limit = time_limit
+        self.stop_arrivals = {}
+        self.origin_seeds = []
+        self.origin_distances = {}
+        self.connections_scanned = 0
+        self.trips_boarded = 0
+        self.footpath_walks = 0
+        self.repeat_walks = 0
+        self.walked = set()
+
+        # Timetable stops that are also stops of the network, in both directions
+        stop_index = network.stop_index
+        self.stop_fids = [stop_index.stop_fid(stop_id) if stop_id >= 0 else None
+                          for stop_id in timetable.stop_ids.tolist()]
+        self.timetable_stops = {fid: stop for stop, fid in enumerate(self.stop_fids) if fid is not None}
+
+    def run(self, x, y):
+        self.run_from_seeds(self.network.graph.snap(x, y))
+
+    def run_from_seeds(self, seeds):
+        network = self.network
+        timetable = self.timetable
+        self.origin_seeds = seeds
+        if not seeds:
+            return
+
+        deadline = self.departure + self.time_limit * 3600
+        arrivals = [math.inf] * len(timetable.stop_ids)
+
+        distances = network.graph.reach(seeds, self.time_limit * network.walk_speed)
+        self.origin_distances = distances
+        for fid, distance in network.graph.reached_points(network.stops_set, distances):
+            stop = self.timetable_stops.get(fid)
+            if stop is not None:
+                arrivals[stop] = min(arrivals[stop], self.departure + distance / network.walk_speed * 3600)
+
+        start, end = timetable.window(self.departure, deadline)
+        dep_stop = timetable.dep_stop[start:end].tolist()
+        arr_stop = timetable.arr_stop[start:end].tolist()
+        dep_time = timetable.dep_time[start:end].tolist()
+        arr_time = timetable.arr_time[start:end].tolist()
+        trip = timetable.trip[start:end].tolist()
+        boarded = bytearray(timetable.trip_count())
+        alighted = set()
+
+        for i in range(end - start):
+            self.connections_scanned += 1
+            t = trip[i]
+            if not boarded[t]:
+                if arrivals[dep_stop[i]] > dep_time[i]:
+                    continue
+                boarded[t] = 1
+                self.trips_boarded += 1
+            to_stop = arr_stop[i]
+            if arr_time[i] < arrivals[to_stop] and arr_time[i] <= deadline:
+                arrivals[to_stop] = arr_time[i]
+                alighted.add(to_stop)
+                self.walk_from(to_stop, arrivals, deadline)
+
+        for stop in alighted:
+            fid = self.stop_fids[stop]
+            if fid is not None:
+                self.stop_arrivals[fid] = (arrivals[stop] - self.departure) / 3600
+
+    # Relaxes the footpaths from a stop just reached by a vehicle
+    def walk_from(self, stop, arrivals, deadline):
+        fid = self.stop_fids[stop]
+        if fid is None:
+            return
+        self.footpath_walks += 1
+        if stop in self.walked:
+            self.repeat_walks += 1
+        self.walked.add(stop)
+        arrival = arrivals[stop]
+        for other_fid, cost in self.network.walk_from_stop(fid, self.network.stops_set, (deadline - arrival) / 3600,
+                                                           self.time_limit):
+            other = self.timetable_stops.get(other_fid)
+            if other is not None and arrival + cost * 3600 < arrivals[other]:
+                arrivals[other] = arrival + cost * 3600
+
+    def walking_seeds(self):
+        return self.network.walking_seeds(self.origin_seeds, self.stop_arrivals)
+
+    def walk_sources(self):
+        return self.origin_distances, self.network.stops_set, self.stop_arrivals
+
+    def counters(self):
+        return {'connections_scanned': self.connections_scanned, 'trips_boarded': self.trips_boarded,
+                'footpath_walks': self.footpath_walks, 'repeat_walks': self.repeat_walks}
+
+    # GTFS trips are not matched to route patterns, so no boardings or ridden route spans are reported
+    def boardings(self):
+        return {}
+
+    def ride_arrivals(self):
+        return {}
+
+    def ridden_spans(self):
+        return []
+
+
+
+# Reads the text files of a GTFS feed from a directory or zip archive
+class _GtfsFeed:
+    def __init__(self, path):
+        self.path = path
+
+    def has(self, name):
+        if os.path.isdir(self.path):
+            return os.path.exists(os.path.join(self.path, name))
+        with zipfile.ZipFile(self.path) as archive:
+            return name in archive.namelist()
+
+    def rows(self, name):
+        if os.path.isdir(self.path):
+            with open(os.path.join(self.path, name), newline='', encoding='utf-8-sig') as f:
+                yield from csv.DictReader(f)
+        else:
+            with zipfile.ZipFile(self.path) as archive:
+                with archive.open(name) as raw:
+                    yield from csv.DictReader(io.TextIOWrapper(raw, encoding='utf-8-sig', newline=''))
+
+
+# service_ids running on a date according to calendar.txt and calendar_dates.txt
+def _active_services(feed, service_date):
+    day = service_date.strftime('%Y%m%d')
+    weekday = weekdays[service_date.weekday()]
+    services = set()
+    if feed.has('calendar.txt'):
+        for row in feed.rows('calendar.txt'):
+            if row['start_date'] <= day <= row['end_date'] and row[weekday] == '1':
+                services.add(row['service_id'])
+    if feed.has('calendar_dates.txt'):
+        for row in feed.rows('calendar_dates.txt'):
+            if row['date'] != day:
+                continue
+            if row['exception_type'] == '1':
+                services.add(row['service_id'])
+            elif row['exception_type'] == '2':
+                services.discard(row['service_id'])
+    return services
+
+
+# Seconds after midnight from a GTFS "H:MM:SS" time, which may run past 24:00:00
+def _parse_time(value):
+    if not value or not value.strip():
+        return None
+    hours, minutes, seconds = value.strip().split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return -1
+
+
+# Seconds after midnight of a datetime
+def seconds_after_midnight(moment):
+    return moment.hour * 3600 + moment.minute * 60 + moment.second
+
+
+# Whether a search departing at departure (seconds after midnight) for time_limit hours runs past midnight,
+#   and so needs the next day's trips (see load_gtfs_timetable)
+def runs_past_midnight(departure, time_limit):
+    return departure + time_limit * 3600 > 24 * 3600
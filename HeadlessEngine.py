@@ -0,0 +1,452 @@
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+from BatchSearch import search_origin
+from BlockColumns import BlockColumns, build_block_columns
+from BlockIndex import (BlockIndex, BlockReach, build_block_index, build_block_reach, edge_block_pairs,
+                        ring_segments, segments_near_rings)
+from GeoPackage import GeoPackage, geometry_lines, geometry_point, geometry_polygons
+from GtfsTimetable import load_gtfs_timetable, runs_past_midnight, seconds_after_midnight
+from NetworkCache import ChecksumStore, load_cached_arrays, save_cached_arrays
+from ResultWriter import GeoPackageResultWriter, default_layer_name
+from Tracing import span
+from StreetGraph import StreetGraph, build_street_graph
+from TransferTable import TransferTable, build_transfer_table
+from TransitIndex import RoutePatterns, StopIndex, build_headway_table, build_route_patterns, build_stop_index
+from TransitNetwork import TransitNetwork
+from WalkCache import WalkCache
+
+walk_feet_per_hour = 14784  # feet walkable in one hour
+transfer_time_limit = 1  # hours of walking precomputed between stops
+block_distance = 10  # feet between a reached street and the census blocks it gives access to
+
+
+# Where each source layer is read from, as (GeoPackage path, layer name)
+class NetworkSources:
+    def __init__(self, streets, route_stops, stops, routes, blocks):
+        self.streets = streets
+        self.route_stops = route_stops
+        self.stops = stops
+        self.routes = routes
+        self.blocks = blocks
+
+
+# The layers of TransitConnectivity.qgs, relative to the directory holding the project
+def project_sources(directory):
+    working = os.path.join(directory, 'WorkingFiles.gpkg')
+    area = os.path.join(directory, 'AreaFiles.gpkg')
+    return NetworkSources(streets=(area, '1HrWalkableRoads_NoHighways'),
+                          route_stops=(working, 'trimet_route_stops'),
+                          stops=(working, 'trimet_stops'),
+                          routes=(working, 'trimet_routes'),
+                          blocks=(os.path.join(directory, '..', 'PortlandTransitConnectivityMap', 'AreaFiles.gpkg'),
+                                  'census_blocks_land_only'))
+
+
+
+# Builds, caches and searches the transit network straight from the GeoPackages, without QGIS
+#   cache_directory, if given, holds the prebuilt structures (see NetworkCache)
+#   transformer(source authid, target authid) returns a function converting a list of (x, y) between
+#   the two crs, and is only called for layers whose crs differs from the layer they are combined with
+class HeadlessEngine:
+    def __init__(self, sources, cache_directory=None, walk_speed=walk_feet_per_hour,
+                 transfer_limit=transfer_time_limit, block_distance=block_distance, transformer=None):
+        self.sources = sources
+        self.cache_directory = cache_directory
+        self.walk_speed = walk_speed
+        self.transfer_limit = transfer_limit
+        self.block_distance = block_distance
+        self.transformer = transformer or pyproj_transformer
+        self.checksums = ChecksumStore(os.path.join(cache_directory, 'checksums.json') if cache_directory else None)
+        self.packages = {}
+        self.structures = {}
+        self.sources_version = None
+        self.walks = None
+
+    def package(self, path):
+        if path not in self.packages:
+            self.packages[path] = GeoPackage(path)
+        return self.packages[path]
+
+    def close(self):
+        for package in self.packages.values():
+            package.close()
+        self.packages = {}
+
+    def features(self, source, fields=(), geometry=True, fids=None):
+        path, layer = source
+        return self.package(path).features(layer, fields, geometry, fids)
+
+    def authid(self, source):
+        path, layer = source
+        return self.package(path).authid(layer)
+
+    # Function converting a list of (x, y) from one layer's crs to another's, or None if they match
+    def transform(self, source, target):
+        if self.authid(source) == self.authid(target):
+            return None
+        return self.transformer(self.authid(source), self.authid(target))
+
+    # (fid, x, y) for every feature of a point layer, in the crs of the target layer
+    def points(self, source, target):
+        transform = self.transform(source, target)
+        points = []
+        for fid, geometry, _ in self.features(source):
+            point = geometry_point(geometry)
+            if point is None:
+                continue
+            if transform:
+                point = transform([point])[0]
+            points.append((fid, point[0], point[1]))
+        return points
+
+    # Loads a structure from the cache, building (and caching) it when missing or built from other sources
+    def cached(self, name, structure_class, sources, parameters, build):
+        if name in self.structures:
+            return self.structures[name]
+        if self.cache_directory is None:
+            with span(f"build {name.replace('_', ' ')}"):
+                self.structures[name] = build()
+            return self.structures[name]
+
+        key = self.checksum(sources, parameters)
+        directory = os.path.join(self.cache_directory, f"{name}_{key[:16]}")
+        with span(f"load {name.replace('_', ' ')}"):
+            arrays = load_cached_arrays(directory, key)
+        if arrays is not None:
+            self.structures[name] = structure_class(arrays)
+        else:
+            with span(f"build {name.replace('_', ' ')}"):
+                self.structures[name] = build()
+                save_cached_arrays(directory, key, self.structures[name].arrays, name)
+        return self.structures[name]
+
+    # Checksum over the contents of a set of layers, the layers' names and any build parameters
+    def checksum(self, sources, parameters):
+        digest = hashlib.sha1()
+        for path, layer in sources:
+            digest.update(self.checksums.checksum(os.path.abspath(path), layer,
+                                                  lambda: self.package(path).layer_checksum(layer)).encode())
+            digest.update(layer.encode())
+        for parameter in parameters:
+            digest.update(repr(parameter).encode())
+        self.checksums.save()
+        return digest.hexdigest()
+
+    # Street network with both stop layers snapped in
+    def street_graph(self):
+        s = self.sources
+        return self.cached('street_graph', StreetGraph, [s.streets, s.route_stops, s.stops], [],
+                           self.build_street_graph)
+
+    def build_street_graph(self):
+        s = self.sources
+        lines = []
+        for fid, geometry, _ in self.features(s.streets):
+            for line in geometry_lines(geometry):
+                lines.append((fid, line))
+        return build_street_graph(lines, {s.route_stops[1]: self.points(s.route_stops, s.streets),
+                                          s.stops[1]: self.points(s.stops, s.streets)})
+
+    # Identifier translation between route stops, stop_ids and stops
+    def stop_index(self):
+        s = self.sources
+        return self.cached('stop_index', StopIndex, [s.route_stops, s.stops], [], self.build_stop_index)
+
+    def build_stop_index(self):
+        s = self.sources
+        route_stops = [(fid, f['stop_id'], f['rte'], f['dir'])
+                       for fid, _, f in self.features(s.route_stops, ['stop_id', 'rte', 'dir'], geometry=False)]
+        stops = [(fid, f['stop_id']) for fid, _, f in self.features(s.stops, ['stop_id'], geometry=False)]
+        return build_stop_index(route_stops, stops)
+
+    # Ordered stops and in-vehicle times of every route
+    def route_patterns(self):
+        s = self.sources
+        return self.cached('route_patterns', RoutePatterns, [s.routes, s.route_stops, s.stops], [],
+                           self.build_route_patterns)
+
+    def build_route_patterns(self):
+        s = self.sources
+        routes = {}
+        for _, geometry, f in self.features(s.routes, ['rte', 'dir', 'KILO_FT_PER_HOUR']):
+            key = (f['rte'], f['dir'])
+            if key not in routes:
+                routes[key] = [f['rte'], f['dir'], f['KILO_FT_PER_HOUR'], []]
+            for line in geometry_lines(geometry):
+                routes[key][3].extend(line)
+
+        index = self.stop_index()
+        stops = [(fid, *index.rte_dir(fid), x, y) for fid, x, y in self.points(s.route_stops, s.routes)]
+        return build_route_patterns(list(routes.values()), stops)
+
+    # Stop-to-stop and stop-to-route-stop walking times
+    def transfer_table(self):
+        s = self.sources
+        return self.cached('transfer_table', TransferTable, [s.streets, s.route_stops, s.stops],
+                           [self.transfer_limit, self.walk_speed],
+                           lambda: build_transfer_table(self.street_graph(), s.stops[1], [s.route_stops[1], s.stops[1]],
+                                                        self.walk_speed * self.transfer_limit, self.walk_speed))
+
+    # Expected waits of every route, read fresh each time as they follow edits to the routes layer
+    def headway_table(self):
+        return build_headway_table(self.headway_rows())
+
+    def headway_rows(self):
+        return [(f['rte'], f['dir'], f['TRIPS_PER_HOUR'])
+                for _, _, f in self.features(self.sources.routes, ['rte', 'dir', 'TRIPS_PER_HOUR'], geometry=False)]
+
+    # Walks from stops longer than the transfer table covers, kept for every search of the session
+    def walk_cache(self):
+        if self.walks is None:
+            self.walks = WalkCache(self.street_graph(), self.walk_speed)
+        return self.walks
+
+    # Census blocks near each street edge
+    def block_index(self):
+        s = self.sources
+        return self.cached('block_index', BlockIndex, [s.streets, s.route_stops, s.stops, s.blocks],
+                           [self.block_distance],
+                           lambda: build_block_index(edge_block_pairs(self.street_graph(), self.block_polygons(),
+                                                                      self.block_distance),
+                                                     self.street_graph().edge_count(), self.block_distance))
+
+    # Where along the streets near it each census block is reached, for travel time matrices
+    def block_reach(self):
+        s = self.sources
+        return self.cached('block_reach', BlockReach, [s.streets, s.route_stops, s.stops, s.blocks],
+                           [self.block_distance],
+                           lambda: build_block_reach(self.street_graph(), self.block_index(), self.block_polygons()))
+
+    # Values of a field of the census blocks, in fid order
+    def block_field(self, field):
+        self.check_block_fields([field])
+        return [values[field] for _, _, values in self.features(self.sources.blocks, [field], geometry=False)]
+
+    # (name, SQLite type) of every attribute field of the census blocks
+    def block_layer_fields(self):
+        path, layer = self.sources.blocks
+        return self.package(path).fields(layer)
+
+    # Raises ValueError if the census blocks lack any of the fields
+    #   (SQLite would otherwise read an unknown quoted field name as a string literal)
+    def check_block_fields(self, fields):
+        path, layer = self.sources.blocks
+        missing = [field for field in fields if field not in self.package(path).field_names(layer)]
+        if missing:
+            raise ValueError(f"{layer} in {path} has no field {', '.join(missing)}")
+
+    # Numeric fields of the census blocks as a column store, for summing over the blocks an origin reaches
+    def block_columns(self, fields):
+        fields = list(fields)
+        self.check_block_fields(fields)
+
+        def build():
+            rows = [(fid, values) for fid, _, values in self.features(self.sources.blocks, fields, geometry=False)]
+            return build_block_columns(rows, fields)
+        return self.cached(f"block_columns_{'_'.join(fields)}", BlockColumns, [self.sources.blocks], fields, build)
+
+    # (fid, [polygon, ...]) of the census blocks, in the street graph's crs
+    #   fids, if given, restricts the blocks read to those fids
+    def block_polygons(self, fids=None):
+        transform = self.transform(self.sources.blocks, self.sources.streets)
+        for fid, geometry, _ in self.features(self.sources.blocks, fids=fids):
+            polygons = geometry_polygons(geometry)
+            if transform:
+                polygons = [[transform(ring) for ring in rings] for rings in polygons]
+            yield fid, polygons
+
+    # (fid, WKB, {field: value}) of the census blocks with the given fids, in the blocks layer's own crs
+    def block_wkb(self, fids):
+        path, layer = self.sources.blocks
+        fields = [name for name, _ in self.block_layer_fields()]
+        return self.package(path).features(layer, fields, fids=fids, wkb=True)
+
+    # Writer streaming service areas into a layer of a GeoPackage, in the blocks layer's crs (see ResultWriter)
+    def result_writer(self, path, layer=default_layer_name, simplify=0, quantize=0):
+        blocks_path, blocks_layer = self.sources.blocks
+        package = self.package(blocks_path)
+        srs_id = int(package.authid(blocks_layer).split(':')[1])
+        return GeoPackageResultWriter(path, layer, srs_id, package.srs_definition(blocks_layer),
+                                      self.block_layer_fields(), simplify, quantize)
+
+    # Adds the band_blocks of one origin to a ResultWriter
+    def write_service_areas(self, writer, name, blocks):
+        for band, fids in blocks:
+            writer.add(name, band * 60, self.block_wkb(fids))
+
+    # blocks includes the census blocks' BlockReach, for travel time matrices,
+    #   and block_fields the BlockColumns of those fields, for block sums
+    def network(self, headways=None, blocks=False, block_fields=None):
+        s = self.sources
+        return TransitNetwork(self.street_graph(), self.transfer_table(), self.route_patterns(),
+                              headways if headways is not None else self.headway_table(), self.stop_index(),
+                              self.walk_speed,
+                              s.stops[1], s.route_stops[1], self.block_reach() if blocks or block_fields else None,
+                              self.block_columns(block_fields) if block_fields else None, self.walk_cache())
+
+    # Checksum identifying everything a search result depends on: the layers the network is built from,
+    #   the walking parameters and the current headways (which follow edits to the routes layer)
+    def network_version(self, headways=None):
+        s = self.sources
+        if self.sources_version is None:
+            self.sources_version = self.checksum([s.streets, s.route_stops, s.stops, s.routes],
+                                                 [self.transfer_limit, self.walk_speed])
+        headways = headways if headways is not None else self.headway_table()
+        digest = hashlib.sha1(self.sources_version.encode())
+        for name in sorted(headways.arrays):
+            digest.update(name.encode())
+            digest.update(np.ascontiguousarray(headways.arrays[name]).tobytes())
+        return digest.hexdigest()
+
+    # Fids of the census blocks within block_distance of the reached streets, ascending
+    #   reached_edges is a list of (edge, start distance, end distance)
+    #   Fully reached edges are looked up in the block index; for the few edges only partly reached,
+    #   the index's blocks are checked against the reached part of the edge
+    def reached_blocks(self, reached_edges):
+        graph = self.street_graph()
+        index = self.block_index()
+        edge_length = graph.edge_lists()[2]
+        partial = [(edge, start, end) for edge, start, end in reached_edges if end - start < edge_length[edge]]
+        full = [edge for edge, start, end in reached_edges if end - start >= edge_length[edge]]
+        fids = set(index.blocks_near_edges(full).tolist())
+
+        candidates = {fid for edge, _, _ in partial for fid in index.blocks_near(edge)} - fids
+        rings = {fid: ring_segments(polygons) for fid, polygons in self.block_polygons(sorted(candidates))}
+        for edge, start, end in partial:
+            (x1, y1), (x2, y2) = graph.edge_segment(edge, start, end)
+            for fid in index.blocks_near(edge):
+                if fid in fids or fid not in rings:
+                    continue
+                if segments_near_rings(np.array([x1]), np.array([y1]), np.array([x2]), np.array([y2]),
+                                       rings[fid], self.block_distance)[0]:
+                    fids.add(fid)
+        return sorted(fids)
+
+    # Searches from a point in the street layer's crs with a table-driven engine ('raptor' or 'timetable')
+    #   Returns the search's OriginResult and, for each time limit in bands (hours, ascending, defaulting
+    #   to time_limit alone), (time limit, fids of the accessible census blocks)
+    #   network, if given, is searched instead of one built with the routes layer's current headways
+    def search(self, x, y, time_limit, engine='raptor', bands=None, max_transfers=None, timetable=None,
+               departure=None, network=None):
+        network = network or self.network()
+        bands = bands or [time_limit]
+        result = search_origin(network, 0, network.graph.snap(x, y), bands[-1], engine, max_transfers, timetable,
+                               departure, bands)
+        return result, self.band_blocks(bands, result)
+
+    # Searches back from destinations, a list of (x, y) in the street layer's crs, in a single pass
+    #   Returns the search's OriginResult and, for each time limit in bands, (time limit, fids of the census blocks
+    #   from which a destination can be reached within it); see search for the other arguments
+    def catchment(self, destinations, time_limit, bands=None, max_transfers=None, network=None):
+        network = network or self.network()
+        bands = bands or [time_limit]
+        seeds = network.graph.snap_many([x for x, _ in destinations], [y for _, y in destinations])
+        result = search_origin(network, 0, [seed for destination_seeds in seeds for seed in destination_seeds],
+                               bands[-1], 'reverse', max_transfers, bands=bands)
+        return result, self.band_blocks(bands, result)
+
+    # Searches from many origins, a list of (x, y) in the street layer's crs, at once for the union of their
+    #   service areas, at the cost of a single search; returns the same as search
+    #   labeled also sets the result's block_sources, the origin each block is reached from first (see source_blocks)
+    def union(self, origins, time_limit, bands=None, max_transfers=None, labeled=False, network=None):
+        network = network or self.network(blocks=labeled)
+        bands = bands or [time_limit]
+        seeds = network.graph.snap_many([x for x, _ in origins], [y for _, y in origins])
+        sources = [index for index, origin_seeds in enumerate(seeds) for _ in origin_seeds]
+        result = search_origin(network, 0, [seed for origin_seeds in seeds for seed in origin_seeds], bands[-1],
+                               'raptor', max_transfers, bands=bands, sources=sources if labeled else None)
+        return result, self.band_blocks(bands, result)
+
+    # (time limit, [(origin index, fids of the census blocks it reaches first), ...]) for each band
+    #   of a labeled union result
+    def source_blocks(self, bands, result):
+        fids = self.block_reach().fids
+        blocks = []
+        for band, sources in zip(bands, result.block_sources):
+            reached = sources >= 0
+            order = np.argsort(sources[reached], kind='stable')
+            labels = sources[reached][order]
+            band_fids = fids[reached][order]
+            splits = np.flatnonzero(np.diff(labels)) + 1
+            blocks.append((band, [(int(group_labels[0]), group_fids.tolist()) for group_labels, group_fids in
+                                  zip(np.split(labels, splits), np.split(band_fids, splits)) if len(group_labels)]))
+        return blocks
+
+    # (time limit, fids of the accessible census blocks) for each band of an OriginResult
+    def band_blocks(self, bands, result):
+        blocks = []
+        for band, (edges, starts, ends) in zip(bands, result.reached_edges):
+            blocks.append((band, self.reached_blocks(list(zip(edges.tolist(), starts.tolist(), ends.tolist())))))
+        return blocks
+
+
+
+# Coordinate transformation through pyproj, the one optional dependency of the headless engine
+def pyproj_transformer(source_authid, target_authid):
+    try:
+        from pyproj import Transformer
+    except ImportError:
+        raise ValueError(f"Layers in {source_authid} and {target_authid} need pyproj to be combined")
+    transformer = Transformer.from_crs(source_authid, target_authid, always_xy=True)
+
+    def transform(points):
+        xs, ys = transformer.transform([p[0] for p in points], [p[1] for p in points])
+        return list(zip(xs, ys))
+    return transform
+
+
+
+# Command line entry point: prints the accessible census blocks of one origin as JSON,
+#   and writes its service areas to a GeoPackage with --output
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Transit service area of a point, without QGIS')
+    parser.add_argument('x', type=float, help='origin x in the street layer crs')
+    parser.add_argument('y', type=float, help='origin y in the street layer crs')
+    parser.add_argument('minutes', type=float, nargs='+', help='one or more time limits in minutes')
+    parser.add_argument('--project', default='.', help='directory holding the project GeoPackages')
+    parser.add_argument('--cache', help='network cache directory (default: network_cache in the project directory)')
+    parser.add_argument('--engine', choices=['raptor', 'timetable', 'reverse'], default='raptor',
+                        help='reverse finds the catchment the point can be reached from instead')
+    parser.add_argument('--max-transfers', type=int)
+    parser.add_argument('--gtfs', help='GTFS feed directory or zip (timetable engine)')
+    parser.add_argument('--departure', help='departure as YYYY-MM-DDTHH:MM:SS (timetable engine)')
+    parser.add_argument('--output', help='GeoPackage to write the service areas to, as well as printing them')
+    parser.add_argument('--layer', default=default_layer_name, help='layer of the output GeoPackage')
+    parser.add_argument('--simplify', type=float, default=0, help='simplification tolerance of the output, in feet')
+    parser.add_argument('--quantize', type=float, default=0, help='coordinate grid of the output, in feet')
+    args = parser.parse_args(argv)
+
+    timetable = None
+    departure = None
+    if args.engine == 'timetable':
+        if not args.gtfs or not args.departure:
+            parser.error('the timetable engine needs --gtfs and --departure')
+        moment = datetime.datetime.fromisoformat(args.departure)
+        departure = seconds_after_midnight(moment)
+        timetable = load_gtfs_timetable(args.gtfs, moment.date(), runs_past_midnight(departure, max(args.minutes) / 60))
+
+    engine = HeadlessEngine(project_sources(args.project), args.cache or os.path.join(args.project, 'network_cache'))
+    bands = sorted(m / 60 for m in args.minutes)
+    result, blocks = engine.search(args.x, args.y, bands[-1], args.engine, bands, args.max_transfers, timetable,
+                                   departure)
+    if args.output:
+        writer = engine.result_writer(args.output, args.layer, args.simplify, args.quantize)
+        engine.write_service_areas(writer, f"{args.x},{args.y}", blocks)
+        writer.close()
+    json.dump({'origin': [args.x, args.y],
+               'counters': result.counters,
+               'stops_reached': len(result.stop_arrivals),
+               'bands': [{'minutes': band * 60, 'blocks': fids} for band, fids in blocks]}, sys.stdout)
+    sys.stdout.write('\n')
+    engine.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import json
+import math
+import os
+import time
+import urllib.parse
+
+from BatchSearch import SharedNetwork, search_origin, shared_executor, submit_search
+from GtfsTimetable import load_gtfs_timetable
+from HeadlessEngine import HeadlessEngine, project_sources
+from ResultCache import origin_key
+
+service_host = '127.0.0.1'  # the service only listens on the local machine
+default_port = 8765
+origin_tolerance = 1  # feet along a street within which identical concurrent requests are coalesced
+latency_history = 1000  # requests kept for the latency percentiles
+response_formats = ['blocks', 'geojson']
+
+_reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            500: 'Internal Server Error'}
+
+
+# Local HTTP/JSON service answering service area requests from a warm network, without QGIS
+#   The network is built (or loaded from the network cache) once at start, and searches run on a pool
+#   of worker processes sharing one copy of it (or on a single thread in this process with workers=0).
+#   Identical requests arriving while a search is running wait for that search instead of starting another.
+#   Block lookups and GeoPackage reads run on a lookup thread of their own, so they never hold up the event loop.
+#   Endpoints:
+#       GET /isochrone?x=&y=&minutes=[&bands=][&engine=][&max_transfers=][&departure=][&format=]
+#       POST /isochrone with the same fields in a JSON object
+#       GET /stats      queue depth, request counts and latency percentiles
+#       GET /health
+#   x and y are in the street layer's crs; bands is a comma separated list of further time limits in minutes;
+#   engine is 'raptor' (default) or 'timetable', the latter needing a GTFS feed given at start and a
+#   departure as HH:MM[:SS] on its service date; format is 'blocks' (default, the accessible block fids of
+#   each time limit) or 'geojson' (the accessible blocks, each with the smallest time limit reaching it).
+class IsochroneService:
+    def __init__(self, engine, workers=1, timetable=None):
+        self.engine = engine
+        self.network = engine.network()
+        engine.block_index()
+        self.timetable = timetable
+        self.workers = workers
+        self.shared = None
+        if workers > 0:
+            self.shared = SharedNetwork(self.network, timetable)
+            self.executor = shared_executor(self.shared, workers)
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor(1)
+        self.lookups = concurrent.futures.ThreadPoolExecutor(1)  # one thread, as the engine's GeoPackages are shared
+
+        self.running = {}               # search key -> asyncio.Future of (OriginResult, band blocks)
+        self.queued = 0                 # searches submitted and not yet finished
+        self.requests = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.latencies = collections.deque(maxlen=latency_history)
+        self.search_latencies = collections.deque(maxlen=latency_history)
+        self.started = time.time()
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.lookups.shutdown(wait=True, cancel_futures=True)
+        if self.shared is not None:
+            self.shared.close()
+        self.engine.close()
+
+    async def serve(self, port=default_port):
+        return await asyncio.start_server(self.handle, service_host, port)
+
+    # Reads one HTTP request from a connection and writes its JSON response
+    async def handle(self, reader, writer):
+        start_time = time.perf_counter()
+        try:
+            request_line = (await reader.readline()).decode('latin-1')
+            method, target, _ = request_line.split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length') or 0))
+            status, payload = await self.route(method, target, body)
+        except (ValueError, KeyError, asyncio.IncompleteReadError) as e:
+            status, payload = 400, {'error': str(e)}
+        except Exception as e:
+            self.failures += 1
+            status, payload = 500, {'error': f"{type(e).__name__}: {e}"}
+
+        data = json.dumps(payload).encode()
+        writer.write(f"HTTP/1.1 {status} {_reasons[status]}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+        if status == 200 and payload.get('origin') is not None:
+            self.latencies.append(time.perf_counter() - start_time)
+
+    async def route(self, method, target, body):
+        url = urllib.parse.urlsplit(target)
+        if url.path == '/health':
+            return 200, {'status': 'ok'}
+        if url.path == '/stats':
+            return 200, self.stats()
+        if url.path != '/isochrone':
+            return 404, {'error': f"No endpoint {url.path}"}
+        if method == 'GET':
+            fields = {name: values[-1] for name, values in urllib.parse.parse_qs(url.query).items()}
+        elif method == 'POST':
+            fields = json.loads(body or b'{}')
+            if not isinstance(fields, dict):
+                raise ValueError("The request body must be a JSON object")
+        else:
+            return 405, {'error': f"{method} is not supported"}
+        return 200, await self.isochrone(fields)
+
+    # Answers one service area request, given as a dictionary of its fields
+    async def isochrone(self, fields):
+        self.requests += 1
+        x = float(fields['x'])
+        y = float(fields['y'])
+        bands = parse_minutes(fields['minutes'], fields.get('bands'))
+        engine = fields.get('engine') or 'raptor'
+        if engine not in ('raptor', 'timetable'):
+            raise ValueError(f"Unknown engine {engine}")
+        max_transfers = int(fields['max_transfers']) if fields.get('max_transfers') not in (None, '') else None
+        departure = None
+        if engine == 'timetable':
+            if self.timetable is None:
+                raise ValueError("The timetable engine needs the service to be started with a GTFS feed")
+            departure = parse_clock(fields.get('departure') or '')
+        response_format = fields.get('format') or 'blocks'
+        if response_format not in response_formats:
+            raise ValueError(f"Unknown format {response_format}")
+
+        seeds = self.network.graph.snap(x, y)
+        if not seeds:
+            raise ValueError("The origin is not near the street network")
+        key = (origin_key(seeds, origin_tolerance), tuple(bands), engine, max_transfers, departure)
+        coalesced = key in self.running
+        if coalesced:
+            self.coalesced += 1
+        else:
+            self.running[key] = asyncio.ensure_future(self.search(key, seeds, bands, engine, max_transfers, departure))
+        result, blocks = await asyncio.shield(self.running[key])
+
+        response = {'origin': [x, y], 'engine': engine, 'coalesced': coalesced,
+                    'stops_reached': len(result.stop_arrivals), 'counters': result.counters}
+        if response_format == 'geojson':
+            response['geojson'] = await asyncio.get_running_loop().run_in_executor(self.lookups, self.blocks_geojson,
+                                                                                   blocks)
+        else:
+            response['bands'] = [{'minutes': band * 60, 'blocks': fids} for band, fids in blocks]
+        return response
+
+    async def search(self, key, seeds, bands, engine, max_transfers, departure):
+        start_time = time.perf_counter()
+        self.queued += 1
+        try:
+            if self.workers > 0:
+                future = submit_search(self.executor, 0, seeds, bands[-1], engine, max_transfers, departure, bands)
+            else:
+                future = self.executor.submit(search_origin, self.network, 0, seeds, bands[-1], engine, max_transfers,
+                                              self.timetable, departure, bands)
+            result = await asyncio.wrap_future(future)
+            blocks = await asyncio.get_running_loop().run_in_executor(self.lookups, self.engine.band_blocks, bands,
+                                                                      result)
+        finally:
+            # Only once the blocks are known, so that requests arriving during the lookup still join this search
+            self.queued -= 1
+            del self.running[key]
+        self.search_latencies.append(time.perf_counter() - start_time)
+        return result, blocks
+
+    # GeoJSON FeatureCollection of the accessible blocks, in the blocks layer's crs,
+    #   each with the smallest time limit (in minutes) that reaches it
+    def blocks_geojson(self, blocks):
+        minutes = {}
+        for band, fids in blocks:
+            for fid in fids:
+                minutes.setdefault(fid, band * 60)
+        features = [{'type': 'Feature', 'id': fid, 'properties': {'fid': fid, 'minutes': minutes[fid]},
+                     'geometry': {'type': geometry[0], 'coordinates': geometry[1]} if geometry else None}
+                    for fid, geometry, _ in self.engine.features(self.engine.sources.blocks, fids=sorted(minutes))]
+        authority, code = self.engine.authid(self.engine.sources.blocks).split(':')
+        return {'type': 'FeatureCollection', 'features': features,
+                'crs': {'type': 'name', 'properties': {'name': f"urn:ogc:def:crs:{authority}::{code}"}}}
+
+    def stats(self):
+        return {'uptime_seconds': time.time() - self.started, 'workers': self.workers,
+                'queue_depth': self.queued, 'running_searches': len(self.running),
+                'requests': self.requests, 'coalesced': self.coalesced, 'failures': self.failures,
+                'latency_seconds': percentiles(self.latencies),
+                'search_latency_seconds': percentiles(self.search_latencies)}
+
+
+# Time limits in hours, ascending, from the time limit and an optional list of further limits in minutes
+#   (a comma separated string or a list)
+def parse_minutes(minutes, bands=None):
+    if isinstance(bands, str):
+        bands = [part for part in bands.split(',') if part.strip()]
+    limits = {float(minutes)} | {float(band) for band in bands or []}
+    if min(limits) <= 0 or not all(math.isfinite(limit) for limit in limits):
+        raise ValueError("Time limits must be positive numbers of minutes")
+    return [limit / 60 for limit in sorted(limits)]
+
+
+# Seconds after midnight from "HH:MM" or "HH:MM:SS"
+def parse_clock(value):
+    parts = value.split(':')
+    if len(parts) not in (2, 3):
+        raise ValueError("The timetable engine needs a departure as HH:MM[:SS]")
+    hours, minutes, seconds = (int(part) for part in parts + ['0'] * (3 - len(parts)))
+    return hours * 3600 + minutes * 60 + seconds
+
+
+# p50, p90 and p99 of a list of durations, or None for each if empty
+def percentiles(values):
+    ordered = sorted(values)
+    if not ordered:
+        return {'count': 0, 'p50': None, 'p90': None, 'p99': None}
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {'count': len(ordered), 'p50': pick(0.5), 'p90': pick(0.9), 'p99': pick(0.99)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local service area service over a warm network, without QGIS')
+    parser.add_argument('--project', default='.', help='directory holding the project GeoPackages')
+    parser.add_argument('--cache', help='network cache directory (default: network_cache in the project directory)')
+    parser.add_argument('--port', type=int, default=default_port)
+    parser.add_argument('--workers', type=int, default=2, help='search worker processes (0 searches in this process)')
+    parser.add_argument('--gtfs', help='GTFS feed directory or zip, for the timetable engine')
+    parser.add_argument('--date', help='service date of the GTFS feed as YYYY-MM-DD (default: today)')
+    args = parser.parse_args(argv)
+
+    engine = HeadlessEngine(project_sources(args.project), args.cache or os.path.join(args.project, 'network_cache'))
+    timetable = None
+    if args.gtfs:
+        service_date = datetime.date.fromisoformat(args.date) if args.date else datetime.date.today()
+        # Requests may depart at any time of day, so trips running into the next day are loaded too
+        timetable = load_gtfs_timetable(args.gtfs, service_date, next_day=True)
+    service = IsochroneService(engine, args.workers, timetable)
+
+    async def serve():
+        server = await service.serve(args.port)
+        print(f"Serving on http://{service_host}:{args.port} with {args.workers} workers", flush=True)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+
+
+# Bumped whenever the arrays of a cached structure change meaning, so older caches are rebuilt
+cache_version = 1
+
+manifest_name = 'manifest.json'
+
+
+# Writes a structure's arrays to a cache directory as one .npy file each, with a manifest holding
+#   the cache version, the key of the sources it was built from and the file of every array
+#   The directory is written under a temporary name and renamed into place once complete,
+#   and other directories of structure_name (built from older sources) are removed
+def save_cached_arrays(directory, key, arrays, structure_name):
+    temp_directory = directory + '.tmp'
+    shutil.rmtree(temp_directory, ignore_errors=True)
+    os.makedirs(temp_directory)
+    files = {}
+    for i, (name, array) in enumerate(arrays.items()):
+        # Array names may hold characters that are not valid in file names
+        files[name] = f"{i:04d}.npy"
+        np.save(os.path.join(temp_directory, files[name]), np.ascontiguousarray(array))
+    with open(os.path.join(temp_directory, manifest_name), 'w') as f:
+        json.dump({'version': cache_version, 'key': key, 'files': files}, f)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temp_directory, directory)
+    prune_cache(os.path.dirname(directory), structure_name, os.path.basename(directory))
+
+
+# Loads the arrays of a cache directory, memory-mapped read-only unless mmap is False
+#   Returns None if the directory is missing, incomplete, from another cache version or built from other sources
+def load_cached_arrays(directory, key, mmap=True):
+    try:
+        with open(os.path.join(directory, manifest_name)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != cache_version or manifest.get('key') != key:
+        return None
+    try:
+        return {name: np.load(os.path.join(directory, file), mmap_mode='r' if mmap else None)
+                for name, file in manifest['files'].items()}
+    except (OSError, ValueError):
+        return None
+
+
+# Removes the cache directories of a structure name ("<name>_<first 16 hex digits of the key>") other than keep
+#   Names may share a prefix (block_columns_POP10 and block_columns_POP10_HU10), so only exact matches are removed
+def prune_cache(parent, name, keep):
+    pattern = re.compile(re.escape(name) + r'_[0-9a-f]{16}')
+    for entry in os.listdir(parent):
+        if entry != keep and pattern.fullmatch(entry) and os.path.isdir(os.path.join(parent, entry)):
+            shutil.rmtree(os.path.join(parent, entry), ignore_errors=True)
+
+
+# Checksums of the layers of source files, remembered on disk by file path, size and modification time
+#   so the layers of an unchanged file are never read again to check whether a cache is stale
+#   A changed file only has the layers asked for checksummed again, by compute(), so a cache built from
+#   layers whose contents did not change stays valid when other layers of the same file are edited.
+#   With no path the checksums are only remembered in memory
+class ChecksumStore:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.changed = False
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, TypeError, ValueError):
+            pass
+
+    def checksum(self, file_path, layer, compute):
+        stat = os.stat(file_path)
+        entry = self.entries.get(file_path)
+        if not entry or entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns or not isinstance(entry[2], dict):
+            entry = self.entries[file_path] = [stat.st_size, stat.st_mtime_ns, {}]
+        if layer not in entry[2]:
+            entry[2][layer] = compute()
+            self.changed = True
+        return entry[2][layer]
+
+    def save(self):
+        if not self.changed or self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(temp_path, self.path)
+        self.changed = False
@@ -3,7 +3,13 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingAlgorithm,
                        QgsProcessingException,
                         QgsProcessingParameterNumber,
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterDateTime,
+                       QgsProcessingParameterString,
                        QgsProcessingParameterVectorDestination,
+                       QgsProcessingParameterFileDestination,
                        QgsProcessingParameterFeatureSource,
                        QgsProcessingParameterField)
 from importlib import reload
@@ -27,7 +33,12 @@ class MultiTransitServiceArea(QgsProcessingAlgorithm):
 
 
     def shortHelpString(self):
-        return self.tr('Generates accurate public transit service areas for all points in a point layer given a time limit')
+        return self.tr('Generates accurate public transit service areas for all points in a point layer given a time limit. '
+                       'With a census block sums file, writes the sums of the chosen census block fields reachable '
+                       'from each point within each time limit to it instead. Searching back from the points as '
+                       'destinations writes the one catchment they can be reached from, and searching from every point '
+                       'at once writes their combined service area, optionally split by the fastest point to each '
+                       'block.')
 
     def initAlgorithm(self, config=None):
         self.addParameter(
@@ -54,6 +65,104 @@ class MultiTransitServiceArea(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterString(
+                'BANDS',
+                self.tr('Additional Time Limits (Minutes, comma separated)'),
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                'ENGINE',
+                self.tr('Search Engine'),
+                options=[self.tr('Node-by-node (Dijkstra)'), self.tr('Round-based (RAPTOR)'),
+                         self.tr('Timetable (GTFS connection scan)')],
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                'REVERSE',
+                self.tr('Treat the points as destinations and find the one catchment they are reachable from '
+                        '(round-based engine only)'),
+                defaultValue=False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                'UNION',
+                self.tr('Search from every point at once for their combined service area (round-based engine only)'),
+                defaultValue=False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                'LABEL_SOURCES',
+                self.tr('Split the combined service area by the fastest point to each block (needs combining)'),
+                defaultValue=False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'MAXTRANSFERS',
+                self.tr('Maximum Transfers (round-based engine only)'),
+                minValue=0,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                'GTFS',
+                self.tr('GTFS Feed Folder (timetable engine only)'),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterDateTime(
+                'DEPARTURE',
+                self.tr('Departure Date and Time (timetable engine only)'),
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'WORKERS',
+                self.tr('Worker Processes (round-based and timetable engines only)'),
+                minValue=1,
+                defaultValue=1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'SIMPLIFY',
+                self.tr('Output Simplification Tolerance (layer units)'),
+                type=QgsProcessingParameterNumber.Double,
+                minValue=0,
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'QUANTIZE',
+                self.tr('Output Coordinate Grid (layer units)'),
+                type=QgsProcessingParameterNumber.Double,
+                minValue=0,
+                defaultValue=0
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterVectorDestination(
                 'OUTPUT',
@@ -61,26 +170,178 @@ class MultiTransitServiceArea(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterString(
+                'DEMOGRAPHIC_FIELDS',
+                self.tr('Census Block Fields to Sum (comma separated)'),
+                defaultValue='POP10,HU10',
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                'DEMOGRAPHICS',
+                self.tr('Reachable Census Block Sums (instead of service areas)'),
+                fileFilter='CSV files (*.csv)',
+                optional=True,
+                createByDefault=False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                'TRACE',
+                self.tr('Stage Trace (Chrome trace JSON)'),
+                fileFilter='JSON files (*.json)',
+                optional=True,
+                createByDefault=False
+            )
+        )
+
     def processAlgorithm(self, parameters, context, feedback):
         start_locations = self.parameterAsSource(parameters, 'STARTLOCATIONS', context)
         search_time = self.parameterAsInt(parameters, 'SEARCHTIMELIMIT', context) / 60
+        try:
+            bands = ServiceAreaSearch.parse_time_bands(self.parameterAsString(parameters, 'BANDS', context),
+                                                       self.parameterAsInt(parameters, 'SEARCHTIMELIMIT', context))
+        except ValueError as e:
+            raise QgsProcessingException(self.tr(f'Invalid additional time limits: {e}'))
         name_field = parameters['NAME_FIELD']
+        engine = ServiceAreaSearch.search_engines[self.parameterAsEnum(parameters, 'ENGINE', context)]
+        max_transfers = None
+        if parameters.get('MAXTRANSFERS') is not None:
+            max_transfers = self.parameterAsInt(parameters, 'MAXTRANSFERS', context)
+        gtfs_path = self.parameterAsFile(parameters, 'GTFS', context)
+        departure = None
+        if engine == 'timetable':
+            if not gtfs_path or parameters.get('DEPARTURE') is None:
+                raise QgsProcessingException(self.tr('The timetable engine needs a GTFS feed folder and a departure time'))
+            departure = self.parameterAsDateTime(parameters, 'DEPARTURE', context).toPyDateTime()
+
+        reverse = self.parameterAsBool(parameters, 'REVERSE', context)
+        if reverse and engine != 'raptor':
+            raise QgsProcessingException(self.tr('Catchments of destinations need the round-based engine'))
+        union = self.parameterAsBool(parameters, 'UNION', context)
+        labeled = self.parameterAsBool(parameters, 'LABEL_SOURCES', context)
+        if union and engine != 'raptor':
+            raise QgsProcessingException(self.tr('Combined service areas need the round-based engine'))
+        if union and reverse:
+            raise QgsProcessingException(self.tr('Choose either a combined service area or a catchment of destinations'))
+        if labeled and not union:
+            raise QgsProcessingException(self.tr('Splitting by the fastest point needs a combined service area'))
+
+        workers = self.parameterAsInt(parameters, 'WORKERS', context)
+        if workers > 1 and engine == 'dijkstra':
+            feedback.pushInfo(self.tr('The node-by-node engine runs in QGIS only, searching points one at a time'))
+            workers = 1
+
+        demographics_path = self.parameterAsFileOutput(parameters, 'DEMOGRAPHICS', context)
+        if demographics_path:
+            if engine == 'dijkstra':
+                raise QgsProcessingException(self.tr('Census block sums need the round-based or timetable engine'))
+            fields = [field.strip() for field in
+                      self.parameterAsString(parameters, 'DEMOGRAPHIC_FIELDS', context).split(',') if field.strip()]
+            if not fields:
+                raise QgsProcessingException(self.tr('Census block sums need at least one field'))
 
+        trace_path = self.parameterAsFileOutput(parameters, 'TRACE', context)
+        ServiceAreaSearch.begin_trace(trace_path)
+        if demographics_path:
+            try:
+                self.sum_points(start_locations, name_field, search_time, context, feedback, engine, workers,
+                                demographics_path, fields, max_transfers, gtfs_path, departure, bands)
+            except ValueError as e:
+                raise QgsProcessingException(str(e))
+            finally:
+                ServiceAreaSearch.end_trace(trace_path)
+            results = {'DEMOGRAPHICS': demographics_path}
+            if trace_path:
+                results['TRACE'] = trace_path
+            return results
+
+        try:
+            output_path = ServiceAreaSearch.open_result_writer(
+                self.parameterAsOutputLayer(parameters, 'OUTPUT', context),
+                self.parameterAsDouble(parameters, 'SIMPLIFY', context),
+                self.parameterAsDouble(parameters, 'QUANTIZE', context))
+            if reverse:
+                self.search_destinations(start_locations, search_time, context, feedback, max_transfers, bands)
+            elif union:
+                self.search_union(start_locations, name_field, search_time, context, feedback, max_transfers,
+                                  bands, labeled)
+            else:
+                self.search_points(start_locations, name_field, search_time, context, feedback, engine, workers,
+                                   max_transfers, gtfs_path, departure, bands)
+        finally:
+            ServiceAreaSearch.close_result_writer()
+            ServiceAreaSearch.end_trace(trace_path)
+
+        results = {'OUTPUT': output_path}
+        if trace_path:
+            results['TRACE'] = trace_path
+        return results
+
+    def search_points(self, start_locations, name_field, search_time, context, feedback, engine, workers,
+                      max_transfers, gtfs_path, departure, bands):
         crs = start_locations.sourceCrs()
         points = start_locations.getFeatures()
         point_count = 0
+        origins = []
         for point in points:
             if feedback.isCanceled():
-                return {}
+                return
 
             name = point[name_field] if point[name_field] is not None else f"Point {point_count}"
             coord = point.geometry().asPoint()
             start_location = f"{coord.x()},{coord.y()} [{crs.authid()}]"
+            point_count = point_count+1
 
-            ServiceAreaSearch.main(name, start_location, search_time, context, feedback)
+            if workers > 1:
+                origins.append((name, start_location))
+                continue
 
-            point_count = point_count+1
+            ServiceAreaSearch.main(name, start_location, search_time, context, feedback, engine, max_transfers,
+                                   gtfs_path, departure, bands)
 
+        if origins:
+            ServiceAreaSearch.main_batch(origins, search_time, context, feedback, engine, workers, max_transfers,
+                                         gtfs_path, departure, bands)
 
+    def search_destinations(self, start_locations, search_time, context, feedback, max_transfers, bands):
+        crs = start_locations.sourceCrs()
+        destinations = []
+        for point in start_locations.getFeatures():
+            coord = point.geometry().asPoint()
+            destinations.append(f"{coord.x()},{coord.y()} [{crs.authid()}]")
+        if not destinations:
+            return
+
+        ServiceAreaSearch.main_reverse(f"Catchment of {len(destinations)} destinations", destinations, search_time,
+                                       context, feedback, max_transfers, bands)
+
+    def search_union(self, start_locations, name_field, search_time, context, feedback, max_transfers, bands,
+                     labeled):
+        crs = start_locations.sourceCrs()
+        origins = []
+        for point in start_locations.getFeatures():
+            name = point[name_field] if name_field and point[name_field] is not None else f"Point {len(origins)}"
+            coord = point.geometry().asPoint()
+            origins.append((name, f"{coord.x()},{coord.y()} [{crs.authid()}]"))
+        if not origins:
+            return
+
+        ServiceAreaSearch.main_union(f"Combined service area of {len(origins)} points", origins, search_time,
+                                     context, feedback, max_transfers, bands, labeled)
+
+    def sum_points(self, start_locations, name_field, search_time, context, feedback, engine, workers, path,
+                   fields, max_transfers, gtfs_path, departure, bands):
+        crs = start_locations.sourceCrs()
+        origins = []
+        for point in start_locations.getFeatures():
+            name = point[name_field] if name_field and point[name_field] is not None else f"Point {len(origins)}"
+            coord = point.geometry().asPoint()
+            origins.append((name, f"{coord.x()},{coord.y()} [{crs.authid()}]"))
 
-        return {}
\ No newline at end of file
+        ServiceAreaSearch.main_sums(origins, search_time, context, feedback, engine, workers, path, fields,
+                                    max_transfers, gtfs_path, departure, bands)
\ No newline at end of file
@@ -3,7 +3,12 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingAlgorithm,
                        QgsProcessingException,
                         QgsProcessingParameterNumber,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterDateTime,
+                       QgsProcessingParameterString,
                        QgsProcessingParameterVectorDestination,
+                       QgsProcessingParameterFileDestination,
                        QgsProcessingParameterPoint)
 from importlib import reload
 import ServiceAreaSearch
@@ -43,6 +48,70 @@ class TransitServiceArea(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterString(
+                'BANDS',
+                self.tr('Additional Time Limits (Minutes, comma separated)'),
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                'ENGINE',
+                self.tr('Search Engine'),
+                options=[self.tr('Node-by-node (Dijkstra)'), self.tr('Round-based (RAPTOR)'),
+                         self.tr('Timetable (GTFS connection scan)')],
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'MAXTRANSFERS',
+                self.tr('Maximum Transfers (round-based engine only)'),
+                minValue=0,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                'GTFS',
+                self.tr('GTFS Feed Folder (timetable engine only)'),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterDateTime(
+                'DEPARTURE',
+                self.tr('Departure Date and Time (timetable engine only)'),
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'SIMPLIFY',
+                self.tr('Output Simplification Tolerance (layer units)'),
+                type=QgsProcessingParameterNumber.Double,
+                minValue=0,
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'QUANTIZE',
+                self.tr('Output Coordinate Grid (layer units)'),
+                type=QgsProcessingParameterNumber.Double,
+                minValue=0,
+                defaultValue=0
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterVectorDestination(
                 'OUTPUT',
@@ -50,15 +119,55 @@ class TransitServiceArea(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                'TRACE',
+                self.tr('Stage Trace (Chrome trace JSON)'),
+                fileFilter='JSON files (*.json)',
+                optional=True,
+                createByDefault=False
+            )
+        )
+
     def processAlgorithm(self, parameters, context, feedback):
         start_location = self.parameterAsString(parameters, 'STARTLOCATION', context)
         search_time_min = self.parameterAsInt(parameters, 'SEARCHTIMELIMIT', context)
         search_time_hour = search_time_min/ 60
+        try:
+            bands = ServiceAreaSearch.parse_time_bands(self.parameterAsString(parameters, 'BANDS', context),
+                                                       search_time_min)
+        except ValueError as e:
+            raise QgsProcessingException(self.tr(f'Invalid additional time limits: {e}'))
+        engine = ServiceAreaSearch.search_engines[self.parameterAsEnum(parameters, 'ENGINE', context)]
+        max_transfers = None
+        if parameters.get('MAXTRANSFERS') is not None:
+            max_transfers = self.parameterAsInt(parameters, 'MAXTRANSFERS', context)
+        gtfs_path = self.parameterAsFile(parameters, 'GTFS', context)
+        departure = None
+        if engine == 'timetable':
+            if not gtfs_path or parameters.get('DEPARTURE') is None:
+                raise QgsProcessingException(self.tr('The timetable engine needs a GTFS feed folder and a departure time'))
+            departure = self.parameterAsDateTime(parameters, 'DEPARTURE', context).toPyDateTime()
         name = f"Point - {search_time_min} minute service area"
         if feedback.isCanceled():
             return {}
 
+        trace_path = self.parameterAsFileOutput(parameters, 'TRACE', context)
+
         #print(f"Start Location: {start_location}")
-        ServiceAreaSearch.main(name, start_location, search_time_hour, context, feedback)
+        ServiceAreaSearch.begin_trace(trace_path)
+        try:
+            output_path = ServiceAreaSearch.open_result_writer(
+                self.parameterAsOutputLayer(parameters, 'OUTPUT', context),
+                self.parameterAsDouble(parameters, 'SIMPLIFY', context),
+                self.parameterAsDouble(parameters, 'QUANTIZE', context))
+            ServiceAreaSearch.main(name, start_location, search_time_hour, context, feedback, engine, max_transfers,
+                                   gtfs_path, departure, bands)
+        finally:
+            ServiceAreaSearch.close_result_writer()
+            ServiceAreaSearch.end_trace(trace_path)
 
-        return {}
\ No newline at end of file
+        results = {'OUTPUT': output_path}
+        if trace_path:
+            results['TRACE'] = trace_path
+        return results
\ No newline at end of file
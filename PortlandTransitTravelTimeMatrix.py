@@ -0,0 +1,146 @@
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessing,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingException,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterDateTime,
+                       QgsProcessingParameterFolderDestination,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterField)
+from importlib import reload
+import ServiceAreaSearch
+reload(ServiceAreaSearch)
+
+# The engines able to find the time to every census block, as listed in the ENGINE parameter
+matrix_engines = ['raptor', 'timetable']
+
+
+class TransitTravelTimeMatrix(QgsProcessingAlgorithm):
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return TransitTravelTimeMatrix()
+
+    def name(self):
+        return 'transittraveltimematrix'
+
+    def displayName(self):
+        return self.tr('Transit Travel Time Matrix')
+
+
+    def shortHelpString(self):
+        return self.tr('Writes the travel time in whole minutes from every point in a point layer to every census '
+                       'block as a uint16 matrix (travel_times.npy), with origins.csv and blocks.csv naming its '
+                       'rows and columns. Blocks not reached within the time limit hold 65535.')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                'STARTLOCATIONS',
+                self.tr('Vector Layer Representing Search Points'),
+                [QgsProcessing.TypeVectorPoint]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterField(
+                'NAME_FIELD',
+                self.tr('Location Name Field'),
+                parentLayerParameterName='STARTLOCATIONS',
+                optional=True,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'SEARCHTIMELIMIT',
+                self.tr('Search Time Limit (Minutes)')
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                'ENGINE',
+                self.tr('Search Engine'),
+                options=[self.tr('Round-based (RAPTOR)'), self.tr('Timetable (GTFS connection scan)')],
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'MAXTRANSFERS',
+                self.tr('Maximum Transfers (round-based engine only)'),
+                minValue=0,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                'GTFS',
+                self.tr('GTFS Feed Folder (timetable engine only)'),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterDateTime(
+                'DEPARTURE',
+                self.tr('Departure Date and Time (timetable engine only)'),
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'WORKERS',
+                self.tr('Worker Processes'),
+                minValue=1,
+                defaultValue=1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                'OUTPUT',
+                self.tr('Matrix Folder')
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        start_locations = self.parameterAsSource(parameters, 'STARTLOCATIONS', context)
+        search_time = self.parameterAsInt(parameters, 'SEARCHTIMELIMIT', context) / 60
+        name_field = parameters['NAME_FIELD']
+        engine = matrix_engines[self.parameterAsEnum(parameters, 'ENGINE', context)]
+        max_transfers = None
+        if parameters.get('MAXTRANSFERS') is not None:
+            max_transfers = self.parameterAsInt(parameters, 'MAXTRANSFERS', context)
+        gtfs_path = self.parameterAsFile(parameters, 'GTFS', context)
+        departure = None
+        if engine == 'timetable':
+            if not gtfs_path or parameters.get('DEPARTURE') is None:
+                raise QgsProcessingException(self.tr('The timetable engine needs a GTFS feed folder and a departure time'))
+            departure = self.parameterAsDateTime(parameters, 'DEPARTURE', context).toPyDateTime()
+        workers = self.parameterAsInt(parameters, 'WORKERS', context)
+        directory = self.parameterAsString(parameters, 'OUTPUT', context)
+
+        crs = start_locations.sourceCrs()
+        origins = []
+        for point in start_locations.getFeatures():
+            name = point[name_field] if name_field and point[name_field] is not None else f"Point {len(origins)}"
+            coord = point.geometry().asPoint()
+            origins.append((name, f"{coord.x()},{coord.y()} [{crs.authid()}]"))
+
+        try:
+            ServiceAreaSearch.main_matrix(origins, search_time, context, feedback, engine, workers, directory,
+                                          max_transfers, gtfs_path, departure)
+        except ValueError as e:
+            raise QgsProcessingException(str(e))
+
+        return {'OUTPUT': directory}
@@ -1,17 +1,27 @@
-import select
-from qgis.core import (QgsProcessing,
-                       QgsProcessingException,
-                       QgsProcessingAlgorithm,
+import os
+import time
+from qgis.core import (QgsProcessingException,
                        QgsFeature,
+                       QgsField,
+                       QgsFields,
                        QgsProject, 
-                       QgsProcessingFeatureSourceDefinition,
                        QgsFeatureRequest,
-                       QgsExpression,
                        QgsVectorLayer,
                        QgsGeometry,
                        QgsPointXY,
-                       QgsVectorFileWriter)
-from qgis import processing
+                       QgsVectorFileWriter,
+                       QgsCoordinateReferenceSystem,
+                       QgsCoordinateTransform,
+                       QgsWkbTypes)
+from qgis.PyQt.QtCore import QVariant
+
+from TransitIndex import build_headway_table
+from TransitNetwork import TransitNetwork
+from GtfsTimetable import load_gtfs_timetable
+from HeadlessEngine import HeadlessEngine, NetworkSources
+from ResultCache import ResultCache
+from ResultWriter import ResultWriter, is_geopackage, output_destination
+from Tracing import feature_count, traced
 
 streets_name = '1HrWalkableRoads_NoHighways'
 route_stops_name = 'trimet_route_stops'
@@ -30,280 +40,259 @@ walk_feet_per_hour = 14784  #feet walkable in one hour \
 walk_km_per_hour = 4.50616
 ft_to_m = 3.28084
 
+transfer_time_limit = 1  # hours of walking precomputed between stops
+block_distance = 10  # feet between a reached street and the census blocks it gives access to
+result_cache_memory = 256 * 2**20  # bytes of search results kept in memory
+result_cache_disk = 2 * 2**30  # bytes of search results kept in the network cache
+origin_tolerance = 1  # feet along a street within which origins share cached search results
+
+engine = None
+headway_table = None
+result_cache = None
+result_writer = None
+cache_directory_name = 'network_cache'  # next to the streets GeoPackage
+gtfs_timetables = {}
+
+
+# Route stops reachable on foot from a search node in the time remaining, as path records
+#   Walks between stops are looked up from the precomputed transfer table when it covers the time remaining.
+#   No geometry is built here; the search builds its service area once it has finished.
+@traced('walk search', node=lambda start_node, time_limit: start_node.id, features_out=feature_count)
+def get_reachable_stops_walking(start_node, time_limit):
+    time_remaining = time_limit - start_node.time
+    transfers = get_transfer_table()
+    if not start_node.is_search_origin and transfers.covers(time_remaining):
+        return get_transfer_paths(transfers, start_node.id, time_remaining)
 
-
-#finds the time to reach each stop within a street network
-def find_stops_walking(start_node, network, stops, context, feedback):
-    # get the coordinates as a string from the start node
-    lat_lon_str = start_node.get_coord_string()
-
-    # Note: due to this algorithm calculating distances on these layers in feet,
-    #   we have to multiply the km/hr by ft_to_meters to get the correct times
-    #print(f"FSW - network type: {type(network)}, feature count = {network.featureCount()}")
-    #print(f"FSW - stops type: {type(stops)}, feature count = {stops.featureCount()}")
-    #print(f"FSW - lat_lon_str: {lat_lon_str}")
-    #print(f"FSW - default speed: {ft_to_m * walk_km_per_hour}")
-    reachable_stops_id = processing.run("native:shortestpathpointtolayer",
-                                     {'INPUT':network,'STRATEGY': 1,
-                                      'DIRECTION_FIELD':'','VALUE_FORWARD':'',
-                                      'VALUE_BACKWARD':'','VALUE_BOTH':'',
-                                      'DEFAULT_DIRECTION':2,'SPEED_FIELD':'',
-                                      'DEFAULT_SPEED': ft_to_m * walk_km_per_hour,
-                                      'TOLERANCE':0,'START_POINT':lat_lon_str,
-                                      'END_POINTS':stops, 'OUTPUT':'TEMPORARY_OUTPUT'},
-                                    is_child_algorithm=True,
-                                    context=context,
-                                    feedback=feedback)['OUTPUT']
-    reachable_stops = context.getMapLayer(reachable_stops_id)
-    reachable_stops.setName(f"walking_routes from id {start_node.id}")
-    #QgsProject.instance().addMapLayer(reachable_stops)
-    return reachable_stops
-
-
-
-def find_stops_transit(start_node, route, stops, context, feedback):
-    # Select the starting stop by pulling it from the stops layer
-    #start_stop = next(route_stops_layer.getFeatures(QgsFeatureRequest().setFilterFid(start_node.id)))
-
-    # Get the starting coordinates as a string from the start node
-    lat_lon_str = start_node.get_coord_string()
-
-    # Get the path to the route and stops
-    #   (Necessary for running this process with only selected features)
-    #route_uri = route.dataProvider().dataSourceUri()
-    #stops_uri = stops.dataProvider().dataSourceUri()
-
-    direction = start_node.dir
-    reverse = 1 if direction == 0 else 0
-    routes_to_stops_id = processing.run("native:shortestpathpointtolayer",
-                                     {'INPUT': route,
-                                     'STRATEGY': 1, 'DIRECTION_FIELD': 'DIR', 'VALUE_FORWARD': direction,
-                                     'VALUE_BACKWARD': reverse, 'VALUE_BOTH': '', 'DEFAULT_DIRECTION': direction,
-                                     'SPEED_FIELD': 'KILO_FT_PER_HOUR', 'DEFAULT_SPEED': 1, 'TOLERANCE': 0,
-                                     'START_POINT': lat_lon_str,
-                                     'END_POINTS': stops,
-                                    'OUTPUT': 'TEMPORARY_OUTPUT'},
-                                    is_child_algorithm=True,
-                                    context=context,
-                                    feedback=feedback)['OUTPUT']
-    routes_to_stops = context.getMapLayer(routes_to_stops_id)
-    routes_to_stops.setName(f"transit_routes from id {start_node.id}")
-    #QgsProject.instance().addMapLayer(routes_to_stops)
-    return routes_to_stops
-
-
-
-def get_reachable_stops_walking(start_node, time_limit, total_service_area, context, feedback):
-    # Create buffer around start point with radius of
     # The maximum distance walkable with time remaining
-    max_distance = walk_feet_per_hour * (time_limit - start_node.time)
+    graph = get_street_graph()
+    max_distance = walk_feet_per_hour * time_remaining
     if start_node.is_search_origin:
-        buffer = create_origin_buffer(start_node, max_distance, context, feedback)
+        x, y = coord_string_to_street_point(start_node.get_coord_string())
+        seeds = graph.snap(x, y)
     else:
-        buffer = create_buffer(start_node, max_distance, context, feedback)
+        seeds = graph.point_seeds(stops_name, start_node.id)
 
-    if not buffer:
-        print("No buffer, returning empty from get_reachable_stops_walking")
+    if not seeds:
+        print("Node not on street network, returning empty from get_reachable_stops_walking")
         return
 
-    #QgsProject.instance().addMapLayer(buffer)
+    # A walk from a stop is the same whatever time it starts at, so repeated walks come from the walk cache
+    if not start_node.is_search_origin:
+        return get_route_stop_paths(get_walk_cache().reachable(stops_name, start_node.id, route_stops_name,
+                                                               time_remaining, time_limit))
 
-    # Clip the street layer to only search relevant streets
-    nearby_streets = clip_layer(street_layer, buffer, "clipped streets", context, feedback)
-    #QgsProject.instance().addMapLayer(nearby_streets)
-    
+    # Search the network to find all reachable stops
+    return get_walking_paths(graph, graph.reach(seeds, max_distance))
 
-    # Clip stop layer to only search relevant stops
-    nearby_stops = clip_layer(route_stops_layer, buffer, "clipped stops", context, feedback)
-    #QgsProject.instance().addMapLayer(nearby_stops)
 
-    # Search the network to find all reachable stops
-    search_routes = find_stops_walking(start_node, nearby_streets, nearby_stops, context, feedback)
 
-    # Get rid of all stops that exceed the time remaining
-    remove_unreachable_stops(search_routes, start_node.time, time_limit)
+@traced('transit search', node=lambda start_node, time_limit: start_node.id,
+        features_out=lambda result: len(result[0]))
+def get_reachable_stops_transit(start_node, time_limit):
+    patterns = get_route_patterns()
 
-    # Get the walking service area from that node (not just the paths to nearby stops
-    # but all street segments reachable from the node)
-    local_service_area = create_walking_service_area(start_node, nearby_streets, time_limit, context, feedback)
-    new_total_service_area = save_service_area(total_service_area, local_service_area, context, feedback)
+    # Ride the start node's route to every downstream stop reachable in the time remaining
+    rides = patterns.ride(start_node.id, time_limit - start_node.time)
+    search_routes = get_route_stop_paths(rides)
 
+    # The portion of the route ridden, as (from route stop fid, to route stop fid)
+    ridden_span = (start_node.id, rides[-1][0]) if rides else None
 
-    #QgsProject.instance().addMapLayer(search_routes)
+    return search_routes, ridden_span
 
-    return search_routes, new_total_service_area
 
 
+# Lines layer of the covered parts of street edges, each given as (edge, start distance, end distance)
+@traced('create reached streets layer', features_in=lambda graph, reached_edges: len(reached_edges),
+        features_out=feature_count)
+def create_reached_streets_layer(graph, reached_edges):
+    segments = [graph.edge_segment(edge, start, end) for edge, start, end in reached_edges]
+    if not segments:
+        return None
+    return create_lines_layer(segments, street_layer.crs(), "walking service area")
 
-def get_reachable_stops_transit(start_node, time_limit, total_service_area, context, feedback):
 
-    # Select the route and stops that match the start node's rte and dir
-    isolated_route = extract_by_route(routes_layer, start_node.rte, start_node.dir, context, feedback)
-    isolated_stops = extract_by_route(route_stops_layer, start_node.rte, start_node.dir, context, feedback)
 
-    # Get the paths (portions of the route) from the start node to all stops on the route
-    search_routes = find_stops_transit(start_node, isolated_route, isolated_stops, context, feedback)
+# Turns a list of (route stop fid, cost in hours) into path records
+#   Records carry the same fields the search reads from the shortest path layers
+def get_route_stop_paths(reached):
+    index = get_stop_index()
+    return [index.route_stop_path(fid, cost) for fid, cost in reached]
 
-    # Get rid of all stops that exceed the time remaining
-    remove_unreachable_stops(search_routes, start_node.time, time_limit)
 
-    new_total_service_area = save_service_area(total_service_area, search_routes, context, feedback)
+# Path records for the route stops found by a street graph search, sorted by ascending cost
+def get_walking_paths(graph, distances):
+    return get_route_stop_paths([(fid, distance / walk_feet_per_hour)
+                                 for fid, distance in graph.reached_points(route_stops_name, distances)])
 
-    #QgsProject.instance().addMapLayer(search_routes)
 
-    return search_routes, new_total_service_area
+# Path records for the route stops reachable from a stop according to the transfer table
+def get_transfer_paths(transfers, stop_fid, time_remaining):
+    return get_route_stop_paths(transfers.transfers(stop_fid, route_stops_name, time_remaining))
 
 
 
-def create_walking_service_area(start_node, streets, total_time, context, feedback):
-    lat_lon_str = start_node.get_coord_string()
-    #print(f"CWSA - streets type: {type(streets)}, feature count = {streets.featureCount()}")
-    service_area_id = processing.run("native:serviceareafrompoint", {
-        'INPUT': streets,
-        'STRATEGY': 1, 'DIRECTION_FIELD': '', 'VALUE_FORWARD': '', 'VALUE_BACKWARD': '', 'VALUE_BOTH': '',
-        'DEFAULT_DIRECTION': 2, 'SPEED_FIELD': '', 'DEFAULT_SPEED': ft_to_m * walk_km_per_hour, 'TOLERANCE': 0,
-        'START_POINT': lat_lon_str, 'TRAVEL_COST2': total_time - start_node.time, 'INCLUDE_BOUNDS': False,
-        'OUTPUT_LINES': 'TEMPORARY_OUTPUT'},
-        is_child_algorithm=True,
-        context=context,
-        feedback=feedback)['OUTPUT_LINES']
-    service_area = context.getMapLayer(service_area_id)
-    return service_area
+# ********************************************************************************************************
 
+# The prebuilt structures are built, cached and held by a headless engine reading the GeoPackages
+#   behind the project's layers (see HeadlessEngine), so the plugin and scripts outside QGIS share one cache
+def get_engine():
+    global engine
+    if engine is None:
+        sources = NetworkSources(layer_source(street_layer), layer_source(route_stops_layer), layer_source(stops_layer),
+                                 layer_source(routes_layer), layer_source(blocks_layer))
+        engine = HeadlessEngine(sources, cache_directory(), walk_feet_per_hour, transfer_time_limit, block_distance,
+                                qgis_transformer)
+    return engine
 
 
-def save_service_area(total_area, new_area, context, feedback):
+def cache_directory():
+    return os.path.join(os.path.dirname(layer_source(street_layer)[0]), cache_directory_name)
 
-    if total_area is None:
-        total_area = new_area
-    else:
-        #print(f"SSA - total_area type: {type(total_area)}, feature count = {total_area.featureCount()}")
-        #print(f"SSA - new_area type: {type(new_area)}, feature count = {new_area.featureCount()}")
-        total_area_id = processing.run("native:mergevectorlayers", {
-            'LAYERS': [total_area,
-                       new_area], 'CRS': None,
-            'OUTPUT': 'TEMPORARY_OUTPUT'},
-            is_child_algorithm=True,
-            context=context,
-            feedback=feedback)['OUTPUT']
-        total_area = context.getMapLayer(total_area_id)
 
-        if total_area.featureCount() > 7:
-            total_area = dissolve_layer(total_area, context, feedback)
-    return total_area
+# (GeoPackage path, layer name) a layer is read from
+def layer_source(layer):
+    parts = layer.source().split('|')
+    for part in parts[1:]:
+        if part.startswith('layername='):
+            return parts[0], part[len('layername='):]
+    return parts[0], layer.name()
 
 
+# Coordinate transformation for the engine through QGIS, using the project's transform context
+def qgis_transformer(source_authid, target_authid):
+    transform = QgsCoordinateTransform(QgsCoordinateReferenceSystem(source_authid),
+                                       QgsCoordinateReferenceSystem(target_authid), QgsProject.instance())
 
-# ********************************************************************************************************
+    def convert(points):
+        converted = [transform.transform(QgsPointXY(*point)) for point in points]
+        return [(p.x(), p.y()) for p in converted]
+    return convert
 
-# Create buffer around the point indicated by a node's layer and id
-# Returns the vector layer containing the buffer
-def create_buffer(node, distance, context, feedback):
-    #print(f"   Creating buffer at coord {node.get_coord_string()} with distance {distance}")
-    select_feature_by_attribute(node.layer, 'fid', node.id, context, feedback)
-    node_extracted = extract_selection(node.layer, context, feedback)
-    
-    buffer_id = processing.run("native:buffer",
-        {'INPUT': node_extracted,
-        'DISTANCE':distance,
-        'SEGMENTS':5,
-        'END_CAP_STYLE':0,'JOIN_STYLE':0,'MITER_LIMIT':2,
-        'DISSOLVE':False,'OUTPUT':'memory:'},
-        is_child_algorithm=True,
-        context=context,
-        feedback=feedback)['OUTPUT']
-    if not buffer_id or not context:
-        return
-    buffer = context.getMapLayer(buffer_id)
-    node.layer.removeSelection()
-    #QgsProject.instance().addMapLayer(buffer)
-    return buffer
+
+# The street network is loaded into an in-memory graph once per session
+#   Both stop layers are snapped into it so walks can start and end at stops
+def get_street_graph():
+    return get_engine().street_graph()
+
+
+# Walks from stops beyond the transfer table are kept for the session and reused by every search (see WalkCache)
+def get_walk_cache():
+    return get_engine().walk_cache()
+
+
+# Stop-to-stop and stop-to-route-stop walking times are computed once for the current layers
+def get_transfer_table():
+    return get_engine().transfer_table()
+
+
+# Ordered stops and in-vehicle times of every route
+def get_route_patterns():
+    return get_engine().route_patterns()
+
+
+# Expected waits for every route, built once per session
+#   The table is refreshed whenever the routes layer's data changes
+def get_headway_table():
+    global headway_table
+    if headway_table is None:
+        headway_table = build_headway_table(routes_headway_rows())
+        routes_layer.dataChanged.connect(refresh_headway_table)
+    return headway_table
+
+
+def refresh_headway_table():
+    if headway_table is not None:
+        headway_table.refresh(routes_headway_rows())
+
+
+def routes_headway_rows():
+    return [(f['rte'], f['dir'], f['TRIPS_PER_HOUR']) for f in routes_layer.getFeatures()]
 
 
-def create_origin_buffer(node, distance, context, feedback):
-    coord = node.get_coord_string().split()[0]
-    coord_lat = float(coord.split(',')[0])
-    coord_lon = float(coord.split(',')[1])
-    crs = node.get_coord_string().split()[1].split('[')[1]
-    crs = crs.split(']')[0]
+# Bundle of every prebuilt structure a search engine needs
+#   blocks adds where each census block is reached along the streets, for travel time matrices,
+#   and block_fields the census blocks' values of those fields, for block sums
+def get_transit_network(blocks=False, block_fields=None):
+    return TransitNetwork(get_street_graph(), get_transfer_table(), get_route_patterns(), get_headway_table(),
+                          get_stop_index(), walk_feet_per_hour, stops_name, route_stops_name,
+                          get_engine().block_reach() if blocks or block_fields else None,
+                          get_engine().block_columns(block_fields) if block_fields else None,
+                          get_walk_cache())
 
-    url = "point?crs=" + crs
-    layer = QgsVectorLayer(url, "init_point", "memory")
 
+# Results of earlier searches, shared by every search of the session and kept on disk between sessions
+def get_result_cache():
+    global result_cache
+    if result_cache is None:
+        result_cache = ResultCache(result_cache_memory, result_cache_disk,
+                                   os.path.join(cache_directory(), 'results'))
+    return result_cache
+
+
+# Identifies the network and headways a search result was found on, so edits invalidate cached results
+def get_network_version():
+    return get_engine().network_version(get_headway_table())
+
+
+# GTFS timetables are loaded once per session for each feed and service date,
+#   with or without the next day's trips (see load_gtfs_timetable)
+def get_gtfs_timetable(path, service_date, next_day=False):
+    key = (os.path.abspath(path), service_date, next_day)
+    if key not in gtfs_timetables:
+        start_time = time.perf_counter()
+        gtfs_timetables[key] = load_gtfs_timetable(path, service_date, next_day)
+        print(f"Loaded {gtfs_timetables[key].connection_count()} connections for {service_date} "
+              f"in {time.perf_counter() - start_time:.1f}s")
+    return gtfs_timetables[key]
+
+
+# Identifier translation between route stops, stop_ids and stops
+def get_stop_index():
+    return get_engine().stop_index()
+
+
+# Converts an "x,y [EPSG:xxxx]" string to a point in the street layer's crs
+def coord_string_to_street_point(coord_string):
+    parts = coord_string.split()
+    x, y = (float(c) for c in parts[0].split(','))
+    if len(parts) > 1:
+        crs = QgsCoordinateReferenceSystem(parts[1].strip('[]'))
+        if crs.isValid() and crs != street_layer.crs():
+            transform = QgsCoordinateTransform(crs, street_layer.crs(), QgsProject.instance())
+            point = transform.transform(QgsPointXY(x, y))
+            return point.x(), point.y()
+    return x, y
+
+
+# Builds a memory layer holding a single multi-line feature from a list of lines, each a sequence of (x, y)
+@traced('create lines layer', features_in=lambda lines, crs, name: len(lines), features_out=feature_count)
+def create_lines_layer(lines, crs, name):
+    layer = QgsVectorLayer(f"MultiLineString?crs={crs.authid()}", name, "memory")
     feat = QgsFeature()
-    feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(coord_lat, coord_lon)))
+    feat.setGeometry(QgsGeometry.fromMultiPolylineXY(
+        [[QgsPointXY(*coord) for coord in line] for line in lines]))
+    layer.dataProvider().addFeatures([feat])
+    return layer
+
+
+# Census blocks within block_distance of the reached streets, each given as (edge, start distance, end distance)
+@traced('get nearby blocks', features_in=lambda reached_edges: len(reached_edges), features_out=feature_count)
+def get_nearby_blocks(reached_edges):
+    return create_blocks_layer(get_engine().reached_blocks(reached_edges))
+
+
+# Memory layer holding copies of the census blocks with the given fids
+def create_blocks_layer(fids):
+    layer = QgsVectorLayer(f"{QgsWkbTypes.displayString(blocks_layer.wkbType())}?crs={blocks_layer.crs().authid()}",
+                           "accessible blocks", "memory")
     provider = layer.dataProvider()
-    provider.addFeatures([feat])
-
-    #print(f"COB - layer type: {type(layer)}, feature count = {layer.featureCount()}")
-    buffer_id = processing.run("native:buffer",
-                            {'INPUT': layer,
-                             'DISTANCE': distance,
-                             'SEGMENTS': 5,
-                             'END_CAP_STYLE': 0, 'JOIN_STYLE': 0, 'MITER_LIMIT': 2,
-                             'DISSOLVE': False, 'OUTPUT': 'memory:'},
-                            is_child_algorithm=True,
-                            context=context,
-                            feedback=feedback)['OUTPUT']
-    buffer_output = context.getMapLayer(buffer_id)
-    #QgsProject.instance().addMapLayer(buffer)
-    #QgsProject.instance().addMapLayer(layer)
-    return buffer_output
-
-
-#clips a layer to a buffer
-def clip_layer(layer, overlay, name, context, feedback):
-    #print(f"CLIPLAYER - layer type: {type(layer)}, feature count = {layer.featureCount()}")
-    #print(f"CLIPLAYER - overlay type: {type(overlay)}, feature count = {overlay.featureCount()}")
-    #if overlay.featureCount() == 1:
-        #feat = next(overlay.getFeatures())
-        #print(feat)
-        #print(feat.geometry())
-    clipped_id = processing.run("native:clip",
-                            {'INPUT': layer, 'OVERLAY':overlay,
-                            'OUTPUT': 'memory:'},
-                            is_child_algorithm=True,
-                            context=context,
-                            feedback=feedback)['OUTPUT']
-    clipped = context.getMapLayer(clipped_id)
-    clipped.setName(name)
-    #QgsProject.instance().addMapLayer(clipped)
-    return clipped
-
-
-def dissolve_layer(layer, context, feedback):
-    #print(f"DISSOLVE - layer type: {type(layer)}, feature count = {layer.featureCount()}")
-    dissolved_id =  processing.run("native:dissolve", {
-        'INPUT': layer, 'FIELD': [], 'SEPARATE_DISJOINT': False,
-        'OUTPUT': 'TEMPORARY_OUTPUT'},
-        is_child_algorithm=True,
-        context=context,
-        feedback=feedback)['OUTPUT']
-    return context.getMapLayer(dissolved_id)
-
-
-def polygonize(layer, context, feedback):
-    #print(f"POLYGONIZE - layer type: {type(layer)}, feature count = {layer.featureCount()}")
-    polygons_id = processing.run("native:polygonize",
-                   {'INPUT':layer,'KEEP_FIELDS':False,
-                    'OUTPUT':'TEMPORARY_OUTPUT'},
-                    is_child_algorithm=True,
-                    context=context,
-                    feedback=feedback)['OUTPUT']
-    polygons = context.getMapLayer(polygons_id)
-
-    return dissolve_layer(polygons, context, feedback)
-
-#return blocks within 10 ft of a feature
-def get_nearby_blocks(feature, context, feedback):
-    blocks_id = processing.run("native:extractwithindistance", 
-                   {'INPUT':blocks_layer,
-                    'REFERENCE':feature,'DISTANCE':10,
-                    'OUTPUT':'TEMPORARY_OUTPUT'},
-                    is_child_algorithm=True,
-                    context=context,
-                    feedback=feedback)['OUTPUT']
-    return context.getMapLayer(blocks_id)
+    provider.addAttributes(blocks_layer.fields().toList())
+    layer.updateFields()
+    if fids:
+        provider.addFeatures(list(blocks_layer.getFeatures(QgsFeatureRequest().setFilterFids(fids))))
+    return layer
 
 
 def add_layer(layer, name, group):
@@ -312,123 +301,78 @@ def add_layer(layer, name, group):
     group.addLayer(layer)
 
 
-def add_layer_to_gpkg(layer, name):
-    layer.setName(name)
-    file = r"C:\Users\lukem\Documents\Projects\PortlandTransitIsochrone\SkateparkOutput.gpkg"
-
-    save_options = QgsVectorFileWriter.SaveVectorOptions()
-    save_options.driverName = "GPKG"
-    save_options.fileEncoding = "UTF-8"
-    save_options.layerName = name
-    save_options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
-
-    # get transform context from the project
-    transform_context = QgsProject.instance().transformContext()
-    
-    # call writeAsVectorFormatV3() method, passing required arguments and
-    # assign the return value to a variable
-    error = QgsVectorFileWriter.writeAsVectorFormatV3(layer,
-                                                      file,
-                                                      transform_context,
-                                                      save_options)
-
-    if error[0] != QgsVectorFileWriter.NoError:
-        print(error[1])
+# Writes the service areas to any vector format QGIS can create, such as FlatGeobuf or a Shapefile,
+#   through one QgsVectorFileWriter kept open for the whole run
+class QgisResultWriter(ResultWriter):
+    def __init__(self, path, layer, crs, block_fields=(), simplify=0, quantize=0):
+        super().__init__(block_fields, simplify, quantize)
+        fields = QgsFields()
+        for name, kind in self.fields:
+            fields.append(QgsField(name, field_variant(kind)))
+
+        save_options = QgsVectorFileWriter.SaveVectorOptions()
+        save_options.driverName = QgsVectorFileWriter.driverForExtension(os.path.splitext(path)[1])
+        save_options.fileEncoding = "UTF-8"
+        save_options.layerName = layer
+        self.writer = QgsVectorFileWriter.create(path, fields, QgsWkbTypes.MultiPolygon, crs,
+                                                 QgsProject.instance().transformContext(), save_options)
+        if self.writer.hasError() != QgsVectorFileWriter.NoError:
+            raise QgsProcessingException(f"Could not create {path}: {self.writer.errorMessage()}")
+
+    def write_rows(self, rows):
+        features = []
+        for geometry, *values in rows:
+            feature = QgsFeature()
+            if geometry is not None:
+                polygons = QgsGeometry()
+                polygons.fromWkb(geometry)
+                feature.setGeometry(polygons)
+            feature.setAttributes(values)
+            features.append(feature)
+        self.writer.addFeatures(features)
+
+    def close_output(self):
+        self.writer.flushBuffer()
+        del self.writer
+
+
+# QVariant type of an SQLite column type
+def field_variant(kind):
+    kind = kind.upper()
+    if 'INT' in kind or kind == 'BOOLEAN':
+        return QVariant.LongLong
+    if kind in ('REAL', 'DOUBLE', 'FLOAT'):
+        return QVariant.Double
+    return QVariant.String
+
+
+# Opens the writer the service areas of a run are streamed to, given the algorithm's OUTPUT destination
+#   GeoPackages are written through plain SQLite (see ResultWriter), other formats through QGIS.
+#   Returns the path written to.
+def open_result_writer(destination, simplify=0, quantize=0):
+    global result_writer
+    close_result_writer()
+    path, layer = output_destination(destination)
+    if is_geopackage(path):
+        result_writer = get_engine().result_writer(path, layer, simplify, quantize)
     else:
-        print(f"{name} Exported Successfully!")
-
-
-'''
-def clone_layer(layer, name):
-    layer.selectAll()
-    clone_layer = processing.run("native:saveselectedfeatures", \
-    {'INPUT': layer, 'OUTPUT': 'memory:'})['OUTPUT']
-    layer.removeSelection()
-    clone_layer.setName(name)
-    return clone_layer
-    #QgsProject.instance().addMapLayer(clone_layer)
-'''
-
-
-def create_reachable_stops_layer(stops_dict, context, feedback):
-    stops_layer.removeSelection()
-    stops_layer.selectByIds(list(stops_dict.keys()))
-    #print(f"CRSL - stops_layer type: {type(stops_layer)}, feature count = {stops_layer.featureCount()}")
-    clone_layer_id = processing.run("native:saveselectedfeatures",
-                                 {'INPUT': stops_layer, 'OUTPUT': 'memory:'},
-                                    is_child_algorithm=True,
-                                    context=context,
-                                    feedback=feedback)['OUTPUT']
-    clone_layer = context.getMapLayer(clone_layer_id)
-    stops_layer.removeSelection()
-    clone_layer.setName("Reachable_stops")
-    #QgsProject.instance().addMapLayer(clone_layer)
-    return clone_layer
-
-
-def remove_unreachable_stops(paths, start_time, total_time):
-    unreachable = []
-    for f in paths.getFeatures():
-        if f['cost']:
-            if start_time + f['cost'] > total_time:
-                unreachable.append(f.id())
-        else:
-            unreachable.append(f.id())
-    paths.dataProvider().deleteFeatures(unreachable)
-    paths.triggerRepaint()
-
-def select_feature_by_attribute(layer, field_name, value, context, feedback):
-    layer.removeSelection()
-    processing.run("qgis:selectbyattribute", {
-    'INPUT': layer,
-    'FIELD': field_name, 'OPERATOR': 0,
-    'VALUE': value, 'METHOD': 0},
-    is_child_algorithm=True,
-    context=context,
-    feedback=feedback)
-
-
-def sort_paths_by_cost(paths):
-    request = QgsFeatureRequest()
-
-    # set order by field
-    clause = QgsFeatureRequest.OrderByClause('cost', ascending=False)
-    orderby = QgsFeatureRequest.OrderBy([clause])
-    request.setOrderBy(orderby)
-    sorted_paths = paths.getFeatures(request)
-
-    return sorted_paths
-
-def select_by_route(layer, rt_num, rt_dir, context, feedback):
-    layer.removeSelection()
-    exp_string = f' "rte" is {rt_num} and "dir" is {rt_dir}'
-    processing.run("qgis:selectbyexpression", {
-        'INPUT': layer,
-        'EXPRESSION': exp_string, 'METHOD': 0},
-        is_child_algorithm=True,
-        context=context,
-        feedback=feedback)
-
-def extract_by_route(layer, rt_num, rt_dir, context, feedback):
-    select_by_route(layer, rt_num, rt_dir, context, feedback)
-    new_layer = extract_selection(layer, context, feedback)
-    layer.removeSelection()
-    return new_layer
-
-def extract_selection(layer, context, feedback):
-    new_layer = processing.run("native:saveselectedfeatures", 
-                               {'INPUT':layer,
-                               'OUTPUT':'TEMPORARY_OUTPUT'},
-                               is_child_algorithm=True,
-                               context=context,
-                               feedback=feedback)['OUTPUT']
-    return new_layer
-
-
-def convert_features_to_list(layer):
-    lst = []
-    for feature in layer.getFeatures():
-        attributes = feature.__geo_interface__["properties"]
-        lst.append(attributes)
-    return lst
+        result_writer = QgisResultWriter(path, layer, blocks_layer.crs(), get_engine().block_layer_fields(),
+                                         simplify, quantize)
+    return path
 
+
+def close_result_writer():
+    global result_writer
+    if result_writer is not None:
+        result_writer.close()
+        print(f"Wrote {result_writer.areas} service areas ({result_writer.written} census blocks)")
+        result_writer = None
+
+
+# Streams the census blocks with the given fids to the open output as one service area
+@traced('write service area', features_in=lambda name, minutes, fids: len(fids))
+def write_service_area(name, minutes, fids):
+    if result_writer is None:
+        print(f"No output open, {name} was not written")
+        return
+    result_writer.add(name, minutes, get_engine().block_wkb(fids))
@@ -0,0 +1,328 @@
+import math
+
+import numpy as np
+
+
+# Round-based transit search over a TransitNetwork
+#   Each round rides every route pattern that gained a better boarding in the previous round,
+#   then walks from every stop that gained a better arrival to the route stops around it.
+#   Round k therefore finds every journey with k boardings; max_transfers caps the rounds at
+#   max_transfers + 1. Times are in hours from the start of the search.
+# The wait model matches ServiceAreaSearch.Search: boarding from the origin has no wait,
+#   every later boarding waits half the route's headway.
+# Searching from many origins at once (see run_many) finds the union of their service areas at the cost
+#   of a single search; with track_sources every boarding, ride and stop arrival also keeps the index of the
+#   origin it was reached from first.
+class RaptorSearch:
+    def __init__(self, network, time_limit, max_transfers=None):
+        self.network = network
+        self.time_limit = time_limit
+        self.max_transfers = max_transfers
+
+        positions = len(network.patterns.stop_fids)
+        self.board = np.full(positions, math.inf)
+        self.arrive = np.full(positions, math.inf)
+        self.stop_arrivals = {}
+        self.origin_seeds = []
+        self.origin_distances = {}
+        self.origin_sources = None
+        self.board_source = None
+        self.arrive_source = None
+        self.stop_sources = {}
+        self.rounds = 0
+        self.route_scans = 0
+        self.transfer_walks = 0
+        self.repeat_walks = 0
+        self.walked = set()
+
+    # Searches from a point given in the street graph's coordinates
+    def run(self, x, y):
+        seeds = self.network.graph.snap(x, y)
+        self.run_from_seeds(seeds)
+
+    # Searches from many origins at once, given as (x, y) in the street graph's coordinates, all starting at time 0
+    #   track_sources labels everything reached with the index of its fastest origin
+    def run_many(self, points, track_sources=False):
+        seeds = self.network.graph.snap_many([x for x, _ in points], [y for _, y in points])
+        if track_sources:
+            self.track_sources([index for index, origin_seeds in enumerate(seeds) for _ in origin_seeds])
+        self.run_from_seeds([seed for origin_seeds in seeds for seed in origin_seeds])
+
+    # Labels everything the search reaches with the origin it was reached from first
+    #   sources holds the origin index of each of the seeds then given to run_from_seeds
+    def track_sources(self, sources):
+        positions = len(self.network.patterns.stop_fids)
+        self.origin_sources = list(sources)
+        self.board_source = np.full(positions, -1, dtype=np.int64)
+        self.arrive_source = np.full(positions, -1, dtype=np.int64)
+
+    # Searches from street graph seeds, each a (vertex, walking distance already covered)
+    def run_from_seeds(self, seeds):
+        network = self.network
+        graph = network.graph
+        self.origin_seeds = seeds
+        if not seeds:
+            return
+
+        max_distance = self.time_limit * network.walk_speed
+        marked = set()
+        if self.origin_sources is None:
+            distances = graph.reach(seeds, max_distance)
+            for fid, distance in graph.reached_points(network.route_stops_set, distances):
+                self.update_boarding(fid, distance / network.walk_speed, marked)
+        else:
+            distances, sources = graph.reach_sources(seeds, self.origin_sources, max_distance)
+            vertices = graph.point_vertices(network.route_stops_set)
+            for fid, distance in graph.reached_points(network.route_stops_set, distances):
+                self.update_boarding(fid, distance / network.walk_speed, marked, sources[vertices[fid]])
+        self.origin_distances = distances
+
+        while marked and (self.max_transfers is None or self.rounds <= self.max_transfers):
+            self.rounds += 1
+            improved_stops = self.scan_routes(marked)
+            marked = set()
+            # Boardings found by walking on after the last permitted ride could never be ridden
+            if self.max_transfers is not None and self.rounds > self.max_transfers:
+                break
+            for stop_fid in improved_stops:
+                self.transfer(stop_fid, marked)
+
+    # Rides each marked pattern, returning the stops whose arrival time improved
+    def scan_routes(self, marked):
+        patterns = self.network.patterns
+        stop_index = self.network.stop_index
+        offsets = patterns.stop_offsets
+        improved_stops = set()
+        for pattern in marked:
+            self.route_scans += 1
+            start = int(offsets[pattern])
+            end = int(offsets[pattern + 1])
+            times = patterns.stop_times[start:end]
+
+            # Best boarding at or before each stop, expressed as a time at the start of the route,
+            #   gives the arrival at every later stop
+            departures = self.board[start:end] - times
+            boarded = np.minimum.accumulate(departures)
+            arrivals = np.full(end - start, math.inf)
+            arrivals[1:] = boarded[:-1] + times[1:]
+
+            better = np.nonzero((arrivals < self.arrive[start:end]) & (arrivals <= self.time_limit))[0]
+            if not len(better):
+                continue
+            self.arrive[start + better] = arrivals[better]
+            if self.arrive_source is not None:
+                # The origin of the best boarding at or before each stop, from the last position setting the minimum
+                best = np.maximum.accumulate(np.where(departures == boarded, np.arange(end - start), 0))
+                self.arrive_source[start + better] = self.board_source[start + best[better - 1]]
+            for position, arrival in zip((start + better).tolist(), arrivals[better].tolist()):
+                stop_fid = stop_index.route_stop_stop_fid(int(patterns.stop_fids[position]))
+                if stop_fid is not None and arrival < self.stop_arrivals.get(stop_fid, math.inf):
+                    self.stop_arrivals[stop_fid] = arrival
+                    if self.arrive_source is not None:
+                        self.stop_sources[stop_fid] = int(self.arrive_source[position])
+                    improved_stops.add(stop_fid)
+        return improved_stops
+
+    # Walks from a stop to the route stops around it, marking patterns that can be boarded earlier
+    def transfer(self, stop_fid, marked):
+        self.transfer_walks += 1
+        if stop_fid in self.walked:
+            self.repeat_walks += 1
+        self.walked.add(stop_fid)
+        network = self.network
+        arrival = self.stop_arrivals[stop_fid]
+        for fid, cost in network.walk_from_stop(stop_fid, network.route_stops_set, self.time_limit - arrival,
+                                                self.time_limit):
+            rte, dir = network.stop_index.rte_dir(fid)
+            wait = network.headways.expected_wait(rte, dir)
+            if wait is None:
+                continue
+            self.update_boarding(fid, arrival + cost + wait, marked, self.stop_sources.get(stop_fid))
+
+    def counters(self):
+        return {'rounds': self.rounds, 'route_scans': self.route_scans, 'transfer_walks': self.transfer_walks,
+                'repeat_walks': self.repeat_walks}
+
+    def update_boarding(self, route_stop_fid, departure, marked, source=None):
+        patterns = self.network.patterns
+        position = patterns.position(route_stop_fid)
+        if position is None or departure >= self.time_limit or departure >= self.board[position]:
+            return
+        self.board[position] = departure
+        if source is not None:
+            self.board_source[position] = source
+        marked.add(patterns.pattern_of_position(position))
+
+    # Route stops with a boarding, as a dictionary of route stop fid -> departure time
+    def boardings(self):
+        boarded = np.nonzero(np.isfinite(self.board))[0]
+        return dict(zip(self.network.patterns.stop_fids[boarded].tolist(), self.board[boarded].tolist()))
+
+    # Seeds for a single multi-source walk covering everything reachable on foot
+    def walking_seeds(self):
+        return self.network.walking_seeds(self.origin_seeds, self.stop_arrivals)
+
+    # The same walk as (walking distances from the origin, point set, {fid: time reached}),
+    #   for TransitNetwork.walked_edge_spans
+    def walk_sources(self):
+        return self.origin_distances, self.network.stops_set, self.stop_arrivals
+
+    # Origin index of each of walking_seeds, for searches with track_sources
+    def walking_seed_sources(self):
+        graph = self.network.graph
+        sources = list(self.origin_sources)
+        for stop_fid in self.stop_arrivals:
+            sources.extend(self.stop_sources[stop_fid] for _ in graph.point_seeds(self.network.stops_set, stop_fid))
+        return sources
+
+    # Route stops reached in a vehicle, as a dictionary of route stop fid -> arrival time
+    def ride_arrivals(self):
+        reached = np.nonzero(np.isfinite(self.arrive))[0]
+        return dict(zip(self.network.patterns.stop_fids[reached].tolist(), self.arrive[reached].tolist()))
+
+    # The ridden part of each pattern, from its first boarding to its last reached stop,
+    #   as (from route stop fid, to route stop fid)
+    def ridden_spans(self):
+        return self.network.patterns.ridden_spans(self.boardings(), self.ride_arrivals())
+
+
+
+# Round-based search run backward from one or more destinations, finding the catchment of everywhere
+#   a destination can be reached from within the time limit in a single pass
+#   Mirrors RaptorSearch journey for journey: walks out from the destinations to the stops a rider could alight
+#   at, rides each route pattern backward from its later stops to the stops it could have been boarded at,
+#   and walks from those route stops back to the stops a rider could have transferred from.
+#   Times are in hours still to go to the nearest destination. The wait model is the same as RaptorSearch:
+#   a boarding reached from a transfer waits half the route's headway, and one reached directly from an origin
+#   (the final walk, see walking_seeds) has no wait.
+class ReverseRaptorSearch:
+    def __init__(self, network, time_limit, max_transfers=None):
+        self.network = network
+        self.time_limit = time_limit
+        self.max_transfers = max_transfers
+
+        positions = len(network.patterns.stop_fids)
+        self.board = np.full(positions, math.inf)
+        self.alight = np.full(positions, math.inf)
+        self.stop_arrivals = {}
+        self.stop_positions = network.stop_positions()
+        self.destination_seeds = []
+        self.destination_distances = {}
+        self.rounds = 0
+        self.route_scans = 0
+        self.transfer_walks = 0
+        self.repeat_walks = 0
+        self.walked = set()
+
+    # Searches back from a point given in the street graph's coordinates
+    def run(self, x, y):
+        self.run_from_seeds(self.network.graph.snap(x, y))
+
+    # Searches back from several destinations at once, given as (x, y) in the street graph's coordinates
+    def run_many(self, points):
+        seeds = self.network.graph.snap_many([x for x, _ in points], [y for _, y in points])
+        self.run_from_seeds([seed for destination_seeds in seeds for seed in destination_seeds])
+
+    # Searches back from street graph seeds, each a (vertex, walking distance still to go)
+    def run_from_seeds(self, seeds):
+        network = self.network
+        self.destination_seeds = seeds
+        if not seeds:
+            return
+
+        distances = network.graph.reach(seeds, self.time_limit * network.walk_speed)
+        self.destination_distances = distances
+        marked = set()
+        for fid, distance in network.graph.reached_points(network.stops_set, distances):
+            self.update_alighting(fid, distance / network.walk_speed, marked)
+
+        while marked and (self.max_transfers is None or self.rounds <= self.max_transfers):
+            self.rounds += 1
+            improved_positions = self.scan_routes(marked)
+            marked = set()
+            # Alightings found by walking on after the last permitted ride could never be ridden to
+            if self.max_transfers is not None and self.rounds > self.max_transfers:
+                break
+            for position in improved_positions:
+                self.transfer(position, marked)
+
+    # Rides each marked pattern backward, returning the positions whose boarding time improved
+    def scan_routes(self, marked):
+        patterns = self.network.patterns
+        offsets = patterns.stop_offsets
+        improved_positions = []
+        for pattern in marked:
+            self.route_scans += 1
+            start = int(offsets[pattern])
+            end = int(offsets[pattern + 1])
+            times = patterns.stop_times[start:end]
+
+            # Best alighting at or after each stop, expressed as a time at the start of the route,
+            #   gives the time to go from boarding at every earlier stop
+            alighted = np.minimum.accumulate((self.alight[start:end] + times)[::-1])[::-1]
+            boardings = np.full(end - start, math.inf)
+            boardings[:-1] = alighted[1:] - times[:-1]
+
+            better = np.nonzero((boardings < self.board[start:end]) & (boardings <= self.time_limit))[0]
+            self.board[start + better] = boardings[better]
+            improved_positions.extend((start + better).tolist())
+        return improved_positions
+
+    # Walks from a boarded route stop back to the stops around it, marking patterns that can be left there
+    def transfer(self, position, marked):
+        network = self.network
+        route_stop_fid = int(network.patterns.stop_fids[position])
+        rte, dir = network.stop_index.rte_dir(route_stop_fid)
+        wait = network.headways.expected_wait(rte, dir)
+        if wait is None:
+            return
+        self.transfer_walks += 1
+        if route_stop_fid in self.walked:
+            self.repeat_walks += 1
+        self.walked.add(route_stop_fid)
+        to_go = float(self.board[position]) + wait
+        for stop_fid, cost in network.walk_to_route_stop(route_stop_fid, self.time_limit - to_go, self.time_limit):
+            self.update_alighting(stop_fid, to_go + cost, marked)
+
+    def counters(self):
+        return {'rounds': self.rounds, 'route_scans': self.route_scans, 'transfer_walks': self.transfer_walks,
+                'repeat_walks': self.repeat_walks}
+
+    def update_alighting(self, stop_fid, to_go, marked):
+        if to_go > self.time_limit or to_go >= self.stop_arrivals.get(stop_fid, math.inf):
+            return
+        self.stop_arrivals[stop_fid] = to_go
+        for position in self.stop_positions.get(stop_fid, ()):
+            if to_go < self.alight[position]:
+                self.alight[position] = to_go
+                marked.add(self.network.patterns.pattern_of_position(position))
+
+    # Route stops that can be boarded, as a dictionary of route stop fid -> time to go from boarding
+    def boardings(self):
+        boarded = np.nonzero(np.isfinite(self.board))[0]
+        return dict(zip(self.network.patterns.stop_fids[boarded].tolist(), self.board[boarded].tolist()))
+
+    # Seeds for a single multi-source walk covering the catchment: the destinations themselves,
+    #   and every boardable route stop at its time to go, boarded from an origin without a wait
+    def walking_seeds(self):
+        network = self.network
+        seeds = list(self.destination_seeds)
+        for route_stop_fid, to_go in self.boardings().items():
+            seeds.extend((vertex, distance + to_go * network.walk_speed)
+                         for vertex, distance in network.graph.point_seeds(network.route_stops_set, route_stop_fid))
+        return seeds
+
+    # The same walk as (walking distances from the destinations, point set, {fid: time to go}),
+    #   for TransitNetwork.walked_edge_spans
+    def walk_sources(self):
+        return self.destination_distances, self.network.route_stops_set, self.boardings()
+
+    # Route stops a ride can end at, as a dictionary of route stop fid -> time to go from alighting
+    def ride_arrivals(self):
+        reached = np.nonzero(np.isfinite(self.alight))[0]
+        return dict(zip(self.network.patterns.stop_fids[reached].tolist(), self.alight[reached].tolist()))
+
+    # The ridden part of each pattern, from its first boarding to its last stop a ride can end at,
+    #   as (from route stop fid, to route stop fid)
+    def ridden_spans(self):
+        return self.network.patterns.ridden_spans(self.boardings(), self.ride_arrivals())
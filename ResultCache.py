@@ -0,0 +1,218 @@
+import collections
+import hashlib
+import os
+
+import numpy as np
+
+
+# Everything a table-driven search found from one origin, enough to rebuild its service areas
+#   for its own time limit or for any smaller one
+#   Stored as arrays, each pair giving a dictionary of keys -> values:
+#       stop_fids, stop_times           stop fid -> arrival time in hours
+#       boarding_fids, boarding_times   route stop fid -> departure time in hours
+#       ride_fids, ride_times           route stop fid -> in-vehicle arrival time in hours
+#       vertices, distances             street graph vertex -> walking distance from the origin or a reached stop
+#       counter_names, counter_values   the engine's work counters
+#   and time_limit, the limit the search ran with
+class SearchRecord:
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.time_limit = float(arrays['time_limit'][0])
+
+    def stop_arrivals(self):
+        return dict(zip(self.arrays['stop_fids'].tolist(), self.arrays['stop_times'].tolist()))
+
+    def boardings(self):
+        return dict(zip(self.arrays['boarding_fids'].tolist(), self.arrays['boarding_times'].tolist()))
+
+    def ride_arrivals(self):
+        return dict(zip(self.arrays['ride_fids'].tolist(), self.arrays['ride_times'].tolist()))
+
+    def distances(self):
+        return dict(zip(self.arrays['vertices'].tolist(), self.arrays['distances'].tolist()))
+
+    def counters(self):
+        return dict(zip(self.arrays['counter_names'].tolist(), self.arrays['counter_values'].tolist()))
+
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    # The record of the same search run with a smaller time limit
+    #   Every label a search keeps is its earliest time, and labels past the time limit are only ever
+    #   pruned, so the labels of the smaller search are exactly those of this one within its limit
+    #   (boardings strictly before it, as the engines never board at the time limit itself)
+    def within(self, time_limit, walk_speed):
+        if time_limit >= self.time_limit:
+            return self
+        a = self.arrays
+        stops = a['stop_times'] <= time_limit
+        boardings = a['boarding_times'] < time_limit
+        rides = a['ride_times'] <= time_limit
+        vertices = a['distances'] <= time_limit * walk_speed
+        return SearchRecord({
+            'time_limit': np.array([time_limit], dtype=np.float64),
+            'stop_fids': a['stop_fids'][stops], 'stop_times': a['stop_times'][stops],
+            'boarding_fids': a['boarding_fids'][boardings], 'boarding_times': a['boarding_times'][boardings],
+            'ride_fids': a['ride_fids'][rides], 'ride_times': a['ride_times'][rides],
+            'vertices': a['vertices'][vertices], 'distances': a['distances'][vertices],
+            'counter_names': a['counter_names'], 'counter_values': a['counter_values'],
+        })
+
+
+def build_search_record(time_limit, stop_arrivals, boardings, ride_arrivals, distances, counters):
+    def pairs(dictionary, key_dtype, value_dtype):
+        return (np.array(list(dictionary.keys()), dtype=key_dtype),
+                np.array(list(dictionary.values()), dtype=value_dtype))
+
+    arrays = {'time_limit': np.array([time_limit], dtype=np.float64)}
+    arrays['stop_fids'], arrays['stop_times'] = pairs(stop_arrivals, np.int64, np.float64)
+    arrays['boarding_fids'], arrays['boarding_times'] = pairs(boardings, np.int64, np.float64)
+    arrays['ride_fids'], arrays['ride_times'] = pairs(ride_arrivals, np.int64, np.float64)
+    arrays['vertices'], arrays['distances'] = pairs(distances, np.int64, np.float64)
+    arrays['counter_names'], arrays['counter_values'] = pairs(counters, np.str_, np.int64)
+    return SearchRecord(arrays)
+
+
+# Cache key part for an origin snapped to the street graph (see StreetGraph.snap)
+#   Origins snapped to the same edge within tolerance of each other share their results
+def origin_key(seeds, tolerance):
+    return tuple((vertex, round(distance / tolerance)) for vertex, distance in seeds)
+
+
+
+# Least recently used cache of SearchRecords, kept in memory and optionally on disk
+#   Records are stored under a key (any tuple with a stable repr, naming the origin, the network version
+#   and the engine settings). A request for a time limit no larger than the one cached for its key is
+#   answered from the cached record, so each key keeps a single record, that of its largest time limit.
+#   memory_limit and disk_limit are in bytes; the disk holds one .npz file per key, with recency
+#   tracked by the files' modification times.
+class ResultCache:
+    def __init__(self, memory_limit, disk_limit=0, directory=None):
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self.directory = directory if disk_limit > 0 else None
+        self.memory = collections.OrderedDict()     # key hash -> SearchRecord
+        self.memory_bytes = 0
+        self.disk = {}                              # key hash -> (time limit, file size)
+        self.hits = 0
+        self.misses = 0
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self.scan_disk()
+
+    # Finds the records already on disk from earlier sessions
+    def scan_disk(self):
+        for entry in os.listdir(self.directory):
+            digest, _, limit = entry[:-len('.npz')].partition('_')
+            if not entry.endswith('.npz') or not limit:
+                continue
+            try:
+                self.disk[digest] = (float(limit), os.path.getsize(os.path.join(self.directory, entry)))
+            except (OSError, ValueError):
+                continue
+
+    def path(self, digest, time_limit):
+        return os.path.join(self.directory, f"{digest}_{time_limit!r}.npz")
+
+    # The record cached for key if its time limit is at least time_limit, or None
+    #   The record may have a larger time limit; see SearchRecord.within
+    def get(self, key, time_limit):
+        digest = _digest(key)
+        record = self.memory.get(digest)
+        if record is not None and record.time_limit >= time_limit:
+            self.memory.move_to_end(digest)
+            if digest in self.disk:
+                _touch(self.path(digest, record.time_limit))
+        elif record is None and digest in self.disk and self.disk[digest][0] >= time_limit:
+            record = self.load(digest)
+        else:
+            record = None
+
+        if record is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return record
+
+    # Caches a record, replacing any record of the same key with a smaller time limit
+    def put(self, key, record):
+        digest = _digest(key)
+        self.remove(digest)
+        self.keep_in_memory(digest, record)
+        if self.directory and record.nbytes() <= self.disk_limit:
+            self.save(digest, record)
+
+    def keep_in_memory(self, digest, record):
+        if record.nbytes() > self.memory_limit:
+            return
+        self.memory[digest] = record
+        self.memory_bytes += record.nbytes()
+        while self.memory_bytes > self.memory_limit:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= evicted.nbytes()
+
+    def remove(self, digest):
+        if digest in self.memory:
+            self.memory_bytes -= self.memory.pop(digest).nbytes()
+        if digest in self.disk:
+            _remove(self.path(digest, self.disk.pop(digest)[0]))
+
+    def load(self, digest):
+        path = self.path(digest, self.disk[digest][0])
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                record = SearchRecord({name: data[name] for name in data.files})
+        except (OSError, ValueError, KeyError):
+            self.remove(digest)
+            return None
+        _touch(path)
+        self.keep_in_memory(digest, record)
+        return record
+
+    # Writes a record under a temporary name and renames it into place, then removes
+    #   the least recently used files until the disk limit is met
+    def save(self, digest, record):
+        path = self.path(digest, record.time_limit)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f, **record.arrays)
+        os.replace(temp_path, path)
+        self.disk[digest] = (record.time_limit, os.path.getsize(path))
+
+        total = sum(size for _, size in self.disk.values())
+        if total <= self.disk_limit:
+            return
+        for old in sorted(self.disk, key=lambda d: _modified(self.path(d, self.disk[d][0]))):
+            if total <= self.disk_limit:
+                break
+            if old == digest:
+                continue
+            time_limit, size = self.disk.pop(old)
+            total -= size
+            _remove(self.path(old, time_limit))
+
+
+
+def _digest(key):
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _touch(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _modified(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
@@ -0,0 +1,201 @@
+import os
+
+import numpy as np
+
+from GeoPackage import GeoPackageWriter, decode_wkb, encode_wkb, wkb_multipolygon, wkb_polygons
+
+default_layer_name = 'service_areas'
+batch_size = 256  # service areas buffered before each write
+
+
+# Streams the service areas of many origins into a single output layer, one row per accessible census block
+#   of each service area, as the tools have always written them: the name of the origin, the time limit in
+#   minutes, then every field of the blocks layer (block_fields, a list of (name, SQLite type)) and the block's
+#   polygons as a MultiPolygon. Block fields named origin or minutes are left out.
+#   Rows are buffered and handed to write_rows batch_size at a time, so an output is opened once per run
+#   rather than once per service area.
+#   Subclasses define write_rows(rows), writing a list of rows of (MultiPolygon WKB, origin, minutes,
+#   *block values) to their output, and may override close_output to close it once the last rows are written.
+#   simplify (layer units) drops the vertices of each block closer than that to its simplified outline,
+#   quantize (layer units) snaps every coordinate to a grid of that spacing; both are off at 0, and the
+#   blocks' WKB is then copied into the output without decoding it.
+class ResultWriter:
+    area_fields = [('origin', 'TEXT'), ('minutes', 'REAL')]
+
+    def __init__(self, block_fields=(), simplify=0, quantize=0, batch_size=batch_size):
+        reserved = {name.lower() for name, _ in self.area_fields}
+        self.block_fields = [(name, kind) for name, kind in block_fields if name.lower() not in reserved]
+        self.fields = self.area_fields + self.block_fields
+        self.simplify = simplify
+        self.quantize = quantize
+        self.batch_size = batch_size
+        self.rows = []
+        self.areas = 0
+        self.written = 0
+
+    # Adds the service area of an origin, given as (fid, WKB, {field: value}) of its accessible census blocks
+    #   in the output's crs
+    def add(self, origin, minutes, blocks):
+        for _, wkb, attributes in blocks:
+            self.rows.append((self.block_geometry(wkb), origin, minutes,
+                              *(attributes.get(name) for name, _ in self.block_fields)))
+            if len(self.rows) >= self.batch_size:
+                self.flush()
+        self.areas += 1
+
+    # MultiPolygon WKB of a block's Polygon or MultiPolygon WKB, simplified and quantized
+    def block_geometry(self, wkb):
+        if wkb is None:
+            return None
+        polygons = None if self.simplify or self.quantize else wkb_polygons(wkb)
+        if polygons is None:
+            polygons = [encode_wkb(('Polygon', rings))
+                        for rings in prepare_polygons(decode_wkb(wkb), self.simplify, self.quantize)]
+        return wkb_multipolygon(polygons) if polygons else None
+
+    def flush(self):
+        if self.rows:
+            self.write_rows(self.rows)
+            self.written += len(self.rows)
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.close_output()
+
+    def close_output(self):
+        pass
+
+
+# Writes the service areas to one layer of a GeoPackage through plain SQLite, each batch in a single
+#   transaction; the layer is replaced if it exists, and any other layers of the file are kept
+class GeoPackageResultWriter(ResultWriter):
+    def __init__(self, path, layer, srs_id, definition='undefined', block_fields=(), simplify=0, quantize=0,
+                 batch_size=batch_size):
+        super().__init__(block_fields, simplify, quantize, batch_size)
+        self.path = path
+        self.layer = layer
+        self.writer = GeoPackageWriter(path, srs_id, definition)
+        self.writer.create_layer(layer, 'MULTIPOLYGON', self.fields)
+
+    def write_rows(self, rows):
+        self.writer.add_features(self.layer, ((None, *row) for row in rows))
+
+    def close_output(self):
+        self.writer.close()
+
+
+# (path, layer name) of an output destination, given as a file path, as "path|layername=name"
+#   or as an OGR URI such as "ogr:dbname='path' table=\"name\" (geom)"
+#   The layer name defaults to default_layer_name for GeoPackages and to the file's name otherwise
+def output_destination(destination):
+    if destination.startswith('ogr:'):
+        options = dict(_uri_options(destination[len('ogr:'):]))
+        return options['dbname'], options.get('table') or default_layer_name
+    parts = destination.split('|')
+    for part in parts[1:]:
+        if part.startswith('layername='):
+            return parts[0], part[len('layername='):]
+    path = parts[0]
+    if is_geopackage(path):
+        return path, default_layer_name
+    return path, os.path.splitext(os.path.basename(path))[0]
+
+
+def is_geopackage(path):
+    return os.path.splitext(path)[1].lower() == '.gpkg'
+
+
+# (key, value) pairs of a data source URI, with single or double quoted values
+def _uri_options(uri):
+    i = 0
+    while i < len(uri):
+        if uri[i] == ' ':
+            i += 1
+            continue
+        key_end = uri.find('=', i)
+        if key_end < 0:
+            break
+        key = uri[i:key_end]
+        i = key_end + 1
+        if i < len(uri) and uri[i] in '\'"':
+            end = uri.find(uri[i], i + 1)
+            end = len(uri) if end < 0 else end
+            yield key, uri[i + 1:end]
+            i = end + 1
+        else:
+            end = uri.find(' ', i)
+            end = len(uri) if end < 0 else end
+            yield key, uri[i:end]
+            i = end
+
+
+
+# Polygons (each a list of rings) of a Polygon or MultiPolygon geometry, simplified and quantized
+#   Rings left with fewer than four points are dropped, along with the holes of a dropped exterior
+def prepare_polygons(geometry, simplify=0, quantize=0):
+    if geometry is None:
+        return []
+    kind, coords = geometry
+    polygons = [coords] if kind == 'Polygon' else coords
+    if not simplify and not quantize:
+        return polygons
+
+    prepared = []
+    for rings in polygons:
+        kept = []
+        for i, ring in enumerate(rings):
+            points = np.asarray(ring, dtype=np.float64).reshape(-1, 2)
+            if simplify:
+                points = simplify_ring(points, simplify)
+            if quantize:
+                points = quantize_ring(points, quantize)
+            if len(points) < 4:
+                if i == 0:
+                    break
+                continue
+            kept.append(list(zip(points[:, 0].tolist(), points[:, 1].tolist())))
+        if kept:
+            prepared.append(kept)
+    return prepared
+
+
+# Douglas-Peucker simplification of a closed ring, given as an (n, 2) array with its first point repeated last
+#   The ring is split at the point farthest from its first point, so that each half has distinct ends
+def simplify_ring(points, tolerance):
+    if len(points) <= 4:
+        return points
+    far = int(np.argmax(((points - points[0]) ** 2).sum(axis=1)))
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, far, len(points) - 1]] = True
+    stack = [(0, far), (far, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        distances = _segment_distances(points[start + 1:end], points[start], points[end])
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            keep[start + 1 + i] = True
+            stack.append((start, start + 1 + i))
+            stack.append((start + 1 + i, end))
+    return points[keep]
+
+
+# Distances from points to the segment from a to b
+def _segment_distances(points, a, b):
+    ab = b - a
+    length = float(ab @ ab)
+    if length == 0:
+        return np.sqrt(((points - a) ** 2).sum(axis=1))
+    t = np.clip((points - a) @ ab / length, 0, 1)
+    return np.sqrt(((points - (a + t[:, None] * ab)) ** 2).sum(axis=1))
+
+
+# Snaps a ring's coordinates to a grid of the given spacing, dropping the points that fall
+#   onto the same grid point as the point before them
+def quantize_ring(points, grid):
+    snapped = np.round(points / grid) * grid
+    keep = np.ones(len(snapped), dtype=bool)
+    keep[1:] = (snapped[1:] != snapped[:-1]).any(axis=1)
+    return snapped[keep]
@@ -0,0 +1,101 @@
+import heapq
+import itertools
+
+
+# Priority queue of search nodes ordered by time, ties broken first in first out
+#   A node is stale once its dictionary holds a different (better) time for its id;
+#   stale nodes are skipped when popped rather than removed when superseded.
+#   With use_decrease_key, each (dictionary, id) has at most one queued entry and
+#   pushing a node for a queued key replaces that entry in place.
+class SearchFrontier:
+    def __init__(self, use_decrease_key=False):
+        self.use_decrease_key = use_decrease_key
+        self.heap = []
+        self.positions = {}
+        self.sequence = itertools.count()
+        self.pushes = 0
+        self.pops = 0
+        self.stale_pops = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __bool__(self):
+        return bool(self.heap)
+
+    def push(self, node):
+        self.pushes += 1
+        entry = [node.time, next(self.sequence), node]
+        if not self.use_decrease_key:
+            heapq.heappush(self.heap, entry)
+            return
+
+        key = (id(node.dictionary), node.id)
+        position = self.positions.get(key)
+        if position is None:
+            self.heap.append(entry)
+            self.positions[key] = len(self.heap) - 1
+            self._sift_up(len(self.heap) - 1)
+            return
+        old_time = self.heap[position][0]
+        self.heap[position] = entry
+        if entry[0] < old_time:
+            self._sift_up(position)
+        else:
+            self._sift_down(position)
+
+    # Returns the earliest node that is not stale, or None once the queue is exhausted
+    def pop(self):
+        while self.heap:
+            if self.use_decrease_key:
+                node = self._pop_indexed()[2]
+            else:
+                node = heapq.heappop(self.heap)[2]
+            self.pops += 1
+            if node.time == node.dictionary[node.id]:
+                return node
+            self.stale_pops += 1
+        return None
+
+    # The n earliest queued nodes, including stale ones, without removing them
+    def smallest(self, n):
+        return [entry[2] for entry in heapq.nsmallest(n, self.heap)]
+
+    def _pop_indexed(self):
+        top = self.heap[0]
+        last = self.heap.pop()
+        del self.positions[self._key(top)]
+        if self.heap:
+            self.heap[0] = last
+            self.positions[self._key(last)] = 0
+            self._sift_down(0)
+        return top
+
+    def _key(self, entry):
+        return id(entry[2].dictionary), entry[2].id
+
+    def _swap(self, i, j):
+        heap = self.heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self.positions[self._key(heap[i])] = i
+        self.positions[self._key(heap[j])] = j
+
+    def _sift_up(self, i):
+        while i > 0:
+            parent = (i - 1) // 2
+            if self.heap[i][:2] >= self.heap[parent][:2]:
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i):
+        size = len(self.heap)
+        while True:
+            smallest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < size and self.heap[child][:2] < self.heap[smallest][:2]:
+                    smallest = child
+            if smallest == i:
+                break
+            self._swap(i, smallest)
+            i = smallest
@@ -1,9 +1,17 @@
-import bisect
+import os
 import time
 from importlib import reload
 import ProjectInteraction
 reload(ProjectInteraction)
 from ProjectInteraction import *
+from SearchFrontier import SearchFrontier
+from BatchSearch import parse_time_bands, run_batch
+from RaptorSearch import RaptorSearch, ReverseRaptorSearch
+from GtfsTimetable import ConnectionScan, runs_past_midnight, seconds_after_midnight
+from ResultCache import build_search_record, origin_key
+from TravelTimeMatrix import block_id_field, write_travel_time_matrix
+from DemographicSums import write_block_sums
+from Tracing import span, start_tracing, stop_tracing, traced
 
 
 from qgis.core import (QgsFeatureRequest,
@@ -44,17 +52,24 @@ class SearchStart:
         return self.time < other.time
 
 class Search:
-    def __init__(self, time_limit, context, feedback):
+    def __init__(self, time_limit, context, feedback, use_decrease_key=False):
         self.time_limit = time_limit
         self.context = context
         self.feedback = feedback
-        self.next_nodes = []
+        self.next_nodes = SearchFrontier(use_decrease_key)
         self.walk_nodes_dictionary = {}
         self.transit_nodes_dictionary = {}
         self.repeat_search_threshold = 10
         self.repeat_count = 0
         self.walking_service_area = None
+        self.reached_edges = []
         self.transit_service_area = None
+        self.transit_lines = []
+        self.ridden_spans = []
+        self.distances = None
+        self.origin_coords = None
+        self.headways = get_headway_table()
+        self.stop_index = get_stop_index()
 
 
     def print_dictionary(self, dictionary):
@@ -65,7 +80,7 @@ class Search:
 
     def print_search_list(self):
         print("Next/potential search nodes:")
-        for elem in self.next_nodes[slice(10)]:
+        for elem in self.next_nodes.smallest(10):
             print(f"    {elem}")
         print("    ... ")
 
@@ -74,24 +89,34 @@ class Search:
         print(f"Searched from {len(self.walk_nodes_dictionary.keys())} walk nodes")
         print(f"Searched from {len(self.transit_nodes_dictionary.keys())} transit nodes")
         print(f"    Repeated searches from {self.repeat_count} nodes")
+        print(f"    Frontier: {self.next_nodes.pushes} pushes, {self.next_nodes.pops} pops, "
+              f"{self.next_nodes.stale_pops} stale pops")
 
 
-    def get_results(self, name):
+    # bands, if given, is a list of time limits in hours up to time_limit, each producing its own
+    #   nested service area from the arrival times this search kept
+    @traced('write results')
+    def get_results(self, name, bands=None):
         root = QgsProject.instance().layerTreeRoot()
         group = root.addGroup(name)
 
-        if self.transit_service_area is not None:
-            # Perform final dissolve if necessary
-            if self.transit_service_area.featureCount() > 1:
-                self.transit_service_area = dissolve_layer(self.transit_service_area, self.context, self.feedback)
+        if self.transit_lines:
+            self.transit_service_area = create_lines_layer(self.transit_lines, routes_layer.crs(),
+                                                           "transit service area")
             #add_layer(self.transit_service_area, f" {name } - Accessible transit network", group)
         else:
             print("No transit service area found")
 
+        if bands:
+            for band, reached_edges in self.band_reached_edges(bands):
+                if not reached_edges:
+                    print(f"No walking service area found within {band*60} minutes")
+                    continue
+                self.set_reached_edges(reached_edges)
+                self.create_polygon(group, name, band)
+            return
+
         if self.walking_service_area is not None:
-            # Perform final dissolve if necessary
-            if self.walking_service_area.featureCount() > 1:
-                self.walking_service_area = dissolve_layer(self.walking_service_area, self.context, self.feedback)
             #add_layer(self.walking_service_area, f" {name } - Accessible street network", group)
             self.create_polygon(group, name)
         else:
@@ -99,17 +124,52 @@ class Search:
 
 
 
-    def create_polygon(self, group, name):
-        polygon_layer = get_nearby_blocks(self.walking_service_area, self.context, self.feedback)
-        renderer = polygon_layer.renderer()
-        #print(renderer.type())
-        symbol = renderer.symbol()
-        symbol.setColor(QtGui.QColor(255,0,0,100))
-        props = polygon_layer.renderer().symbol().symbolLayer(0).properties()
-        #print(f"Properties: {props}")
-        #symbol.setAlpha(.4)
-        #add_layer(polygon_layer, f" {name } - Accessible blocks", group)
-        add_layer_to_gpkg(polygon_layer, f"{name}_{self.time_limit*60}")
+    # Streets reached within each band, as (time limit, [(edge, start distance, end distance), ...])
+    def band_reached_edges(self, bands):
+        network = get_transit_network()
+        distances = self.walking_distances(network)
+        for band in bands:
+            yield band, network.graph.reached_edges(distances, band * network.walk_speed)
+
+
+    # Sets the walking service area to the given reached streets
+    def set_reached_edges(self, reached_edges):
+        self.reached_edges = reached_edges
+        self.walking_service_area = create_reached_streets_layer(get_street_graph(), reached_edges)
+
+
+    # Walking distances over the street graph from the origin and from every stop at its arrival time,
+    #   found by a single multi-source walk once the search has finished
+    def walking_distances(self, network):
+        if self.distances is None:
+            with span('walking distances', features_in=len(self.walk_nodes_dictionary)) as traced_span:
+                graph = network.graph
+                origin_seeds = graph.snap(*coord_string_to_street_point(self.origin_coords))
+                self.distances = graph.reach(network.walking_seeds(origin_seeds, self.walk_nodes_dictionary),
+                                             self.time_limit * network.walk_speed)
+                traced_span.features_out = len(self.distances)
+        return self.distances
+
+
+    # Builds the walking and transit service areas from the arrival times and ridden spans the search kept
+    #   Geometry is only built here, so its cost depends on the size of the service area rather than
+    #   on the number of nodes the search expanded
+    @traced('build service areas')
+    def build_service_areas(self):
+        network = get_transit_network()
+        self.set_reached_edges(network.graph.reached_edges(self.walking_distances(network),
+                                                           self.time_limit * network.walk_speed))
+        patterns = network.patterns
+        self.transit_lines = [patterns.line_between(from_fid, to_fid)
+                              for from_fid, to_fid in patterns.merge_spans(self.ridden_spans)]
+
+
+    @traced('create polygon', features_in=lambda self, group, name, time_limit=None: len(self.reached_edges))
+    def create_polygon(self, group, name, time_limit=None):
+        if time_limit is None:
+            time_limit = self.time_limit
+        #add_layer(get_nearby_blocks(self.reached_edges), f" {name } - Accessible blocks", group)
+        write_service_area(name, time_limit * 60, get_engine().reached_blocks(self.reached_edges))
 
     # Get the feature ID for the correct layer
     #   If the search that yielded this feature was a transit search:
@@ -117,10 +177,7 @@ class Search:
     #   Otherwise, just add the fid from what was the route_stops layer
     def get_correct_fid(self, feature, get_stop_fid):
         if get_stop_fid:
-            stop_id = str(feature['stop_id'])
-            expr = QgsExpression("stop_id = " + stop_id)
-            stop_feature = next(stops_layer.getFeatures(QgsFeatureRequest(expr)))
-            return stop_feature['fid']
+            return self.stop_index.route_stop_stop_fid(feature['fid'])
         return feature['fid']
 
 
@@ -145,6 +202,8 @@ class Search:
         if departing_time >= self.time_limit:
             return
         feature_key = self.get_correct_fid(feature, add_to_walk_search)
+        if feature_key is None:
+            return
 
         if self.should_add_search_node(feature_key, next_dictionary, departing_time):
             next_dictionary[feature_key] = departing_time
@@ -153,10 +212,7 @@ class Search:
                                departing_time, next_dictionary, not add_to_walk_search, False)
             if not add_to_walk_search:
                 node.set_route_dir(feature['rte'], feature['dir'])
-            if self.next_nodes:
-                bisect.insort(self.next_nodes, node)
-            else:
-                self.next_nodes.append(node)
+            self.next_nodes.push(node)
 
 
     # Iterates over stops encountered in a search
@@ -166,41 +222,26 @@ class Search:
         next_dictionary = self.walk_nodes_dictionary if add_to_walk_search else self.transit_nodes_dictionary
 
         for f in paths:
-            if f['cost']:
+            # Walking paths can have zero cost when a route stop shares the walk node's location
+            if f['cost'] or (f['cost'] is not None and not add_to_walk_search):
                 if node.is_search_origin or add_to_walk_search:
                     departure_time = node.time + f['cost']
                 else:
-                    # Select the route that will depart from this stop
-                    select_by_route(routes_layer, f['rte'], f['dir'], self.context, self.feedback)
-                    if not routes_layer.selectedFeatures():
-                        continue
-                    next_route = routes_layer.selectedFeatures()[0]
-                    if next_route['TRIPS_PER_HOUR'] == 0:
+                    # Average wait is half of the headway of the route that will depart from this stop
+                    avg_wait = self.headways.expected_wait(f['rte'], f['dir'])
+                    if avg_wait is None:
                         continue
-
-                    # Average wait is half of the headway of the route
-                    avg_wait = (1 / next_route['TRIPS_PER_HOUR']) / 2
                     departure_time = node.time + f['cost'] + avg_wait
-                    routes_layer.removeSelection()
 
                 self.add_search_node(f, departure_time, add_to_walk_search, next_dictionary, next_search_layer)
 
 
     # Select next node from which to begin a search
+    #   Only nodes whose time still matches their dictionary entry are returned
+    #   Nodes may be entered multiple times if a faster start time is found
+    #   The dictionary entry will contain the fastest start time
     def pick_next(self):
-        # If no more searchable nodes, return none
-        if not self.next_nodes: return
-
-        # Get next candidate by popping it from list
-        node = self.next_nodes.pop(0)
-
-        # Only begin a search if the node in the search list has the same time as it's dictionary match
-        # Nodes may be entered multiple times if a faster start time is found
-        # The dictionary entry will contain the fastest start time
-        if node.time == node.dictionary[node.id]:
-            return node
-
-        return self.pick_next()
+        return self.next_nodes.pop()
 
 
     def update_walking_dictionary(self, path_features, start_search_time):
@@ -208,7 +249,7 @@ class Search:
             cost = f['cost']
 
             feature_key = self.get_correct_fid(f, True)
-            if cost:
+            if cost and feature_key is not None:
                 if (feature_key not in self.walk_nodes_dictionary.keys() or
                         start_search_time + cost < self.walk_nodes_dictionary[feature_key]):
                     self.walk_nodes_dictionary[feature_key] = start_search_time + cost
@@ -230,24 +271,20 @@ class Search:
 
 
     def perform_transit_search(self, node):
-        paths_to_stops, self.transit_service_area = get_reachable_stops_transit(node, self.time_limit, self.transit_service_area,
-                                                                                self.context, self.feedback)
-        path_features_sorted = sort_paths_by_cost(paths_to_stops)
-        #print(f"Sorted path features: {path_features_sorted} and len: {len(list(path_features_sorted))}")
-        self.update_network_dictionary(path_features_sorted,node.time)
-        self.add_search_nodes(paths_to_stops.getFeatures(), node, True)
+        paths_to_stops, ridden_span = get_reachable_stops_transit(node, self.time_limit)
+        if ridden_span:
+            self.ridden_spans.append(ridden_span)
+        self.update_network_dictionary(paths_to_stops, node.time)
+        self.add_search_nodes(paths_to_stops, node, True)
 
 
     def perform_walk_search(self, node):
-        result = get_reachable_stops_walking(node, self.time_limit, self.walking_service_area,
-                                                                                self.context, self.feedback)
-        if not result:
+        paths_to_stops = get_reachable_stops_walking(node, self.time_limit)
+        if paths_to_stops is None:
             print("No result from perform_walk_search, returning")
             return
-        paths_to_stops, self.walking_service_area = result
-        path_features_sorted = sort_paths_by_cost(paths_to_stops)
-        self.update_walking_dictionary(paths_to_stops.getFeatures(), node.time)
-        self.add_search_nodes(path_features_sorted, node, False)
+        self.update_walking_dictionary(paths_to_stops, node.time)
+        self.add_search_nodes(paths_to_stops, node, False)
 
 
     def perform_search(self):
@@ -270,22 +307,238 @@ class Search:
 
 
     def init_search(self, origin_coords):
+        self.origin_coords = origin_coords
         # Prep starting node
         init_node = SearchStart(None, None, 0,
                                 self.transit_nodes_dictionary, False, True)
         init_node.set_coord_string(origin_coords)
 
         # Prep node search list and dictionary
-        self.next_nodes.append(init_node)
         init_node.dictionary[init_node.id] = init_node.time
+        self.next_nodes.push(init_node)
 
         # Perform and time the search
         start_time = time.perf_counter()
-        self.perform_search()
+        with span('dijkstra search') as traced_span:
+            self.perform_search()
+            traced_span.features_out = len(self.walk_nodes_dictionary)
         end_time = time.perf_counter()
         print(f"Elapsed search time: {print_elapsed_time(end_time - start_time)}")
 
+        self.build_service_areas()
+
+
+
+
+
+# Round-based alternative to Search
+#   Runs RaptorSearch over the prebuilt network and then builds the same service area layers,
+#   with the walking area found by a single multi-source walk from the origin and every stop reached
+class RoundBasedSearch(Search):
+    def __init__(self, time_limit, context, feedback, max_transfers=None):
+        super().__init__(time_limit, context, feedback)
+        self.max_transfers = max_transfers
+        self.network = get_transit_network()
+        self.engine = None
+
+    def create_engine(self):
+        return RaptorSearch(self.network, self.time_limit, self.max_transfers)
+
+    def print_search_summary(self):
+        print(f"Reached {len(self.walk_nodes_dictionary.keys())} stops by transit")
+        print(f"Boarded at {len(self.transit_nodes_dictionary.keys())} route stops")
+        print(f"    {self.engine.rounds} rounds, {self.engine.route_scans} route scans, "
+              f"{self.engine.transfer_walks} transfer walks ({self.engine.repeat_walks} repeated)")
+
+    def init_search(self, origin_coords):
+        self.origin_coords = origin_coords
+        self.engine = self.create_engine()
+
+        start_time = time.perf_counter()
+        with span(f'{type(self.engine).__name__}.run') as traced_span:
+            self.run_engine(origin_coords)
+            traced_span.features_out = len(self.engine.stop_arrivals)
+        end_time = time.perf_counter()
+        print(f"Elapsed search time: {print_elapsed_time(end_time - start_time)}")
+
+        self.walk_nodes_dictionary = self.engine.stop_arrivals
+        self.collect_transit_results()
+        self.build_service_areas()
+
+    def run_engine(self, origin_coords):
+        self.engine.run(*coord_string_to_street_point(origin_coords))
+
+    def collect_transit_results(self):
+        self.transit_nodes_dictionary = self.engine.boardings()
+        self.ridden_spans = self.engine.ridden_spans()
+
+    # What the search found, for the result cache
+    def search_record(self):
+        return build_search_record(self.time_limit, self.walk_nodes_dictionary, self.transit_nodes_dictionary,
+                                   self.engine.ride_arrivals(), self.walking_distances(self.network),
+                                   self.engine.counters())
+
+
+
+# Exact departure-time alternative to Search
+#   Runs a ConnectionScan over a GTFS timetable departing at departure (seconds after midnight)
+class TimetableSearch(RoundBasedSearch):
+    def __init__(self, time_limit, context, feedback, timetable, departure):
+        super().__init__(time_limit, context, feedback)
+        self.timetable = timetable
+        self.departure = departure
+
+    def create_engine(self):
+        return ConnectionScan(self.network, self.timetable, self.departure, self.time_limit)
+
+    def print_search_summary(self):
+        print(f"Reached {len(self.walk_nodes_dictionary.keys())} stops by transit")
+        print(f"    {self.engine.connections_scanned} connections scanned, {self.engine.trips_boarded} trips boarded, "
+              f"{self.engine.footpath_walks} footpath walks ({self.engine.repeat_walks} repeated)")
+
+
+
+# Arrive-by alternative to RoundBasedSearch
+#   Runs a ReverseRaptorSearch back from one or more destinations, given to init_search as a list of
+#   origin_coords strings, and builds the layers of the catchment they can all be reached from in one pass
+class ReverseSearch(RoundBasedSearch):
+    def create_engine(self):
+        return ReverseRaptorSearch(self.network, self.time_limit, self.max_transfers)
+
+    def run_engine(self, destinations):
+        self.engine.run_many([coord_string_to_street_point(coords) for coords in destinations])
+
+    # Walking distances back from the destinations and from every route stop that can be boarded
+    def walking_distances(self, network):
+        if self.distances is None:
+            with span('walking distances', features_in=len(self.transit_nodes_dictionary)) as traced_span:
+                self.distances = network.graph.reach(self.engine.walking_seeds(),
+                                                     self.time_limit * network.walk_speed)
+                traced_span.features_out = len(self.distances)
+        return self.distances
+
+    def print_search_summary(self):
+        print(f"Searched back from {len(self.origin_coords)} destinations")
+        print(f"Left transit at {len(self.walk_nodes_dictionary.keys())} stops")
+        print(f"Boarded at {len(self.transit_nodes_dictionary.keys())} route stops")
+        print(f"    {self.engine.rounds} rounds, {self.engine.route_scans} route scans, "
+              f"{self.engine.transfer_walks} transfer walks ({self.engine.repeat_walks} repeated)")
+
+
+
+# Union alternative to searching from each point of a layer in turn
+#   Runs one RaptorSearch from every origin at once, given to init_search as a list of (name, origin_coords),
+#   and builds the layers of the union of their service areas. labeled splits the union by the origin each
+#   census block is reached from first, writing one service area per origin instead.
+class UnionSearch(RoundBasedSearch):
+    def __init__(self, time_limit, context, feedback, max_transfers=None, labeled=False):
+        super().__init__(time_limit, context, feedback, max_transfers)
+        self.labeled = labeled
+        self.vertex_sources = None
+        if labeled:
+            self.network = get_transit_network(blocks=True)
+
+    def run_engine(self, origins):
+        self.engine.run_many([coord_string_to_street_point(coords) for _, coords in origins], self.labeled)
+
+    # Walking distances from every origin and from every stop at its arrival time,
+    #   labeled with the origin each vertex is reached from first when labeled
+    def walking_distances(self, network):
+        if self.distances is None:
+            with span('walking distances', features_in=len(self.walk_nodes_dictionary)) as traced_span:
+                max_distance = self.time_limit * network.walk_speed
+                if self.labeled:
+                    self.distances, self.vertex_sources = network.graph.reach_sources(
+                        self.engine.walking_seeds(), self.engine.walking_seed_sources(), max_distance)
+                else:
+                    self.distances = network.graph.reach(self.engine.walking_seeds(), max_distance)
+                traced_span.features_out = len(self.distances)
+        return self.distances
+
+    def get_results(self, name, bands=None):
+        if not self.labeled:
+            super().get_results(name, bands)
+            return
+        self.write_labeled_areas(bands)
+
+    # Writes, for each band, the census blocks each origin reaches first as that origin's service area
+    @traced('write results')
+    def write_labeled_areas(self, bands):
+        network = self.network
+        graph = network.graph
+        max_distance = self.time_limit * network.walk_speed
+        distances = graph.distance_array(self.walking_distances(network))
+        block_distances, fastest = network.block_reach.block_sources(graph, distances,
+                                                                     graph.source_array(self.vertex_sources),
+                                                                     max_distance)
+        fids = network.block_reach.fids
+        for band in bands or [self.time_limit]:
+            within = block_distances <= band * network.walk_speed
+            for source, (origin_name, _) in enumerate(self.origin_coords):
+                source_fids = fids[within & (fastest == source)].tolist()
+                if source_fids:
+                    write_service_area(origin_name, band * 60, source_fids)
+
+    def print_search_summary(self):
+        print(f"Searched from {len(self.origin_coords)} origins at once")
+        super().print_search_summary()
+
+
+
+# Service area layers from a search already run elsewhere, such as a BatchSearch worker
+#   result is the OriginResult of the search
+class PrecomputedSearch(Search):
+    def __init__(self, time_limit, context, feedback, network, result):
+        super().__init__(time_limit, context, feedback)
+        self.network = network
+        self.result = result
+
+    def init_search(self, origin_coords):
+        self.origin_coords = origin_coords
+        self.walk_nodes_dictionary = self.result.stop_arrivals
+        self.transit_nodes_dictionary = self.result.boardings
+        self.ridden_spans = self.result.ridden_spans
+        self.transit_lines = [self.network.patterns.line_between(from_fid, to_fid)
+                              for from_fid, to_fid in self.network.patterns.merge_spans(self.ridden_spans)]
+        self.set_reached_edges(self.edge_list(self.result.reached_edges[-1]))
+
+    # The worker already found the streets covered within each band
+    def band_reached_edges(self, bands):
+        for band, reached_edges in zip(bands, self.result.reached_edges):
+            yield band, self.edge_list(reached_edges)
+
+    def edge_list(self, reached_edges):
+        edges, starts, ends = reached_edges
+        return list(zip(edges.tolist(), starts.tolist(), ends.tolist()))
+
+    def print_search_summary(self):
+        print(f"Reached {len(self.walk_nodes_dictionary.keys())} stops by transit")
+        print(f"Boarded at {len(self.transit_nodes_dictionary.keys())} route stops")
+        print("    " + ", ".join(f"{count} {name.replace('_', ' ')}" for name, count in self.result.counters.items()))
+
+
+
+# Service area layers from a search result kept in the result cache
+#   record is the SearchRecord of the search, already limited to time_limit (see SearchRecord.within)
+class CachedSearch(Search):
+    def __init__(self, time_limit, context, feedback, network, record):
+        super().__init__(time_limit, context, feedback)
+        self.network = network
+        self.record = record
 
+    def init_search(self, origin_coords):
+        self.origin_coords = origin_coords
+        self.walk_nodes_dictionary = self.record.stop_arrivals()
+        self.transit_nodes_dictionary = self.record.boardings()
+        self.ridden_spans = self.network.patterns.ridden_spans(self.transit_nodes_dictionary,
+                                                               self.record.ride_arrivals())
+        self.distances = self.record.distances()
+        self.build_service_areas()
+
+    def print_search_summary(self):
+        print(f"Reached {len(self.walk_nodes_dictionary.keys())} stops by transit (from the result cache)")
+        print(f"Boarded at {len(self.transit_nodes_dictionary.keys())} route stops")
+        print("    " + ", ".join(f"{count} {name.replace('_', ' ')}" for name, count in self.record.counters().items()))
 
 
 
@@ -301,20 +554,193 @@ def print_elapsed_time(seconds):
     return "%02d:%02d:%02d" % (hour, min, sec)
 
 
-def main(name, origin_coords, search_time, context, feedback):
-    s = Search(search_time, context, feedback)
+search_engines = ['dijkstra', 'raptor', 'timetable']
+
+
+# Turns tracing on for a run whose trace is to be written to trace_path; does nothing without a path
+def begin_trace(trace_path):
+    if trace_path:
+        start_tracing()
+
+
+# Ends a run begun with begin_trace, writing its spans as a Chrome trace to trace_path
+#   and its per-stage table as CSV next to it, and printing the table
+def end_trace(trace_path):
+    tracer = stop_tracing()
+    if not trace_path or tracer is None:
+        return
+    tracer.write_chrome_trace(trace_path)
+    tracer.write_stage_table(os.path.splitext(trace_path)[0] + '_stages.csv')
+    print(tracer.format_stage_table())
+
+
+# Result cache key of a table-driven search, or None for an origin off the street network
+#   Results of the Dijkstra engine are not cached, as which nodes it repeats depends on its time limit
+def search_cache_key(origin_coords, engine, max_transfers=None, gtfs_path=None, departure=None):
+    seeds = get_street_graph().snap(*coord_string_to_street_point(origin_coords))
+    if not seeds:
+        return None
+    key = (origin_key(seeds, origin_tolerance), get_network_version(), engine, max_transfers)
+    if engine == 'timetable':
+        key += (os.path.abspath(gtfs_path), departure.isoformat())
+    return key
+
+
+# gtfs_path and departure (a datetime) are only used by the timetable engine
+# bands (hours, ascending) runs one search to the largest limit and emits a service area for each
+# Searches with the table-driven engines are answered from the result cache when the same origin
+#   has already been searched with at least the same time limit
+def main(name, origin_coords, search_time, context, feedback, engine='dijkstra', max_transfers=None,
+         gtfs_path=None, departure=None, bands=None):
+    if bands:
+        search_time = bands[-1]
+    cache_key = None
+    record = None
+    if engine in ('raptor', 'timetable'):
+        cache_key = search_cache_key(origin_coords, engine, max_transfers, gtfs_path, departure)
+        if cache_key is not None:
+            record = get_result_cache().get(cache_key, search_time)
+
+    if record is not None:
+        s = CachedSearch(search_time, context, feedback, get_transit_network(),
+                         record.within(search_time, walk_feet_per_hour))
+    elif engine == 'raptor':
+        s = RoundBasedSearch(search_time, context, feedback, max_transfers)
+    elif engine == 'timetable':
+        departure_seconds = seconds_after_midnight(departure)
+        timetable = get_gtfs_timetable(gtfs_path, departure.date(), runs_past_midnight(departure_seconds, search_time))
+        s = TimetableSearch(search_time, context, feedback, timetable, departure_seconds)
+    else:
+        s = Search(search_time, context, feedback)
     s.init_search(origin_coords)
+    if record is None and cache_key is not None:
+        get_result_cache().put(cache_key, s.search_record())
     #s.clean_up
 
 
     start_time = time.perf_counter()
-    s.get_results(name)
+    s.get_results(name, bands)
     end_time = time.perf_counter()
-    print(f"    + Elapsed time performing final dissolves: {print_elapsed_time(end_time - start_time)}")
+    print(f"    + Elapsed time writing results: {print_elapsed_time(end_time - start_time)}")
 
     s.print_search_summary()
+    print(get_walk_cache().summary())
 
     del s
 
 
+# Finds the catchment of destinations, a list of origin_coords strings: everywhere at least one of them
+#   can be reached from within the time limit, searched back from all of them at once (see ReverseSearch)
+#   bands (hours, ascending) emits a catchment for each time limit from the one search
+def main_reverse(name, destinations, search_time, context, feedback, max_transfers=None, bands=None):
+    if bands:
+        search_time = bands[-1]
+    s = ReverseSearch(search_time, context, feedback, max_transfers)
+    s.init_search(destinations)
+
+    start_time = time.perf_counter()
+    s.get_results(name, bands)
+    end_time = time.perf_counter()
+    print(f"    + Elapsed time writing results: {print_elapsed_time(end_time - start_time)}")
+
+    s.print_search_summary()
+    print(get_walk_cache().summary())
+
+    del s
+
+
+# Finds the union of the service areas of origins, a list of (name, origin_coords), in a single search
+#   from all of them at once (see UnionSearch); labeled writes the census blocks each origin reaches first
+#   as its own service area instead of writing the union under name
+def main_union(name, origins, search_time, context, feedback, max_transfers=None, bands=None, labeled=False):
+    if bands:
+        search_time = bands[-1]
+    s = UnionSearch(search_time, context, feedback, max_transfers, labeled)
+    s.init_search(origins)
+
+    start_time = time.perf_counter()
+    s.get_results(name, bands)
+    end_time = time.perf_counter()
+    print(f"    + Elapsed time writing results: {print_elapsed_time(end_time - start_time)}")
+
+    s.print_search_summary()
+    print(get_walk_cache().summary())
+
+    del s
+
+
+# Searches from many origins, a list of (name, origin_coords), on a pool of worker processes
+#   Only the table-driven engines ('raptor' and 'timetable') can run outside QGIS.
+#   Layers are still built here, in origin order, as each worker result arrives.
+def main_batch(origins, search_time, context, feedback, engine, workers, max_transfers=None,
+               gtfs_path=None, departure=None, bands=None):
+    if bands:
+        search_time = bands[-1]
+    network = get_transit_network()
+    timetable = None
+    departure_seconds = None
+    if engine == 'timetable':
+        departure_seconds = seconds_after_midnight(departure)
+        timetable = get_gtfs_timetable(gtfs_path, departure.date(), runs_past_midnight(departure_seconds, search_time))
+    points = [coord_string_to_street_point(origin_coords) for _, origin_coords in origins]
+
+    start_time = time.perf_counter()
+    for result in run_batch(network, points, search_time, engine, workers, max_transfers, timetable,
+                            departure_seconds, bands, feedback.isCanceled,
+                            lambda done: feedback.setProgress(done * 100)):
+        name, origin_coords = origins[result.index]
+        s = PrecomputedSearch(search_time, context, feedback, network, result)
+        s.init_search(origin_coords)
+        s.get_results(name, bands)
+        s.print_search_summary()
+        del s
+    end_time = time.perf_counter()
+    print(f"Elapsed batch time for {len(origins)} origins on {workers} workers: "
+          f"{print_elapsed_time(end_time - start_time)}")
+
+
+# Writes the travel time matrix from origins, a list of (name, origin_coords), to every census block
+#   into a directory (see TravelTimeMatrix), searching on a pool of workers when there is more than one
+#   Only the table-driven engines ('raptor' and 'timetable') can find the time to every block.
+def main_matrix(origins, search_time, context, feedback, engine, workers, directory, max_transfers=None,
+                gtfs_path=None, departure=None):
+    network = get_transit_network(blocks=True)
+    timetable = None
+    departure_seconds = None
+    if engine == 'timetable':
+        departure_seconds = seconds_after_midnight(departure)
+        timetable = get_gtfs_timetable(gtfs_path, departure.date(), runs_past_midnight(departure_seconds, search_time))
+    points = [(name, *coord_string_to_street_point(origin_coords)) for name, origin_coords in origins]
+
+    start_time = time.perf_counter()
+    written = write_travel_time_matrix(directory, network, points, get_engine().block_field(block_id_field),
+                                       search_time, engine, workers, max_transfers, timetable, departure_seconds,
+                                       feedback.isCanceled, lambda done: feedback.setProgress(done * 100))
+    end_time = time.perf_counter()
+    print(f"Elapsed matrix time for {written} origins x {network.block_reach.column_count()} blocks "
+          f"on {workers} workers: {print_elapsed_time(end_time - start_time)}")
+
+
+# Writes the sums of the census block fields reachable from origins, a list of (name, origin_coords),
+#   within each time limit to a CSV file (see DemographicSums), instead of their service areas
+#   Only the table-driven engines ('raptor' and 'timetable') can sum over every block.
+def main_sums(origins, search_time, context, feedback, engine, workers, path, fields, max_transfers=None,
+              gtfs_path=None, departure=None, bands=None):
+    bands = bands or [search_time]
+    network = get_transit_network(block_fields=fields)
+    timetable = None
+    departure_seconds = None
+    if engine == 'timetable':
+        departure_seconds = seconds_after_midnight(departure)
+        timetable = get_gtfs_timetable(gtfs_path, departure.date(), runs_past_midnight(departure_seconds, bands[-1]))
+    points = [(name, *coord_string_to_street_point(origin_coords)) for name, origin_coords in origins]
+
+    start_time = time.perf_counter()
+    written = write_block_sums(path, network, points, bands, engine, workers, max_transfers, timetable,
+                               departure_seconds, feedback.isCanceled, lambda done: feedback.setProgress(done * 100))
+    end_time = time.perf_counter()
+    print(f"Elapsed block sums time for {written} origins on {workers} workers: "
+          f"{print_elapsed_time(end_time - start_time)}")
+
+
 #main("7642303.8,681728.6 [EPSG:2913]", .5)
\ No newline at end of file
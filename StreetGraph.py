@@ -0,0 +1,549 @@
+import heapq
+import math
+
+import numpy as np
+
+
+# Side length of the uniform grid used to snap points onto street edges
+#   (in the units of the street layer, feet for EPSG:2913)
+snap_cell_size = 500
+
+# Points projected this close to the end of an edge reuse the end vertex
+#   instead of splitting the edge
+snap_tolerance = 1e-6
+
+
+# Compact, undirected street network held entirely in arrays
+#   Vertices:   x, y
+#   Edges:      edge_u, edge_v, edge_length, edge_feature (fid of the source street)
+#   Adjacency:  CSR form - the half-edges leaving vertex v are
+#               adj_vertices/adj_edges[adj_offsets[v]:adj_offsets[v + 1]]
+#   Snap grid:  uniform grid over the edges, also in CSR form
+#   Points:     named point sets (stops) snapped into the network as vertices,
+#               stored as parallel "<name>:keys" / "<name>:vertices" arrays
+# All distances are in the units of the street layer's CRS
+#
+# By default the arrays used inside the search loops are copied into Python lists, which are the
+#   fastest to index. With materialize=False the loops read memoryviews straight onto the arrays
+#   instead, so graphs held in shared or memory-mapped arrays are not copied into every process.
+class StreetGraph:
+    def __init__(self, arrays, materialize=True):
+        self.arrays = arrays
+        self.materialize = materialize
+        self.x = arrays['x']
+        self.y = arrays['y']
+        self.edge_u = arrays['edge_u']
+        self.edge_v = arrays['edge_v']
+        self.edge_length = arrays['edge_length']
+        self.edge_feature = arrays['edge_feature']
+        self._adjacency = None
+        self._edge_lists = None
+        self._grid = None
+        self._point_vertex = {}
+        self._vertex_points = {}
+
+    def vertex_count(self):
+        return len(self.x)
+
+    def edge_count(self):
+        return len(self.edge_u)
+
+    def point_set_names(self):
+        return [name[:-len(':keys')] for name in self.arrays if name.endswith(':keys')]
+
+    # Sequence with fast element access onto one of the arrays
+    def sequence(self, name):
+        if self.materialize:
+            return self.arrays[name].tolist()
+        return memoryview(self.arrays[name])
+
+    def adjacency(self):
+        if self._adjacency is None:
+            self._adjacency = (self.sequence('adj_offsets'), self.sequence('adj_vertices'),
+                               self.sequence('adj_lengths'), self.sequence('adj_edges'))
+        return self._adjacency
+
+    def edge_lists(self):
+        if self._edge_lists is None:
+            self._edge_lists = (self.sequence('edge_u'), self.sequence('edge_v'), self.sequence('edge_length'))
+        return self._edge_lists
+
+    def grid(self):
+        if self._grid is None:
+            self._grid = (self.arrays['grid_meta'].tolist(),
+                          self.sequence('grid_offsets'), self.sequence('grid_edges'),
+                          self.sequence('x'), self.sequence('y'), self.sequence('edge_u'), self.sequence('edge_v'))
+        return self._grid
+
+    # Map of point key -> vertex for one of the snapped point sets
+    def point_vertices(self, name):
+        if name not in self._point_vertex:
+            keys = self.arrays[f'{name}:keys'].tolist()
+            vertices = self.arrays[f'{name}:vertices'].tolist()
+            self._point_vertex[name] = dict(zip(keys, vertices))
+        return self._point_vertex[name]
+
+    # Map of vertex -> point keys for one of the snapped point sets
+    #   (several route stops commonly share a single location)
+    def vertex_points(self, name):
+        if name not in self._vertex_points:
+            lookup = {}
+            keys = self.arrays[f'{name}:keys'].tolist()
+            vertices = self.arrays[f'{name}:vertices'].tolist()
+            for key, vertex in zip(keys, vertices):
+                lookup.setdefault(vertex, []).append(key)
+            self._vertex_points[name] = lookup
+        return self._vertex_points[name]
+
+    # Search seeds for starting at a snapped point
+    def point_seeds(self, name, key):
+        vertex = self.point_vertices(name).get(key)
+        if vertex is None:
+            return []
+        return [(vertex, 0.0)]
+
+    # Search seeds for starting at an arbitrary coordinate
+    #   The coordinate is projected onto the nearest edge and the search
+    #   starts from both ends of that edge, offset by the distance to each end
+    def snap(self, x, y):
+        edge, t = nearest_edge(self.grid(), x, y)
+        if edge is None:
+            return []
+        length = float(self.edge_length[edge])
+        return [(int(self.edge_u[edge]), t * length),
+                (int(self.edge_v[edge]), (1 - t) * length)]
+
+    # Search seeds for many coordinates at once, one list per point in the same form as snap
+    def snap_many(self, xs, ys):
+        edges, ts = self.nearest_edges(xs, ys)
+        lengths = self.edge_length[edges] * (edges >= 0)
+        seeds = []
+        for edge, t, length in zip(edges.tolist(), ts.tolist(), lengths.tolist()):
+            if edge < 0:
+                seeds.append([])
+            else:
+                seeds.append([(int(self.edge_u[edge]), t * length), (int(self.edge_v[edge]), (1 - t) * length)])
+        return seeds
+
+    # nearest_edge for arrays of points, returning arrays of edges (-1 for an empty graph) and positions t
+    #   Points sharing a grid cell share their candidate edges, which are projected onto all of them at once
+    def nearest_edges(self, xs, ys):
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        best_edge = np.full(len(xs), -1, dtype=np.int64)
+        best_t = np.zeros(len(xs))
+        min_x, min_y, cell_size, nx, ny = self.arrays['grid_meta'].tolist()
+        nx = int(nx)
+        ny = int(ny)
+        if nx == 0 or ny == 0 or not len(xs):
+            return best_edge, best_t
+
+        offsets = self.arrays['grid_offsets']
+        grid_edges = self.arrays['grid_edges']
+        cells = np.stack((((xs - min_x) // cell_size).astype(np.int64),
+                          ((ys - min_y) // cell_size).astype(np.int64)), axis=1)
+        homes, members = np.unique(cells, axis=0, return_inverse=True)
+        members = members.reshape(-1)
+        for home, (cx, cy) in enumerate(homes.tolist()):
+            points = np.nonzero(members == home)[0]
+            px = xs[points, None]
+            py = ys[points, None]
+            dist = np.full(len(points), math.inf)
+            max_ring = max(cx, nx - 1 - cx, cy, ny - 1 - cy)
+            ring = 0
+            while ring <= max_ring:
+                candidates = [grid_edges[offsets[cell]:offsets[cell + 1]] for cell in _ring_cells(cx, cy, ring, nx, ny)]
+                candidates = np.concatenate(candidates) if candidates else grid_edges[:0]
+                if len(candidates):
+                    u = self.edge_u[candidates]
+                    v = self.edge_v[candidates]
+                    d, t = _project_many(px, py, self.x[u], self.y[u], self.x[v], self.y[v])
+                    nearest = np.argmin(d, axis=1)
+                    rows = np.arange(len(points))
+                    closer = d[rows, nearest] < dist
+                    dist[closer] = d[rows, nearest][closer]
+                    best_edge[points[closer]] = candidates[nearest[closer]]
+                    best_t[points[closer]] = t[rows, nearest][closer]
+                # Any cell further out is at least ring * cell_size away
+                if (best_edge[points] >= 0).all() and (dist <= ring * cell_size).all():
+                    break
+                ring += 1
+        return best_edge, best_t
+
+    # Bounded multi-source Dijkstra
+    #   seeds is a list of (vertex, starting distance)
+    #   Returns a dictionary of vertex -> shortest distance for every vertex within max_distance
+    def reach(self, seeds, max_distance):
+        offsets, neighbours, lengths, _ = self.adjacency()
+        distances = {}
+        heap = [(d, v) for v, d in seeds if d <= max_distance]
+        heapq.heapify(heap)
+        while heap:
+            d, v = heapq.heappop(heap)
+            if v in distances:
+                continue
+            distances[v] = d
+            for i in range(offsets[v], offsets[v + 1]):
+                w = neighbours[i]
+                if w in distances:
+                    continue
+                next_d = d + lengths[i]
+                if next_d <= max_distance:
+                    heapq.heappush(heap, (next_d, w))
+        return distances
+
+    # reach that also labels every vertex with the source it was reached from
+    #   sources holds the label (such as an origin index) of each seed
+    #   Returns (vertex -> shortest distance, vertex -> label of the nearest seed)
+    def reach_sources(self, seeds, sources, max_distance):
+        offsets, neighbours, lengths, _ = self.adjacency()
+        distances = {}
+        labels = {}
+        heap = [(d, v, s) for (v, d), s in zip(seeds, sources) if d <= max_distance]
+        heapq.heapify(heap)
+        while heap:
+            d, v, s = heapq.heappop(heap)
+            if v in distances:
+                continue
+            distances[v] = d
+            labels[v] = s
+            for i in range(offsets[v], offsets[v + 1]):
+                w = neighbours[i]
+                if w in distances:
+                    continue
+                next_d = d + lengths[i]
+                if next_d <= max_distance:
+                    heapq.heappush(heap, (next_d, w, s))
+        return distances, labels
+
+    # Array of the distance to every vertex from a reach result, inf where unreached
+    def distance_array(self, distances):
+        array = np.full(self.vertex_count(), np.inf)
+        if distances:
+            array[np.fromiter(distances.keys(), dtype=np.int64, count=len(distances))] = \
+                np.fromiter(distances.values(), dtype=np.float64, count=len(distances))
+        return array
+
+    # Array of the label of every vertex from a reach_sources result, -1 where unreached
+    def source_array(self, labels):
+        array = np.full(self.vertex_count(), -1, dtype=np.int64)
+        if labels:
+            array[np.fromiter(labels.keys(), dtype=np.int64, count=len(labels))] = \
+                np.fromiter(labels.values(), dtype=np.int64, count=len(labels))
+        return array
+
+    # Points of a snapped set found by a search, as (key, distance) sorted by distance
+    def reached_points(self, name, distances):
+        lookup = self.vertex_points(name)
+        reached = []
+        for vertex, d in distances.items():
+            for key in lookup.get(vertex, ()):
+                reached.append((key, d))
+        reached.sort(key=lambda p: p[1])
+        return reached
+
+    # Edges (or the parts of edges) covered by a search
+    #   Returns a list of (edge, start, end) where start and end are the distances
+    #   along the edge from edge_u that are within max_distance of a source
+    def reached_edges(self, distances, max_distance):
+        edges, starts, ends = self.covered_edges(*self.edge_spans(distances), max_distance)
+        return list(zip(edges.tolist(), starts.tolist(), ends.tolist()))
+
+    # Edge spans of a search: (edges, distance to edge_u, distance to edge_v) of every edge touching a vertex
+    #   the search reached, ascending by edge, with math.inf at an end it did not reach
+    #   Spans keep the whole walk, so the edges covered within any smaller distance can be cut from them
+    #   (see covered_edges), and the spans of several searches merged (see merge_edge_spans).
+    def edge_spans(self, distances):
+        if not distances:
+            return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+        vertices = np.fromiter(distances.keys(), dtype=np.int64, count=len(distances))
+        vertex_distances = np.fromiter(distances.values(), dtype=np.float64, count=len(distances))
+        order = np.argsort(vertices)
+        vertices = vertices[order]
+        vertex_distances = vertex_distances[order]
+
+        offsets = self.arrays['adj_offsets']
+        starts = offsets[vertices]
+        counts = offsets[vertices + 1] - starts
+        half_edges = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(int(counts.sum()))
+        edges = np.unique(self.arrays['adj_edges'][half_edges]).astype(np.int64)
+
+        def ends(edge_vertices):
+            found = np.minimum(np.searchsorted(vertices, edge_vertices), len(vertices) - 1)
+            return np.where(vertices[found] == edge_vertices, vertex_distances[found], np.inf)
+
+        return edges, ends(self.edge_u[edges]), ends(self.edge_v[edges])
+
+    # The parts of the edges of edge spans within max_distance, as arrays of (edge, start, end)
+    #   where start and end are distances along the edge from edge_u
+    def covered_edges(self, edges, to_u, to_v, max_distance):
+        lengths = np.asarray(self.edge_length)[edges]
+        from_u = max_distance - to_u
+        from_v = max_distance - to_v
+        whole = from_u + from_v >= lengths
+        start_part = ~whole & (from_u > 0)
+        end_part = ~whole & (from_v > 0)
+        return (np.concatenate([edges[whole], edges[start_part], edges[end_part]]),
+                np.concatenate([np.zeros(int(whole.sum())), np.zeros(int(start_part.sum())),
+                                lengths[end_part] - from_v[end_part]]),
+                np.concatenate([lengths[whole], from_u[start_part], lengths[end_part]]))
+
+    # Coordinates of the part of an edge between two distances along it
+    def edge_segment(self, edge, start, end):
+        u = self.edge_u[edge]
+        v = self.edge_v[edge]
+        x1, y1, x2, y2 = float(self.x[u]), float(self.y[u]), float(self.x[v]), float(self.y[v])
+        length = float(self.edge_length[edge])
+        if length == 0:
+            return (x1, y1), (x2, y2)
+        a = start / length
+        b = end / length
+        return ((x1 + (x2 - x1) * a, y1 + (y2 - y1) * a),
+                (x1 + (x2 - x1) * b, y1 + (y2 - y1) * b))
+
+
+
+# Edge spans of a walk from all the sources of several walks at once, from the edge spans of each
+#   (see StreetGraph.edge_spans), keeping the shorter distance to each end of every edge
+def merge_edge_spans(spans):
+    spans = [span for span in spans if len(span[0])]
+    if not spans:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+    edges, inverse = np.unique(np.concatenate([span[0] for span in spans]), return_inverse=True)
+    to_u = np.full(len(edges), np.inf)
+    to_v = np.full(len(edges), np.inf)
+    np.minimum.at(to_u, inverse, np.concatenate([span[1] for span in spans]))
+    np.minimum.at(to_v, inverse, np.concatenate([span[2] for span in spans]))
+    return edges, to_u, to_v
+
+
+# Builds a StreetGraph
+#   lines:      iterable of (feature id, [(x, y), ...]), one entry per line part
+#   point_sets: dictionary of name -> list of (key, x, y)
+# Each segment of each line becomes an edge; lines sharing a coordinate share a vertex.
+# Every point is projected onto its nearest edge, splitting the edge so the point becomes a vertex.
+def build_street_graph(lines, point_sets, cell_size=snap_cell_size):
+    vertex_ids = {}
+    xs = []
+    ys = []
+
+    def vertex_at(coord):
+        vertex = vertex_ids.get(coord)
+        if vertex is None:
+            vertex = len(xs)
+            vertex_ids[coord] = vertex
+            xs.append(coord[0])
+            ys.append(coord[1])
+        return vertex
+
+    seg_u = []
+    seg_v = []
+    seg_feature = []
+    for feature_id, coords in lines:
+        previous = None
+        for coord in coords:
+            vertex = vertex_at((float(coord[0]), float(coord[1])))
+            if previous is not None and previous != vertex:
+                seg_u.append(previous)
+                seg_v.append(vertex)
+                seg_feature.append(feature_id)
+            previous = vertex
+
+    # Snap every point onto its nearest segment, collecting the splits needed on each segment
+    grid = _segment_grid(xs, ys, seg_u, seg_v, cell_size)
+    splits = {}
+    point_vertices = {name: [] for name in point_sets}
+    pending = []
+    for name, points in point_sets.items():
+        for index, (key, px, py) in enumerate(points):
+            seg, t = nearest_edge(grid, px, py)
+            if seg is None:
+                point_vertices[name].append(-1)
+                continue
+            if t <= snap_tolerance:
+                point_vertices[name].append(seg_u[seg])
+            elif t >= 1 - snap_tolerance:
+                point_vertices[name].append(seg_v[seg])
+            else:
+                point_vertices[name].append(None)
+                splits.setdefault(seg, set()).add(t)
+                pending.append((name, index, seg, t))
+
+    # Rebuild the edge list, replacing split segments with chains through the new vertices
+    split_vertices = {}
+    edge_u = []
+    edge_v = []
+    edge_feature = []
+    for seg in range(len(seg_u)):
+        u = seg_u[seg]
+        v = seg_v[seg]
+        if seg not in splits:
+            edge_u.append(u)
+            edge_v.append(v)
+            edge_feature.append(seg_feature[seg])
+            continue
+        previous = u
+        for t in sorted(splits[seg]):
+            vertex = len(xs)
+            xs.append(xs[u] + (xs[v] - xs[u]) * t)
+            ys.append(ys[u] + (ys[v] - ys[u]) * t)
+            split_vertices[(seg, t)] = vertex
+            edge_u.append(previous)
+            edge_v.append(vertex)
+            edge_feature.append(seg_feature[seg])
+            previous = vertex
+        edge_u.append(previous)
+        edge_v.append(v)
+        edge_feature.append(seg_feature[seg])
+
+    for name, index, seg, t in pending:
+        point_vertices[name][index] = split_vertices[(seg, t)]
+
+    arrays = {
+        'x': np.array(xs, dtype=np.float64),
+        'y': np.array(ys, dtype=np.float64),
+        'edge_u': np.array(edge_u, dtype=np.int32),
+        'edge_v': np.array(edge_v, dtype=np.int32),
+        'edge_feature': np.array(edge_feature, dtype=np.int64),
+    }
+    arrays['edge_length'] = np.hypot(arrays['x'][arrays['edge_v']] - arrays['x'][arrays['edge_u']],
+                                     arrays['y'][arrays['edge_v']] - arrays['y'][arrays['edge_u']])
+
+    # CSR adjacency - each undirected edge contributes a half-edge from both of its ends
+    edge_count = len(edge_u)
+    ends = np.concatenate((arrays['edge_u'], arrays['edge_v']))
+    others = np.concatenate((arrays['edge_v'], arrays['edge_u']))
+    edge_ids = np.concatenate((np.arange(edge_count, dtype=np.int32),
+                               np.arange(edge_count, dtype=np.int32)))
+    order = np.argsort(ends, kind='stable')
+    arrays['adj_offsets'] = np.concatenate(([0], np.cumsum(np.bincount(ends, minlength=len(xs))))).astype(np.int64)
+    arrays['adj_vertices'] = others[order].astype(np.int32)
+    arrays['adj_edges'] = edge_ids[order]
+    arrays['adj_lengths'] = arrays['edge_length'][arrays['adj_edges']]
+
+    meta, grid_offsets, grid_edges = _segment_grid(xs, ys, edge_u, edge_v, cell_size)[:3]
+    arrays['grid_meta'] = np.array(meta, dtype=np.float64)
+    arrays['grid_offsets'] = np.array(grid_offsets, dtype=np.int64)
+    arrays['grid_edges'] = np.array(grid_edges, dtype=np.int32)
+
+    for name, points in point_sets.items():
+        keep = [i for i, vertex in enumerate(point_vertices[name]) if vertex >= 0]
+        arrays[f'{name}:keys'] = np.array([points[i][0] for i in keep], dtype=np.int64)
+        arrays[f'{name}:vertices'] = np.array([point_vertices[name][i] for i in keep], dtype=np.int32)
+
+    return StreetGraph(arrays)
+
+
+
+# Buckets segments into a uniform grid by their bounding boxes
+#   Returns the grid in the same form as StreetGraph.grid()
+def _segment_grid(xs, ys, seg_u, seg_v, cell_size):
+    x1 = [xs[u] for u in seg_u]
+    y1 = [ys[u] for u in seg_u]
+    x2 = [xs[v] for v in seg_v]
+    y2 = [ys[v] for v in seg_v]
+    if not seg_u:
+        return [0.0, 0.0, cell_size, 0, 0], [0], [], xs, ys, seg_u, seg_v
+
+    min_x = min(min(x1), min(x2))
+    min_y = min(min(y1), min(y2))
+    nx = int((max(max(x1), max(x2)) - min_x) // cell_size) + 1
+    ny = int((max(max(y1), max(y2)) - min_y) // cell_size) + 1
+
+    cells = {}
+    for seg in range(len(seg_u)):
+        cx1 = int((min(x1[seg], x2[seg]) - min_x) // cell_size)
+        cx2 = int((max(x1[seg], x2[seg]) - min_x) // cell_size)
+        cy1 = int((min(y1[seg], y2[seg]) - min_y) // cell_size)
+        cy2 = int((max(y1[seg], y2[seg]) - min_y) // cell_size)
+        for cx in range(cx1, cx2 + 1):
+            for cy in range(cy1, cy2 + 1):
+                cells.setdefault(cy * nx + cx, []).append(seg)
+
+    offsets = [0]
+    edges = []
+    for cell in range(nx * ny):
+        edges.extend(cells.get(cell, ()))
+        offsets.append(len(edges))
+    return [min_x, min_y, cell_size, nx, ny], offsets, edges, xs, ys, seg_u, seg_v
+
+
+# Grid cells on the square ring at distance ring around (cx, cy), in the order nearest_edge visits them
+def _ring_cells(cx, cy, ring, nx, ny):
+    cells = []
+    for gx in range(max(cx - ring, 0), min(cx + ring, nx - 1) + 1):
+        on_side = gx == cx - ring or gx == cx + ring
+        for gy in range(max(cy - ring, 0), min(cy + ring, ny - 1) + 1):
+            if on_side or gy == cy - ring or gy == cy + ring:
+                cells.append(gy * nx + gx)
+    return cells
+
+
+# Finds the edge nearest to a point using a grid from _segment_grid or StreetGraph.grid()
+#   Returns (edge, t) where t is the position of the projected point along the edge (0 to 1),
+#   or (None, None) for an empty grid
+def nearest_edge(grid, px, py):
+    meta, offsets, edges, xs, ys, edge_u, edge_v = grid
+    min_x, min_y, cell_size, nx, ny = meta
+    nx = int(nx)
+    ny = int(ny)
+    if nx == 0 or ny == 0:
+        return None, None
+
+    cx = int((px - min_x) // cell_size)
+    cy = int((py - min_y) // cell_size)
+    max_ring = max(cx, nx - 1 - cx, cy, ny - 1 - cy)
+
+    best_edge = None
+    best_t = None
+    best_dist = math.inf
+    ring = 0
+    while ring <= max_ring:
+        for gx in range(cx - ring, cx + ring + 1):
+            if gx < 0 or gx >= nx:
+                continue
+            on_side = gx == cx - ring or gx == cx + ring
+            for gy in range(cy - ring, cy + ring + 1):
+                if gy < 0 or gy >= ny:
+                    continue
+                if not on_side and gy != cy - ring and gy != cy + ring:
+                    continue
+                cell = gy * nx + gx
+                for i in range(offsets[cell], offsets[cell + 1]):
+                    edge = edges[i]
+                    u = edge_u[edge]
+                    v = edge_v[edge]
+                    dist, t = _project(px, py, xs[u], ys[u], xs[v], ys[v])
+                    if dist < best_dist:
+                        best_dist = dist
+                        best_edge = edge
+                        best_t = t
+        # Any cell further out is at least ring * cell_size away
+        if best_edge is not None and best_dist <= ring * cell_size:
+            break
+        ring += 1
+    return best_edge, best_t
+
+
+# Distance from a point to a segment and the position of its projection along the segment
+def _project(px, py, x1, y1, x2, y2):
+    dx = x2 - x1
+    dy = y2 - y1
+    length_sq = dx * dx + dy * dy
+    if length_sq == 0:
+        t = 0.0
+    else:
+        t = ((px - x1) * dx + (py - y1) * dy) / length_sq
+        t = min(1.0, max(0.0, t))
+    return math.hypot(px - (x1 + dx * t), py - (y1 + dy * t)), t
+
+
+# _project for a column of points against a row of segments, returning (distance, t) matrices
+def _project_many(px, py, x1, y1, x2, y2):
+    dx = x2 - x1
+    dy = y2 - y1
+    length_sq = dx * dx + dy * dy
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(length_sq > 0, ((px - x1) * dx + (py - y1) * dy) / length_sq, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    return np.hypot(px - (x1 + dx * t), py - (y1 + dy * t)), t
@@ -0,0 +1,168 @@
+import csv
+import functools
+import json
+import os
+import threading
+import time
+
+# The tracer recording spans, or None while tracing is off
+#   Traced functions check this once per call, so tracing costs next to nothing while it is off
+active_tracer = None
+
+
+# Spans of the stages of a search, each recorded as
+#   (stage, start, end, thread, node, features in, features out)
+#   with times from time.perf_counter and node the id of the search node the stage ran for
+class Tracer:
+    def __init__(self):
+        self.spans = []
+        self.origin = time.perf_counter()
+
+    def add(self, stage, start, end, node=None, features_in=None, features_out=None):
+        self.spans.append((stage, start, end, threading.get_ident(), node, features_in, features_out))
+
+    # Chrome trace event format, as read by chrome://tracing and Perfetto: one complete event per span,
+    #   with the per-stage table under otherData
+    def write_chrome_trace(self, path):
+        pid = os.getpid()
+        events = []
+        for stage, start, end, thread, node, features_in, features_out in self.spans:
+            args = {name: value for name, value in
+                    (('node', node), ('features_in', features_in), ('features_out', features_out))
+                    if value is not None}
+            events.append({'name': stage, 'cat': 'search', 'ph': 'X', 'pid': pid, 'tid': thread,
+                           'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6, 'args': args})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                       'otherData': {'stages': [dict(zip(stage_columns, row)) for row in self.stage_table()]}}, f)
+
+    # Per-stage totals, slowest first, as rows of stage_columns
+    #   Self time excludes the time spent in stages nested inside each span
+    def stage_table(self):
+        totals = {}
+        nested = self.nested_time()
+        for i, (stage, start, end, _, _, features_in, features_out) in enumerate(self.spans):
+            row = totals.setdefault(stage, [stage, 0, 0.0, 0.0, 0.0, 0, 0])
+            row[1] += 1
+            row[2] += end - start
+            row[3] += end - start - nested[i]
+            row[4] = max(row[4], end - start)
+            row[5] += features_in or 0
+            row[6] += features_out or 0
+        return sorted((tuple(row) for row in totals.values()), key=lambda row: -row[2])
+
+    # Time spent in spans directly nested inside each span, on the same thread
+    def nested_time(self):
+        nested = [0.0] * len(self.spans)
+        open_spans = {}
+        order = sorted(range(len(self.spans)), key=lambda i: (self.spans[i][1], -self.spans[i][2]))
+        for i in order:
+            _, start, end, thread, _, _, _ = self.spans[i]
+            stack = open_spans.setdefault(thread, [])
+            while stack and self.spans[stack[-1]][2] <= start:
+                stack.pop()
+            if stack:
+                nested[stack[-1]] += end - start
+            stack.append(i)
+        return nested
+
+    def write_stage_table(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(stage_columns)
+            writer.writerows(self.stage_table())
+
+    def format_stage_table(self):
+        lines = [f"{'Stage':<36}{'Calls':>8}{'Total s':>10}{'Self s':>10}{'Max s':>10}{'In':>10}{'Out':>10}"]
+        for stage, calls, total, own, longest, features_in, features_out in self.stage_table():
+            lines.append(f"{stage:<36}{calls:>8}{total:>10.3f}{own:>10.3f}{longest:>10.3f}"
+                         f"{features_in:>10}{features_out:>10}")
+        return '\n'.join(lines)
+
+
+stage_columns = ['stage', 'calls', 'total_seconds', 'self_seconds', 'max_seconds', 'features_in', 'features_out']
+
+
+def start_tracing():
+    global active_tracer
+    active_tracer = Tracer()
+    return active_tracer
+
+
+# Turns tracing off, returning the tracer that was recording
+def stop_tracing():
+    global active_tracer
+    tracer = active_tracer
+    active_tracer = None
+    return tracer
+
+
+# Decorator recording a span for every call of a function while tracing is on
+#   node(*args, **kwargs) and features_in(*args, **kwargs) describe the call from its arguments,
+#   features_out(result) from what it returned
+def traced(stage, node=None, features_in=None, features_out=None):
+    def decorate(function):
+        @functools.wraps(function)
+        def call(*args, **kwargs):
+            tracer = active_tracer
+            if tracer is None:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            end = time.perf_counter()
+            tracer.add(stage, start, end, node(*args, **kwargs) if node else None,
+                       features_in(*args, **kwargs) if features_in else None,
+                       features_out(result) if features_out else None)
+            return result
+        return call
+    return decorate
+
+
+# Context manager recording a span around a block of code while tracing is on
+#   The span's features_out can be set inside the block
+def span(stage, node=None, features_in=None):
+    if active_tracer is None:
+        return _off
+    return _Span(active_tracer, stage, node, features_in)
+
+
+class _Span:
+    def __init__(self, tracer, stage, node, features_in):
+        self.tracer = tracer
+        self.stage = stage
+        self.node = node
+        self.features_in = features_in
+        self.features_out = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.add(self.stage, self.start, time.perf_counter(), self.node, self.features_in, self.features_out)
+        return False
+
+
+class _OffSpan:
+    features_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_off = _OffSpan()
+
+
+# Number of features in a layer or items in a list, for features_in and features_out
+def feature_count(value):
+    if value is None:
+        return 0
+    if hasattr(value, 'featureCount'):
+        return value.featureCount()
+    return len(value)
@@ -0,0 +1,90 @@
+import numpy as np
+
+
+# Walking times (in hours) from every stop to every stop and route stop within a time bound
+#   Stored sparsely, one CSR structure per target point set:
+#       sources                 stop fids, one row each, ascending
+#       <name>:offsets          row r covers <name>:targets/<name>:costs[offsets[r]:offsets[r + 1]]
+#       <name>:targets          fids of the reachable points
+#       <name>:costs            walking time to each of them, ascending within a row
+#       max_cost                the bound the table was built with
+class TransferTable:
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.max_cost = float(arrays['max_cost'][0])
+        self._rows = None
+        self._inverse = {}
+
+    def target_set_names(self):
+        return [name[:-len(':targets')] for name in self.arrays if name.endswith(':targets')]
+
+    # Whether a walk of the given length can be answered from the table
+    def covers(self, max_cost):
+        return max_cost <= self.max_cost
+
+    def row(self, fid):
+        if self._rows is None:
+            self._rows = {fid: row for row, fid in enumerate(self.arrays['sources'].tolist())}
+        return self._rows.get(fid)
+
+    # Points of a target set reachable from a stop within max_cost, as (fid, cost) sorted by cost
+    def transfers(self, fid, name, max_cost):
+        row = self.row(fid)
+        if row is None:
+            return []
+        offsets = self.arrays[f'{name}:offsets']
+        start = int(offsets[row])
+        end = int(offsets[row + 1])
+        costs = self.arrays[f'{name}:costs'][start:end]
+        cut = int(np.searchsorted(costs, max_cost, side='right'))
+        targets = self.arrays[f'{name}:targets'][start:start + cut]
+        return list(zip(targets.tolist(), costs[:cut].tolist()))
+
+    # Stops from which a point of a target set is reachable within max_cost, as (stop fid, cost) sorted by cost
+    #   Walks are symmetric on the undirected street graph, so these are also the walks from the point to the stops
+    def transfers_to(self, fid, name, max_cost):
+        if name not in self._inverse:
+            offsets = self.arrays[f'{name}:offsets']
+            targets = self.arrays[f'{name}:targets']
+            costs = self.arrays[f'{name}:costs']
+            sources = np.repeat(self.arrays['sources'], np.diff(offsets))
+            order = np.lexsort((costs, targets))
+            self._inverse[name] = (targets[order], sources[order], costs[order])
+        targets, sources, costs = self._inverse[name]
+        start = int(np.searchsorted(targets, fid, side='left'))
+        end = int(np.searchsorted(targets, fid, side='right'))
+        cut = start + int(np.searchsorted(costs[start:end], max_cost, side='right'))
+        return list(zip(sources[start:cut].tolist(), costs[start:cut].tolist()))
+
+
+
+# Walks the street graph from every point of source_name, recording the points of each
+#   target set reached within max_distance
+#   distance_per_hour converts graph distances to hours
+#   progress, if given, is called with the fraction of sources processed
+def build_transfer_table(graph, source_name, target_names, max_distance, distance_per_hour, progress=None):
+    sources = sorted(graph.point_vertices(source_name).keys())
+    rows = {name: ([0], [], []) for name in target_names}
+
+    for index, fid in enumerate(sources):
+        distances = graph.reach(graph.point_seeds(source_name, fid), max_distance)
+        for name in target_names:
+            offsets, targets, costs = rows[name]
+            for target, distance in graph.reached_points(name, distances):
+                if name == source_name and target == fid:
+                    continue
+                targets.append(target)
+                costs.append(distance / distance_per_hour)
+            offsets.append(len(targets))
+        if progress and index % 100 == 0:
+            progress(index / len(sources))
+
+    arrays = {
+        'sources': np.array(sources, dtype=np.int64),
+        'max_cost': np.array([max_distance / distance_per_hour], dtype=np.float64),
+    }
+    for name, (offsets, targets, costs) in rows.items():
+        arrays[f'{name}:offsets'] = np.array(offsets, dtype=np.int64)
+        arrays[f'{name}:targets'] = np.array(targets, dtype=np.int64)
+        arrays[f'{name}:costs'] = np.array(costs, dtype=np.float32)
+    return TransferTable(arrays)
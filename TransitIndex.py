@@ -0,0 +1,319 @@
+import numpy as np
+
+
+# Ordered stop sequence of every route pattern (one per rte and dir)
+#   Patterns:   pattern_rte, pattern_dir, pattern_speed (thousands of feet per hour)
+#   Stops:      the stops of pattern p are stop_fids/stop_measures/stop_times[stop_offsets[p]:stop_offsets[p + 1]],
+#               ordered by their distance along the route (stop_measures) with the cumulative
+#               in-vehicle time from the start of the route in hours (stop_times)
+#   Lines:      the route geometry of pattern p is line_x/line_y/line_measures[line_offsets[p]:line_offsets[p + 1]]
+class RoutePatterns:
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.pattern_rte = arrays['pattern_rte']
+        self.pattern_dir = arrays['pattern_dir']
+        self.stop_offsets = arrays['stop_offsets']
+        self.stop_fids = arrays['stop_fids']
+        self.stop_times = arrays['stop_times']
+        self.stop_measures = arrays['stop_measures']
+        self._positions = None
+        self._patterns = None
+        self._position_patterns = None
+
+    def pattern_count(self):
+        return len(self.pattern_rte)
+
+    # Index of the pattern serving a rte and dir, or None
+    def pattern(self, rte, dir):
+        if self._patterns is None:
+            self._patterns = {(r, d): p for p, (r, d) in
+                              enumerate(zip(self.pattern_rte.tolist(), self.pattern_dir.tolist()))}
+        return self._patterns.get((rte, dir))
+
+    # Index of a route stop within stop_fids, or None if it is not on a pattern
+    def position(self, fid):
+        if self._positions is None:
+            self._positions = {fid: i for i, fid in enumerate(self.stop_fids.tolist())}
+        return self._positions.get(fid)
+
+    def pattern_of_position(self, position):
+        if self._position_patterns is None:
+            counts = np.diff(self.stop_offsets)
+            self._position_patterns = np.repeat(np.arange(len(counts)), counts).tolist()
+        return self._position_patterns[position]
+
+    # Stops downstream of a boarding route stop that can be reached within max_time,
+    #   as (fid, in-vehicle time) in route order
+    def ride(self, fid, max_time):
+        start = self.position(fid)
+        if start is None:
+            return []
+        end = int(self.stop_offsets[self.pattern_of_position(start) + 1])
+        times = self.stop_times[start + 1:end] - self.stop_times[start]
+        cut = int(np.searchsorted(times, max_time, side='right'))
+        return list(zip(self.stop_fids[start + 1:start + 1 + cut].tolist(), times[:cut].tolist()))
+
+    # Route geometry between two stops of the same pattern as a list of (x, y)
+    def line_between(self, from_fid, to_fid):
+        start = self.position(from_fid)
+        end = self.position(to_fid)
+        pattern = self.pattern_of_position(start)
+        first = int(self.arrays['line_offsets'][pattern])
+        last = int(self.arrays['line_offsets'][pattern + 1])
+        xs = self.arrays['line_x'][first:last]
+        ys = self.arrays['line_y'][first:last]
+        measures = self.arrays['line_measures'][first:last]
+        from_measure = float(self.stop_measures[start])
+        to_measure = float(self.stop_measures[end])
+
+        inner = np.nonzero((measures > from_measure) & (measures < to_measure))[0].tolist()
+        coords = [_interpolate(xs, ys, measures, from_measure)]
+        coords.extend((float(xs[i]), float(ys[i])) for i in inner)
+        coords.append(_interpolate(xs, ys, measures, to_measure))
+        return coords
+
+    # Merges ridden spans, each (from route stop fid, to route stop fid), that overlap on the same pattern,
+    #   so every stretch of route ridden is drawn once
+    def merge_spans(self, spans):
+        merged = []
+        for start, end in sorted((self.position(from_fid), self.position(to_fid)) for from_fid, to_fid in spans):
+            if (merged and start <= merged[-1][1]
+                    and self.pattern_of_position(start) == self.pattern_of_position(merged[-1][0])):
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return [(int(self.stop_fids[start]), int(self.stop_fids[end])) for start, end in merged]
+
+    # The ridden part of each pattern, from its first boarding to its last stop reached in the vehicle,
+    #   as (from route stop fid, to route stop fid)
+    #   boardings and arrivals are dictionaries of route stop fid -> time
+    def ridden_spans(self, boardings, arrivals):
+        boarded = np.zeros(len(self.stop_fids), dtype=bool)
+        reached = np.zeros(len(self.stop_fids), dtype=bool)
+        boarded[[self.position(fid) for fid in boardings]] = True
+        reached[[self.position(fid) for fid in arrivals]] = True
+        spans = []
+        offsets = self.stop_offsets.tolist()
+        for pattern in range(self.pattern_count()):
+            start, end = offsets[pattern], offsets[pattern + 1]
+            first = np.nonzero(boarded[start:end])[0]
+            last = np.nonzero(reached[start:end])[0]
+            if not len(first) or not len(last) or last[-1] <= first[0]:
+                continue
+            spans.append((int(self.stop_fids[start + first[0]]), int(self.stop_fids[start + last[-1]])))
+        return spans
+
+
+
+# Dense identifier translation between route stops, stop_ids and stops
+#   Every array is indexed directly by the identifier it translates from, with -1 where there is no feature:
+#       route_stop_stop_id  route stop fid -> stop_id
+#       route_stop_stop_fid route stop fid -> fid of the stop with the same stop_id
+#       route_stop_rte      route stop fid -> rte
+#       route_stop_dir      route stop fid -> dir
+#       stop_id_fid         stop_id -> stop fid
+class StopIndex:
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self._lists = None
+
+    # Plain lists are the fastest structure for single element lookups in the search loop
+    def lists(self):
+        if self._lists is None:
+            self._lists = {name: array.tolist() for name, array in self.arrays.items()}
+        return self._lists
+
+    def _get(self, name, key):
+        values = self.lists()[name]
+        if key is None or key < 0 or key >= len(values) or values[key] < 0:
+            return None
+        return values[key]
+
+    def stop_id(self, route_stop_fid):
+        return self._get('route_stop_stop_id', route_stop_fid)
+
+    def stop_fid(self, stop_id):
+        return self._get('stop_id_fid', stop_id)
+
+    def route_stop_stop_fid(self, route_stop_fid):
+        return self._get('route_stop_stop_fid', route_stop_fid)
+
+    def rte_dir(self, route_stop_fid):
+        return self._get('route_stop_rte', route_stop_fid), self._get('route_stop_dir', route_stop_fid)
+
+    # Path record for reaching a route stop, with the fields the search reads from paths
+    def route_stop_path(self, route_stop_fid, cost):
+        lists = self.lists()
+        return {'fid': route_stop_fid,
+                'stop_id': lists['route_stop_stop_id'][route_stop_fid],
+                'rte': lists['route_stop_rte'][route_stop_fid],
+                'dir': lists['route_stop_dir'][route_stop_fid],
+                'cost': cost}
+
+
+
+# Builds a StopIndex
+#   route_stops: list of (fid, stop_id, rte, dir)
+#   stops:       list of (fid, stop_id)
+def build_stop_index(route_stops, stops):
+    stop_id_fid = _dense([(stop_id, fid) for fid, stop_id in stops if stop_id is not None])
+    route_stop_stop_id = _dense([(fid, stop_id) for fid, stop_id, _, _ in route_stops if stop_id is not None])
+    stop_fids = np.full(len(route_stop_stop_id), -1, dtype=np.int64)
+    known = (route_stop_stop_id >= 0) & (route_stop_stop_id < len(stop_id_fid))
+    stop_fids[known] = stop_id_fid[route_stop_stop_id[known]]
+
+    return StopIndex({
+        'route_stop_stop_id': route_stop_stop_id,
+        'route_stop_stop_fid': stop_fids,
+        'route_stop_rte': _dense([(fid, rte) for fid, _, rte, _ in route_stops if rte is not None]),
+        'route_stop_dir': _dense([(fid, dir) for fid, _, _, dir in route_stops if dir is not None]),
+        'stop_id_fid': stop_id_fid,
+    })
+
+
+# Array holding value at index key for each (key, value) pair and -1 elsewhere
+def _dense(pairs):
+    size = max((key for key, _ in pairs), default=-1) + 1
+    array = np.full(size, -1, dtype=np.int64)
+    for key, value in pairs:
+        array[key] = value
+    return array
+
+
+
+# Trips per hour and expected wait of every route, keyed by rte and dir
+#   The wait is modeled as half of the headway; routes without trips have an infinite wait
+class HeadwayTable:
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self._lookup = None
+
+    # Replace the table's contents with rows of (rte, dir, trips per hour)
+    def refresh(self, rows):
+        self.arrays = build_headway_table(rows).arrays
+        self._lookup = None
+
+    def lookup(self):
+        if self._lookup is None:
+            self._lookup = {(rte, dir): (trips, wait) for rte, dir, trips, wait in
+                            zip(self.arrays['rte'].tolist(), self.arrays['dir'].tolist(),
+                                self.arrays['trips_per_hour'].tolist(), self.arrays['expected_wait'].tolist())}
+        return self._lookup
+
+    def trips_per_hour(self, rte, dir):
+        return self.lookup().get((rte, dir), (0.0, np.inf))[0]
+
+    # Expected wait in hours for a rte and dir, or None if the route has no service
+    def expected_wait(self, rte, dir):
+        wait = self.lookup().get((rte, dir), (0.0, np.inf))[1]
+        return None if wait == np.inf else wait
+
+
+
+# Builds a HeadwayTable from rows of (rte, dir, trips per hour)
+#   If a route appears more than once the first row is used
+def build_headway_table(rows):
+    seen = set()
+    rtes = []
+    dirs = []
+    trips = []
+    for rte, dir, trips_per_hour in rows:
+        if (rte, dir) in seen:
+            continue
+        seen.add((rte, dir))
+        rtes.append(rte)
+        dirs.append(dir)
+        trips.append(float(trips_per_hour) if trips_per_hour else 0.0)
+
+    trips = np.array(trips, dtype=np.float64)
+    with np.errstate(divide='ignore'):
+        waits = np.where(trips > 0, 0.5 / trips, np.inf)
+    return HeadwayTable({
+        'rte': np.array(rtes, dtype=np.int64),
+        'dir': np.array(dirs, dtype=np.int64),
+        'trips_per_hour': trips,
+        'expected_wait': waits,
+    })
+
+
+
+# Builds RoutePatterns
+#   routes: list of (rte, dir, kilo_ft_per_hour, [(x, y), ...]) with line parts in travel order
+#   stops:  list of (fid, rte, dir, x, y) for every route stop
+# Each stop is located along its route by projecting it onto the nearest segment of the route line
+def build_route_patterns(routes, stops):
+    stops_by_route = {}
+    for fid, rte, dir, x, y in stops:
+        stops_by_route.setdefault((rte, dir), []).append((fid, x, y))
+
+    pattern_rte = []
+    pattern_dir = []
+    pattern_speed = []
+    stop_offsets = [0]
+    stop_fids = []
+    stop_measures = []
+    stop_times = []
+    line_offsets = [0]
+    line_x = []
+    line_y = []
+    line_measures = []
+
+    for rte, dir, speed, coords in routes:
+        route_stops = stops_by_route.pop((rte, dir), None)
+        if not route_stops or not speed or len(coords) < 2:
+            continue
+
+        xs = np.array([c[0] for c in coords], dtype=np.float64)
+        ys = np.array([c[1] for c in coords], dtype=np.float64)
+        measures = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(xs), np.diff(ys)))))
+
+        located = sorted((_locate(xs, ys, measures, x, y), fid) for fid, x, y in route_stops)
+
+        pattern_rte.append(rte)
+        pattern_dir.append(dir)
+        pattern_speed.append(speed)
+        for measure, fid in located:
+            stop_fids.append(fid)
+            stop_measures.append(measure)
+            stop_times.append(measure / (speed * 1000))
+        stop_offsets.append(len(stop_fids))
+        line_x.extend(xs.tolist())
+        line_y.extend(ys.tolist())
+        line_measures.extend(measures.tolist())
+        line_offsets.append(len(line_x))
+
+    return RoutePatterns({
+        'pattern_rte': np.array(pattern_rte, dtype=np.int64),
+        'pattern_dir': np.array(pattern_dir, dtype=np.int64),
+        'pattern_speed': np.array(pattern_speed, dtype=np.float64),
+        'stop_offsets': np.array(stop_offsets, dtype=np.int64),
+        'stop_fids': np.array(stop_fids, dtype=np.int64),
+        'stop_measures': np.array(stop_measures, dtype=np.float64),
+        'stop_times': np.array(stop_times, dtype=np.float64),
+        'line_offsets': np.array(line_offsets, dtype=np.int64),
+        'line_x': np.array(line_x, dtype=np.float64),
+        'line_y': np.array(line_y, dtype=np.float64),
+        'line_measures': np.array(line_measures, dtype=np.float64),
+    })
+
+
+# Distance along a polyline of its nearest point to (x, y)
+def _locate(xs, ys, measures, x, y):
+    dx = np.diff(xs)
+    dy = np.diff(ys)
+    length_sq = dx * dx + dy * dy
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = ((x - xs[:-1]) * dx + (y - ys[:-1]) * dy) / length_sq
+    t = np.clip(np.nan_to_num(t), 0, 1)
+    dist = np.hypot(xs[:-1] + dx * t - x, ys[:-1] + dy * t - y)
+    segment = int(np.argmin(dist))
+    return float(measures[segment] + t[segment] * np.sqrt(length_sq[segment]))
+
+
+# Point at a distance along a polyline
+def _interpolate(xs, ys, measures, measure):
+    i = int(np.searchsorted(measures, measure, side='right')) - 1
+    i = min(max(i, 0), len(measures) - 2)
+    span = measures[i + 1] - measures[i]
+    t = (measure - measures[i]) / span if span else 0.0
+    return (float(xs[i] + (xs[i + 1] - xs[i]) * t), float(ys[i] + (ys[i + 1] - ys[i]) * t))
@@ -0,0 +1,141 @@
+from BlockColumns import BlockColumns
+from BlockIndex import BlockReach
+from GtfsTimetable import GtfsTimetable
+from StreetGraph import StreetGraph, merge_edge_spans
+from TransferTable import TransferTable
+from TransitIndex import HeadwayTable, RoutePatterns, StopIndex
+from WalkCache import WalkCache
+
+
+# Everything a search needs to know about the street and transit networks, independent of QGIS
+#   graph:              StreetGraph with both stop layers snapped in
+#   transfers:          TransferTable of walks from stops
+#   patterns:           RoutePatterns of every rte and dir
+#   headways:           HeadwayTable of expected waits
+#   stop_index:         StopIndex translating between route stops, stop_ids and stops
+#   walk_speed:         graph distance units walked per hour
+#   stops_set:          name of the stops point set in the graph and transfer table
+#   route_stops_set:    name of the route stops point set in the graph and transfer table
+#   block_reach:        BlockReach of the census blocks, only needed for travel time matrices and block sums
+#   block_columns:      BlockColumns of the census blocks' fields, only needed for block sums
+#   walk_cache:         WalkCache of the walks from stops, reused by every search on the network for the walks
+#                       longer than the transfer table covers and for the streets walked at the end of a search;
+#                       without one each such walk searches the street graph
+#   limit, where taken, is the time limit of the search asking for a walk, which caps how far the walk cache
+#   extends a walk asked for again with more time
+class TransitNetwork:
+    def __init__(self, graph, transfers, patterns, headways, stop_index, walk_speed, stops_set, route_stops_set,
+                 block_reach=None, block_columns=None, walk_cache=None):
+        self.graph = graph
+        self.transfers = transfers
+        self.patterns = patterns
+        self.headways = headways
+        self.stop_index = stop_index
+        self.walk_speed = walk_speed
+        self.stops_set = stops_set
+        self.route_stops_set = route_stops_set
+        self.block_reach = block_reach
+        self.block_columns = block_columns
+        self.walk_cache = walk_cache
+
+    # Points of a target set (stops or route stops) reachable on foot from a stop within max_time,
+    #   as (fid, walking time) sorted by time
+    #   Walks longer than the transfer table covers fall back to walking the street graph (see walks)
+    def walk_from_stop(self, stop_fid, target_set, max_time, limit=None):
+        if self.transfers.covers(max_time):
+            return self.transfers.transfers(stop_fid, target_set, max_time)
+        return [(fid, cost) for fid, cost in self.walks(self.stops_set, stop_fid, target_set, max_time, limit)
+                if not (target_set == self.stops_set and fid == stop_fid)]
+
+    # Stops from which a route stop is reachable on foot within max_time, as (stop fid, walking time) sorted by time
+    #   Walks longer than the transfer table covers fall back to walking the street graph from the route stop
+    def walk_to_route_stop(self, route_stop_fid, max_time, limit=None):
+        if self.transfers.covers(max_time):
+            return self.transfers.transfers_to(route_stop_fid, self.route_stops_set, max_time)
+        return self.walks(self.route_stops_set, route_stop_fid, self.stops_set, max_time, limit)
+
+    # Points of a target set reachable on foot from a point of a source set within max_time,
+    #   as (fid, walking time) sorted by time, taken from the walk cache when the network has one
+    def walks(self, source_set, fid, target_set, max_time, limit=None):
+        if self.walk_cache is not None:
+            return self.walk_cache.reachable(source_set, fid, target_set, max_time, limit)
+        distances = self.graph.reach(self.graph.point_seeds(source_set, fid), max_time * self.walk_speed)
+        return [(key, distance / self.walk_speed) for key, distance in self.graph.reached_points(target_set, distances)]
+
+    # Edge spans (see StreetGraph.edge_spans) of everything reachable on foot within time_limit from the origin
+    #   (given by the distances of its own walk) and from the points of source_set reached at the given times
+    #   (fid -> hours), as a single walk from all of them would find: the walks from the points come from
+    #   the walk cache, shifted by their times
+    def walked_edge_spans(self, origin_distances, source_set, arrivals, time_limit):
+        graph = self.graph
+        spans = [graph.edge_spans(origin_distances)]
+        for fid, arrival in arrivals.items():
+            if arrival > time_limit:
+                continue
+            if self.walk_cache is not None:
+                edges, to_u, to_v = self.walk_cache.edge_spans(source_set, fid, time_limit - arrival, time_limit)
+            else:
+                edges, to_u, to_v = graph.edge_spans(graph.reach(graph.point_seeds(source_set, fid),
+                                                                 (time_limit - arrival) * self.walk_speed))
+            spans.append((edges, to_u + arrival * self.walk_speed, to_v + arrival * self.walk_speed))
+        return merge_edge_spans(spans)
+
+    # Positions in the route patterns of the route stops at each stop, as stop fid -> [position, ...]
+    def stop_positions(self):
+        positions = {}
+        for position, route_stop_fid in enumerate(self.patterns.stop_fids.tolist()):
+            stop_fid = self.stop_index.route_stop_stop_fid(route_stop_fid)
+            if stop_fid is not None:
+                positions.setdefault(stop_fid, []).append(position)
+        return positions
+
+    # Seeds for a single multi-source walk covering everything reachable on foot,
+    #   from the origin seeds and from every stop at its arrival time (in graph distance units)
+    def walking_seeds(self, origin_seeds, stop_arrivals):
+        seeds = list(origin_seeds)
+        for stop_fid, arrival in stop_arrivals.items():
+            seeds.extend((vertex, distance + arrival * self.walk_speed)
+                         for vertex, distance in self.graph.point_seeds(self.stops_set, stop_fid))
+        return seeds
+
+
+
+# Flattens a network's structures (and optionally a GTFS timetable) into one dictionary of arrays,
+#   with names prefixed by the structure they belong to
+def network_arrays(network, timetable=None):
+    components = {'graph': network.graph, 'transfers': network.transfers, 'patterns': network.patterns,
+                  'headways': network.headways, 'stop_index': network.stop_index}
+    if network.block_reach is not None:
+        components['block_reach'] = network.block_reach
+    if network.block_columns is not None:
+        components['block_columns'] = network.block_columns
+    if timetable is not None:
+        components['timetable'] = timetable
+    arrays = {}
+    for prefix, component in components.items():
+        for name, array in component.arrays.items():
+            arrays[f'{prefix}/{name}'] = array
+    return arrays
+
+
+# Rebuilds the network (and timetable, if present) from network_arrays without copying the arrays,
+#   with a walk cache of its own so the searches of a worker process share their walks
+#   Returns (network, timetable or None)
+def network_from_arrays(arrays, walk_speed, stops_set, route_stops_set, materialize=True):
+    components = {}
+    for key, array in arrays.items():
+        prefix, name = key.split('/', 1)
+        components.setdefault(prefix, {})[name] = array
+
+    graph = StreetGraph(components['graph'], materialize)
+    network = TransitNetwork(graph,
+                             TransferTable(components['transfers']),
+                             RoutePatterns(components['patterns']),
+                             HeadwayTable(components['headways']),
+                             StopIndex(components['stop_index']),
+                             walk_speed, stops_set, route_stops_set,
+                             BlockReach(components['block_reach']) if 'block_reach' in components else None,
+                             BlockColumns(components['block_columns']) if 'block_columns' in components else None,
+                             WalkCache(graph, walk_speed))
+    timetable = GtfsTimetable(components['timetable']) if 'timetable' in components else None
+    return network, timetable
@@ -0,0 +1,130 @@
+import argparse
+import csv
+import datetime
+import json
+import os
+import time
+
+import numpy as np
+
+from BatchSearch import batch_results
+from BlockIndex import unreached_minutes
+from GtfsTimetable import load_gtfs_timetable, runs_past_midnight, seconds_after_midnight
+from HeadlessEngine import HeadlessEngine, project_sources
+
+block_id_field = 'GEOID10'
+matrix_file = 'travel_times.npy'
+origins_file = 'origins.csv'
+blocks_file = 'blocks.csv'
+description_file = 'matrix.json'
+
+
+# Origin x census block travel time matrix, written to a directory as:
+#   travel_times.npy    uint16 minutes to each block (see BlockReach.block_minutes), one row per origin
+#                       and one column per block, unreached_minutes where a block is beyond the time limit
+#   origins.csv         row, name, x and y of each origin
+#   blocks.csv          column, fid and id (GEOID10 by default) of each block
+#   matrix.json         the time limit, engine and unreached value the matrix was written with
+#   The matrix is a memory-mapped .npy filled in row by row, so it never has to fit in memory
+class MatrixWriter:
+    def __init__(self, directory, origins, block_fids, block_ids, time_limit, engine, id_field=block_id_field):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.matrix = np.lib.format.open_memmap(os.path.join(directory, matrix_file), mode='w+', dtype=np.uint16,
+                                                shape=(len(origins), len(block_fids)))
+        self.matrix[...] = unreached_minutes
+
+        with open(os.path.join(directory, origins_file), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['row', 'name', 'x', 'y'])
+            writer.writerows((row, name, x, y) for row, (name, x, y) in enumerate(origins))
+        with open(os.path.join(directory, blocks_file), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['column', 'fid', id_field])
+            writer.writerows((column, fid, block_id) for column, (fid, block_id)
+                             in enumerate(zip(block_fids.tolist(), block_ids)))
+        with open(os.path.join(directory, description_file), 'w') as f:
+            json.dump({'time_limit_minutes': time_limit * 60, 'engine': engine, 'unreached': int(unreached_minutes),
+                       'origins': len(origins), 'blocks': len(block_fids)}, f, indent=2)
+
+    def set_row(self, row, minutes):
+        self.matrix[row] = minutes
+
+    def close(self):
+        self.matrix.flush()
+        del self.matrix
+
+
+
+# Yields an OriginResult with block_minutes for every origin (a list of (x, y) in the street graph's crs),
+#   in input order; network must have been built with its block_reach, see batch_results for the other arguments
+def matrix_results(network, points, time_limit, engine, workers=1, max_transfers=None, timetable=None,
+                   departure=None, is_canceled=None, progress=None):
+    return batch_results(network, points, time_limit, engine, workers, max_transfers, timetable, departure,
+                         None, is_canceled, progress, block_times=True)
+
+
+# Writes the travel time matrix of origins, a list of (name, x, y) in the street graph's crs, to a directory
+#   block_ids (such as GEOID10) name the matrix's columns, in the ascending fid order of the network's block_reach
+#   Returns the number of origins written
+def write_travel_time_matrix(directory, network, origins, block_ids, time_limit, engine, workers=1,
+                             max_transfers=None, timetable=None, departure=None, is_canceled=None, progress=None,
+                             id_field=block_id_field):
+    writer = MatrixWriter(directory, origins, network.block_reach.fids, block_ids, time_limit, engine, id_field)
+    written = 0
+    try:
+        for result in matrix_results(network, [(x, y) for _, x, y in origins], time_limit, engine, workers,
+                                     max_transfers, timetable, departure, is_canceled, progress):
+            writer.set_row(result.index, result.block_minutes)
+            written += 1
+    finally:
+        writer.close()
+    return written
+
+
+# Origins from a CSV file with name, x and y columns
+def read_origins(path):
+    with open(path, newline='') as f:
+        return [(row['name'], float(row['x']), float(row['y'])) for row in csv.DictReader(f)]
+
+
+
+# Command line entry point: writes the travel time matrix of the origins in a CSV file
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Origin x census block travel time matrix, without QGIS')
+    parser.add_argument('origins', help='CSV file of origins with name, x and y columns, in the street layer crs')
+    parser.add_argument('output', help='directory to write the matrix and its index files to')
+    parser.add_argument('minutes', type=float, help='time limit in minutes')
+    parser.add_argument('--project', default='.', help='directory holding the project GeoPackages')
+    parser.add_argument('--cache', help='network cache directory (default: network_cache in the project directory)')
+    parser.add_argument('--engine', choices=['raptor', 'timetable'], default='raptor')
+    parser.add_argument('--max-transfers', type=int)
+    parser.add_argument('--gtfs', help='GTFS feed directory or zip (timetable engine)')
+    parser.add_argument('--departure', help='departure as YYYY-MM-DDTHH:MM:SS (timetable engine)')
+    parser.add_argument('--workers', type=int, default=1, help='search worker processes')
+    parser.add_argument('--block-id-field', default=block_id_field, help='census block field naming the columns')
+    args = parser.parse_args(argv)
+
+    timetable = None
+    departure = None
+    if args.engine == 'timetable':
+        if not args.gtfs or not args.departure:
+            parser.error('the timetable engine needs --gtfs and --departure')
+        moment = datetime.datetime.fromisoformat(args.departure)
+        departure = seconds_after_midnight(moment)
+        timetable = load_gtfs_timetable(args.gtfs, moment.date(), runs_past_midnight(departure, args.minutes / 60))
+
+    engine = HeadlessEngine(project_sources(args.project), args.cache or os.path.join(args.project, 'network_cache'))
+    origins = read_origins(args.origins)
+    start_time = time.perf_counter()
+    written = write_travel_time_matrix(args.output, engine.network(blocks=True), origins,
+                                       engine.block_field(args.block_id_field), args.minutes / 60, args.engine,
+                                       args.workers, args.max_transfers, timetable, departure,
+                                       id_field=args.block_id_field)
+    print(f"Wrote {written} origins x {engine.block_reach().column_count()} blocks to {args.output} "
+          f"in {time.perf_counter() - start_time:.1f}s")
+    engine.close()
+
+
+if __name__ == '__main__':
+    main()
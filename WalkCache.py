@@ -0,0 +1,98 @@
+import collections
+
+import numpy as np
+
+walk_cache_memory = 64 * 2**20  # bytes of walks from stops kept in memory
+
+
+# Least recently used cache of the walks from snapped points (stops and route stops) over the street graph
+#   A walk from a point reaches the same points and streets at the same walking times whatever time it starts
+#   at, so each walk is kept as the points of every point set it reached, sorted by walking time from the start
+#   of the walk, and as the edge spans of the streets it covered (see StreetGraph.edge_spans); callers shift
+#   the times by their own start time. A request for a time no larger than the one cached for its point is cut
+#   from the cached walk, so each point keeps the walk of its largest time. A walk asked for again with more
+#   time is extended to twice its time, but never past limit, the time limit of the search asking for it.
+#   memory_limit is in bytes; the least recently used walks are evicted once the cache holds more.
+class WalkCache:
+    def __init__(self, graph, walk_speed, memory_limit=walk_cache_memory):
+        self.graph = graph
+        self.walk_speed = walk_speed
+        self.memory_limit = memory_limit
+        self.walks = collections.OrderedDict()  # (point set, fid) -> (max time, {point set: (fids, times)}, spans)
+        self.memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.extensions = 0
+        self.evictions = 0
+
+    # Points of target_set reachable on foot from point fid of source_set within max_time,
+    #   as (fid, walking time) sorted by time
+    def reachable(self, source_set, fid, target_set, max_time, limit=None):
+        walk = self.lookup((source_set, fid), max_time, limit)
+        fids, times = walk[1].get(target_set, (np.empty(0, dtype=np.int64), np.empty(0)))
+        cut = int(np.searchsorted(times, max_time, side='right'))
+        return list(zip(fids[:cut].tolist(), times[:cut].tolist()))
+
+    # Edge spans (edges, distance to edge_u, distance to edge_v) of the streets within max_time of point fid
+    #   of source_set, in street graph units; see StreetGraph.covered_edges for the parts covered
+    def edge_spans(self, source_set, fid, max_time, limit=None):
+        edges, to_u, to_v = self.lookup((source_set, fid), max_time, limit)[2]
+        cut = int(np.searchsorted(np.minimum(to_u, to_v), max_time * self.walk_speed, side='right'))
+        return edges[:cut], to_u[:cut], to_v[:cut]
+
+    # The cached walk from a point covering at least max_time, walking it on a miss
+    def lookup(self, key, max_time, limit=None):
+        walk = self.walks.get(key)
+        if walk is not None and walk[0] >= max_time:
+            self.hits += 1
+            self.walks.move_to_end(key)
+            return walk
+        if walk is None:
+            self.misses += 1
+            return self.walk(key, max_time)
+        # Walks asked for again with more time usually keep growing, so they are extended by at least double,
+        #   up to the time limit of the search
+        self.extensions += 1
+        extended = max(max_time, 2 * walk[0])
+        return self.walk(key, extended if limit is None else max(max_time, min(extended, limit)))
+
+    # Walks the street graph from a point, replacing any shorter walk cached for it
+    def walk(self, key, max_time):
+        source_set, fid = key
+        distances = self.graph.reach(self.graph.point_seeds(source_set, fid), max_time * self.walk_speed)
+        reached = {}
+        for name in self.graph.point_set_names():
+            points = self.graph.reached_points(name, distances)
+            reached[name] = (np.array([point for point, _ in points], dtype=np.int64),
+                             np.array([distance for _, distance in points], dtype=np.float64) / self.walk_speed)
+
+        if key in self.walks:
+            self.memory_bytes -= _walk_bytes(self.walks.pop(key))
+        # Spans sorted by their nearer end, so shorter walks are cut from the front
+        edges, to_u, to_v = self.graph.edge_spans(distances)
+        order = np.argsort(np.minimum(to_u, to_v), kind='stable')
+        walk = (max_time, reached, (edges[order], to_u[order], to_v[order]))
+        self.walks[key] = walk
+        self.memory_bytes += _walk_bytes(walk)
+        while self.memory_bytes > self.memory_limit and len(self.walks) > 1:
+            _, evicted = self.walks.popitem(last=False)
+            self.memory_bytes -= _walk_bytes(evicted)
+            self.evictions += 1
+        return walk
+
+    def hit_rate(self):
+        requests = self.hits + self.misses + self.extensions
+        return self.hits / requests if requests else 0.0
+
+    def counters(self):
+        return {'walk_cache_hits': self.hits, 'walk_cache_misses': self.misses,
+                'walk_cache_extensions': self.extensions, 'walk_cache_evictions': self.evictions}
+
+    def summary(self):
+        return (f"Walk cache: {self.hits} hits, {self.misses} misses, {self.extensions} extended, "
+                f"{self.evictions} evicted ({self.hit_rate():.0%} hit rate, {len(self.walks)} walks, "
+                f"{self.memory_bytes / 2**20:.1f} MB)")
+
+
+def _walk_bytes(walk):
+    return sum(fids.nbytes + times.nbytes for fids, times in walk[1].values()) + sum(a.nbytes for a in walk[2])
@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Benchmark import city_engine, city_origins, write_synthetic_city
+
+# Small synthetic city shared by the tests: (streets along each side of the grid, transit lines along each axis)
+city_streets = 24
+city_lines = 2
+
+
+@pytest.fixture(scope='session')
+def city(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp('city'))
+    write_synthetic_city(directory, city_streets, city_lines)
+    return directory
+
+
+@pytest.fixture(scope='session')
+def engine(city):
+    engine = city_engine(city)
+    yield engine
+    engine.close()
+
+
+@pytest.fixture(scope='session')
+def network(engine):
+    return engine.network()
+
+
+@pytest.fixture(scope='session')
+def origins():
+    return city_origins(city_streets, 8)
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from BatchSearch import parse_time_bands, run_batch, search_origin
+
+time_limit = 0.25
+
+
+def assert_same_result(result, expected):
+    assert result.index == expected.index
+    assert result.stop_arrivals == pytest.approx(expected.stop_arrivals)
+    assert result.boardings == pytest.approx(expected.boardings)
+    assert len(result.reached_edges) == len(expected.reached_edges)
+    for arrays, expected_arrays in zip(result.reached_edges, expected.reached_edges):
+        for array, expected_array in zip(arrays, expected_arrays):
+            assert np.allclose(array, expected_array)
+
+
+def test_results_come_back_in_input_order(network, origins):
+    progress = []
+    results = list(run_batch(network, origins, time_limit, 'raptor', 2, bands=[0.1, time_limit],
+                             progress=progress.append))
+    assert [result.index for result in results] == list(range(len(origins)))
+    assert progress == pytest.approx([(i + 1) / len(origins) for i in range(len(origins))])
+    for result, (x, y) in zip(results, origins):
+        expected = search_origin(network, result.index, network.graph.snap(x, y), time_limit, 'raptor',
+                                 bands=[0.1, time_limit])
+        assert_same_result(result, expected)
+
+
+def test_cancel_stops_after_the_current_result(network, origins):
+    results = []
+
+    def is_canceled():
+        return len(results) == 2
+
+    for result in run_batch(network, origins, time_limit, 'raptor', 2, is_canceled=is_canceled):
+        results.append(result)
+    assert [result.index for result in results] == [0, 1]
+
+
+def test_parse_time_bands():
+    assert parse_time_bands('', 30) is None
+    assert parse_time_bands(' 30 ', 30) is None
+    assert parse_time_bands('10, 20', 30) == pytest.approx([10 / 60, 20 / 60, 0.5])
+    assert parse_time_bands('15,45,', 30) == pytest.approx([0.25, 0.5, 0.75])
+    assert parse_time_bands('30,45', 30) == pytest.approx([0.5, 0.75])
+
+
+@pytest.mark.parametrize('bands_text', ['ten', '10;20', '0', '-5', 'nan', 'inf', '20,10', '10,10'])
+def test_parse_time_bands_rejects_malformed_or_unsorted_bands(bands_text):
+    with pytest.raises(ValueError):
+        parse_time_bands(bands_text, 30)
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from BlockIndex import edge_coordinates, near_spans, ring_segments
+
+samples = 2001  # points tested along each segment
+
+
+# Distance from each point to polygons given by their boundary segments, 0 inside them (even-odd rule)
+def polygon_distance(px, py, rings):
+    rx1, ry1, rx2, ry2 = (r[None, :] for r in rings)
+    px = px[:, None]
+    py = py[:, None]
+    dx = rx2 - rx1
+    dy = ry2 - ry1
+    t = np.clip(((px - rx1) * dx + (py - ry1) * dy) / np.maximum(dx * dx + dy * dy, 1e-12), 0, 1)
+    distance = np.hypot(rx1 + t * dx - px, ry1 + t * dy - py).min(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crossings = ((ry1 > py) != (ry2 > py)) & (px < dx * (py - ry1) / dy + rx1)
+    return np.where(crossings.sum(axis=1) % 2 == 1, 0.0, distance)
+
+
+# Distance to the polygons of evenly spaced points along a segment, with their positions as fractions
+def distances_along(x1, y1, x2, y2, rings):
+    t = np.linspace(0, 1, samples)
+    return t, polygon_distance(x1 + t * (x2 - x1), y1 + t * (y2 - y1), rings)
+
+
+# An L shaped block with a courtyard
+l_shape = [[[(0.0, 0.0), (300.0, 0.0), (300.0, 100.0), (100.0, 100.0), (100.0, 300.0), (0.0, 300.0), (0.0, 0.0)],
+            [(20.0, 20.0), (20.0, 60.0), (60.0, 60.0), (60.0, 20.0), (20.0, 20.0)]]]
+
+
+@pytest.mark.parametrize('distance', [0.0, 10.0, 45.0])
+def test_near_spans_match_points_tested_along_each_segment(distance):
+    rng = np.random.default_rng(3)
+    x1, y1, x2, y2 = (rng.uniform(-100, 400, 300) for _ in range(4))
+    rings = ring_segments(l_shape)
+    starts, ends = near_spans(x1, y1, x2, y2, rings, distance)
+    tolerance = 1e-6 * 500
+    near_count = 0
+    for i in range(len(x1)):
+        t, gap = distances_along(x1[i], y1[i], x2[i], y2[i], rings)
+        near = gap <= distance
+        if starts[i] > ends[i]:
+            assert not near.any()
+            continue
+        near_count += 1
+        # Nothing outside the span is near, and the span starts and ends at points that are
+        assert not near[(t < starts[i] - 1e-9) | (t > ends[i] + 1e-9)].any()
+        for end in (starts[i], ends[i]):
+            point = (np.array([x1[i] + end * (x2[i] - x1[i])]), np.array([y1[i] + end * (y2[i] - y1[i])]))
+            assert polygon_distance(*point, rings)[0] <= distance + tolerance
+    assert 0 < near_count < len(x1)
+
+
+def test_block_index_matches_points_tested_along_every_edge(engine):
+    graph = engine.street_graph()
+    index = engine.block_index()
+    edges = np.arange(graph.edge_count())
+    x1, y1, x2, y2 = edge_coordinates(graph, edges)
+    t = np.linspace(0, 1, 201)
+    px = (x1[:, None] + t * (x2 - x1)[:, None]).ravel()
+    py = (y1[:, None] + t * (y2 - y1)[:, None]).ravel()
+    spacing = float(np.max(np.asarray(graph.edge_length))) / (len(t) - 1)
+
+    polygons = dict(engine.block_polygons())
+    rng = np.random.default_rng(0)
+    checked = 0
+    for fid in rng.choice(sorted(polygons), 30, replace=False).tolist():
+        rings = ring_segments(polygons[fid])
+        # Points beyond the block's bounding box widened by the index distance are never near it
+        margin = index.distance + spacing
+        xs = np.concatenate((rings[0], rings[2]))
+        ys = np.concatenate((rings[1], rings[3]))
+        close = ((px >= xs.min() - margin) & (px <= xs.max() + margin)
+                 & (py >= ys.min() - margin) & (py <= ys.max() + margin))
+        gap = np.full(len(px), np.inf)
+        gap[close] = polygon_distance(px[close], py[close], rings)
+        gap = gap.reshape(len(edges), len(t)).min(axis=1)
+        indexed = np.array([fid in index.blocks_near(edge) for edge in edges.tolist()])
+        # Points between two samples are at most half the spacing closer than the nearer sample
+        assert indexed[gap <= index.distance].all()
+        assert not indexed[gap > index.distance + spacing / 2].any()
+        checked += int(indexed.sum())
+    assert checked > 0
+
+
+def test_blocks_near_edges_is_the_union_of_their_rows(engine):
+    index = engine.block_index()
+    rng = np.random.default_rng(1)
+    for count in (0, 1, 25, 200):
+        edges = rng.choice(engine.street_graph().edge_count(), count, replace=False)
+        expected = sorted({fid for edge in edges.tolist() for fid in index.blocks_near(edge)})
+        assert index.blocks_near_edges(edges).tolist() == expected
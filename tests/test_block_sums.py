@@ -0,0 +1,43 @@
+import csv
+
+import numpy as np
+import pytest
+
+from BlockColumns import build_block_columns
+from DemographicSums import write_block_sums
+
+
+def test_sums_within_is_a_manual_sum():
+    rng = np.random.default_rng(4)
+    rows = [(fid, {'POP10': int(rng.integers(0, 100)), 'HU10': None if fid % 7 == 0 else float(rng.uniform(0, 40))})
+            for fid in rng.permutation(50).tolist()]
+    columns = build_block_columns(rows, ['POP10', 'HU10'])
+    assert columns.fids.tolist() == list(range(50))
+    distances = np.where(rng.random(50) < 0.2, np.inf, rng.uniform(0, 1000, 50))
+    limits = [0, 250, 600, 1000]
+    sums, counts = columns.sums_within(distances, limits)
+    values = dict(rows)
+    for limit, limit_sums, count in zip(limits, sums.tolist(), counts.tolist()):
+        reached = [fid for fid in range(50) if distances[fid] <= limit]
+        assert count == len(reached)
+        assert limit_sums == pytest.approx([sum(values[fid]['POP10'] for fid in reached),
+                                            sum(values[fid]['HU10'] or 0 for fid in reached)])
+
+
+def test_written_sums_match_the_blocks_each_origin_reaches(engine, origins, tmp_path):
+    path = str(tmp_path / 'sums.csv')
+    network = engine.network(block_fields=['POP10'])
+    bands = [0.1, 0.25]
+    named = [(f"origin {row}", x, y) for row, (x, y) in enumerate(origins)]
+    assert write_block_sums(path, network, named, bands, 'raptor') == len(origins)
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+
+    population = {fid: f['POP10'] for fid, _, f in engine.features(engine.sources.blocks, ['POP10'], geometry=False)}
+    expected = []
+    for name, x, y in named:
+        for band, blocks in engine.search(x, y, bands[-1], bands=bands, network=network)[1]:
+            expected.append({'origin': name, 'minutes': str(band * 60), 'blocks': str(len(blocks)),
+                             'POP10': str(sum(population[fid] for fid in blocks))})
+    assert rows == expected
+    assert any(row['POP10'] != '0' for row in rows)
@@ -0,0 +1,69 @@
+import struct
+
+import pytest
+
+from GeoPackage import (GeoPackage, GeoPackageWriter, decode_wkb, encode_wkb, geometry_wkb, wkb_multipolygon,
+                        wkb_polygons)
+
+square = [(0.0, 0.0), (10.0, 0.0), (10.0, 10.0), (0.0, 10.0), (0.0, 0.0)]
+hole = [(2.0, 2.0), (4.0, 2.0), (4.0, 4.0), (2.0, 2.0)]
+far_square = [(x + 100.0, y - 50.5) for x, y in square]
+
+geometries = [
+    ('Point', (1.5, -2.25)),
+    ('LineString', [(0.0, 0.0), (1.0, 2.0), (3.5, 2.0)]),
+    ('Polygon', [square, hole]),
+    ('MultiPoint', [(0.0, 0.0), (7.0, 8.0)]),
+    ('MultiLineString', [[(0.0, 0.0), (1.0, 1.0)], [(5.0, 5.0), (6.0, 5.0), (6.0, 7.0)]]),
+    ('MultiPolygon', [[square, hole], [far_square]]),
+]
+
+
+@pytest.mark.parametrize('geometry', geometries, ids=[kind for kind, _ in geometries])
+def test_wkb_round_trip(geometry):
+    assert decode_wkb(encode_wkb(geometry)) == geometry
+
+
+def test_decode_drops_z_and_reads_big_endian():
+    # Big-endian ISO LineString Z
+    wkb = struct.pack('>BII', 0, 1002, 2) + struct.pack('>6d', 1.0, 2.0, 3.0, 4.0, 5.0, 6.0)
+    assert decode_wkb(wkb) == ('LineString', [(1.0, 2.0), (4.0, 5.0)])
+
+
+def test_wkb_polygons_splits_without_decoding():
+    multipolygon = ('MultiPolygon', [[square, hole], [far_square]])
+    parts = wkb_polygons(encode_wkb(multipolygon))
+    assert parts == [encode_wkb(('Polygon', rings)) for rings in multipolygon[1]]
+    assert wkb_multipolygon(parts) == encode_wkb(multipolygon)
+
+    polygon = encode_wkb(('Polygon', [square]))
+    assert wkb_polygons(polygon) == [polygon]
+    assert wkb_polygons(encode_wkb(('LineString', square))) is None
+
+
+def test_layer_round_trip(tmp_path):
+    path = str(tmp_path / 'round_trip.gpkg')
+    writer = GeoPackageWriter(path, 2913)
+    writer.create_layer('areas', 'MULTIPOLYGON', [('name', 'TEXT'), ('minutes', 'REAL')])
+    rows = [(None, geometries[5], 'a', 15.0), (None, ('MultiPolygon', [[far_square]]), 'b', 30.0),
+            (None, None, 'c', 45.0)]
+    writer.add_features('areas', rows)
+    writer.close()
+
+    package = GeoPackage(path)
+    try:
+        assert package.authid('areas') == 'EPSG:2913'
+        features = list(package.features('areas', ['name', 'minutes']))
+        assert [(geometry, f['name'], f['minutes']) for _, geometry, f in features] == \
+               [(geometry, name, minutes) for _, geometry, name, minutes in rows]
+        fids = [fid for fid, _, _ in features]
+        assert [wkb for _, wkb, _ in package.features('areas', wkb=True, fids=fids[:2])] == \
+               [encode_wkb(geometry) for _, geometry, _, _ in rows[:2]]
+    finally:
+        package.close()
+
+
+def test_invalid_envelope_code_is_rejected():
+    blob = b'GP' + bytes([0, 0x01 | (5 << 1)]) + struct.pack('<i', 2913) + encode_wkb(geometries[0])
+    with pytest.raises(ValueError, match='envelope'):
+        geometry_wkb(blob)
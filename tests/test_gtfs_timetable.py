@@ -0,0 +1,52 @@
+import datetime
+
+from GtfsTimetable import load_gtfs_timetable, runs_past_midnight
+
+weekday_service = 'WK,1,1,1,1,1,0,0,20260101,20261231'
+saturday_service = 'SA,0,0,0,0,0,1,0,20260101,20261231'
+
+
+def write_feed(directory):
+    files = {
+        'calendar.txt': ['service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date',
+                         weekday_service, saturday_service],
+        'trips.txt': ['route_id,service_id,trip_id,direction_id', '1,WK,late,0', '2,SA,morning,1'],
+        'stop_times.txt': ['trip_id,arrival_time,departure_time,stop_id,stop_sequence',
+                           'late,23:50:00,23:50:00,10,1', 'late,24:10:00,24:10:00,11,2', 'late,24:30:00,24:30:00,12,3',
+                           'morning,08:00:00,08:00:00,10,1', 'morning,08:10:00,08:10:00,12,2'],
+    }
+    for name, lines in files.items():
+        (directory / name).write_text('\n'.join(lines) + '\n')
+    return str(directory)
+
+
+def connections(timetable):
+    return list(zip(timetable.dep_time.tolist(), timetable.arr_time.tolist(),
+                    timetable.arrays['trip_route'][timetable.trip].tolist()))
+
+
+def test_previous_day_trips_after_midnight(tmp_path):
+    feed = write_feed(tmp_path)
+    # Saturday: Friday's late trip still runs from 00:10, and the 23:50 departure of the Friday is dropped
+    assert connections(load_gtfs_timetable(feed, datetime.date(2026, 10, 17))) == [(600, 1800, 1), (28800, 29400, 2)]
+    # Friday: Thursday's late trip after midnight, then Friday's own
+    assert connections(load_gtfs_timetable(feed, datetime.date(2026, 10, 16))) == \
+           [(600, 1800, 1), (85800, 87000, 1), (87000, 88200, 1)]
+    # Sunday: no service, and Saturday has no trips past midnight
+    assert connections(load_gtfs_timetable(feed, datetime.date(2026, 10, 18))) == []
+
+
+def test_next_day_trips_for_searches_past_midnight(tmp_path):
+    feed = write_feed(tmp_path)
+    friday = datetime.date(2026, 10, 16)
+    # Friday evening: Saturday's morning trip follows Friday's own, a day later
+    assert connections(load_gtfs_timetable(feed, friday, next_day=True)) == \
+           [(600, 1800, 1), (85800, 87000, 1), (87000, 88200, 1), (115200, 115800, 2)]
+    # Saturday: Sunday has no service
+    saturday = datetime.date(2026, 10, 17)
+    assert connections(load_gtfs_timetable(feed, saturday, next_day=True)) == \
+           connections(load_gtfs_timetable(feed, saturday))
+
+    assert runs_past_midnight(23 * 3600 + 30 * 60, 0.75)
+    assert not runs_past_midnight(23 * 3600, 1)
+    assert not runs_past_midnight(8 * 3600, 2)
@@ -0,0 +1,85 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from Benchmark import city_engine
+from IsochroneService import IsochroneService, percentiles
+
+
+@pytest.fixture
+def service(city):
+    service = IsochroneService(city_engine(city), workers=0)
+    yield service
+    service.close()
+
+
+def test_identical_requests_share_one_search(service, origins):
+    x, y = origins[0]
+    fields = {'x': x, 'y': y, 'minutes': 15, 'bands': '5,10'}
+    band_blocks = service.engine.band_blocks
+    lookups = []
+    looking_up = threading.Event()
+    release = threading.Event()
+
+    # Holds the block lookup of the first search until the second request has arrived
+    def held_band_blocks(bands, result):
+        lookups.append(bands)
+        looking_up.set()
+        release.wait()
+        return band_blocks(bands, result)
+    service.engine.band_blocks = held_band_blocks
+
+    async def run():
+        first = asyncio.ensure_future(service.isochrone(fields))
+        await asyncio.get_running_loop().run_in_executor(None, looking_up.wait)
+        second = asyncio.ensure_future(service.isochrone(dict(fields, x=x + 0.5)))
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(first, second)
+
+    first, second = asyncio.run(run())
+    assert len(lookups) == 1
+    assert (first['coalesced'], second['coalesced']) == (False, True)
+    assert first['bands'] == second['bands'] and len(first['bands']) == 3
+    assert service.coalesced == 1 and not service.running and service.queued == 0
+
+
+async def request(port, target):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(body)
+
+
+def test_stats_report_latency_percentiles(service, origins):
+    async def run():
+        server = await service.serve(0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            for x, y in origins[:3]:
+                status, _ = await request(port, f"/isochrone?x={x}&y={y}&minutes=10")
+                assert status == 200
+            assert (await request(port, '/isochrone?x=abc&y=0&minutes=10'))[0] == 400
+            return await request(port, '/stats')
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    status, stats = asyncio.run(run())
+    assert status == 200
+    assert stats['requests'] == 4 and stats['queue_depth'] == 0 and stats['running_searches'] == 0
+    for name in ('latency_seconds', 'search_latency_seconds'):
+        latency = stats[name]
+        assert latency['count'] == 3
+        assert 0 < latency['p50'] <= latency['p90'] <= latency['p99']
+
+
+def test_percentiles():
+    assert percentiles([]) == {'count': 0, 'p50': None, 'p90': None, 'p99': None}
+    assert percentiles([0.3, 0.1, 0.2]) == {'count': 3, 'p50': 0.2, 'p90': 0.3, 'p99': 0.3}
+    assert percentiles(range(100)) == {'count': 100, 'p50': 50, 'p90': 90, 'p99': 99}
@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+
+from GeoPackage import GeoPackage, GeoPackageWriter
+from NetworkCache import ChecksumStore, load_cached_arrays, save_cached_arrays
+
+point = ('Point', (1.0, 2.0))
+
+
+def write_layer(path, layer, count):
+    writer = GeoPackageWriter(path, 2913)
+    writer.create_layer(layer, 'POINT', [('value', 'INTEGER')])
+    writer.add_features(layer, [(None, point, value) for value in range(count)])
+    writer.close()
+
+
+def checksum(store, path, layer):
+    computed = []
+
+    def compute():
+        computed.append(layer)
+        package = GeoPackage(path)
+        try:
+            return package.layer_checksum(layer)
+        finally:
+            package.close()
+
+    return store.checksum(path, layer, compute), bool(computed)
+
+
+def test_layer_checksums_follow_their_own_layer(tmp_path):
+    path = str(tmp_path / 'layers.gpkg')
+    write_layer(path, 'streets', 3)
+    write_layer(path, 'stops', 2)
+    store = ChecksumStore(str(tmp_path / 'checksums.json'))
+    streets, computed = checksum(store, path, 'streets')
+    stops, _ = checksum(store, path, 'stops')
+    assert computed and streets != stops
+
+    # An unchanged file is never read again, even by a new store
+    store.save()
+    assert checksum(ChecksumStore(str(tmp_path / 'checksums.json')), path, 'streets') == (streets, False)
+
+    # Editing one layer leaves the other's checksum as it was
+    write_layer(path, 'stops', 5)
+    os.utime(path, ns=(0, 0))
+    assert checksum(store, path, 'streets') == (streets, True)
+    assert checksum(store, path, 'stops')[0] != stops
+
+
+def test_cached_arrays_round_trip(tmp_path):
+    directory = str(tmp_path / 'structure_0123')
+    arrays = {'a/b': np.arange(5), 'c': np.linspace(0, 1, 3)}
+    save_cached_arrays(directory, 'key', arrays, 'structure')
+    loaded = load_cached_arrays(directory, 'key')
+    assert loaded.keys() == arrays.keys()
+    for name, array in arrays.items():
+        assert np.array_equal(loaded[name], array)
+    assert load_cached_arrays(directory, 'other key') is None
+
+
+def test_prune_keeps_names_sharing_a_prefix(tmp_path):
+    def save(name, key):
+        directory = str(tmp_path / f"{name}_{key[:16]}")
+        save_cached_arrays(directory, key, {'values': np.arange(3)}, name)
+        return directory
+
+    narrow = save('block_columns_POP10', 'a' * 40)
+    wide = save('block_columns_POP10_HU10', 'b' * 40)
+    assert load_cached_arrays(narrow, 'a' * 40) is not None
+    assert load_cached_arrays(wide, 'b' * 40) is not None
+
+    # A newer build of the same name replaces only its own older directory
+    newer = save('block_columns_POP10', 'c' * 40)
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(d) for d in (newer, wide))
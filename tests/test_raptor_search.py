@@ -0,0 +1,87 @@
+import heapq
+
+import pytest
+
+from RaptorSearch import RaptorSearch
+
+time_limit = 0.25
+
+
+# Stop arrivals of a plain Dijkstra search over boardings, rides and stops, with the wait model of
+#   ServiceAreaSearch.Search: no wait boarding from the origin, half the route's headway after a transfer
+def reference_arrivals(network, seeds, time_limit):
+    patterns = network.patterns
+    stop_index = network.stop_index
+    queue = []
+    distances = network.graph.reach(seeds, time_limit * network.walk_speed)
+    for fid, distance in network.graph.reached_points(network.route_stops_set, distances):
+        position = patterns.position(fid)
+        if position is not None and distance / network.walk_speed < time_limit:
+            heapq.heappush(queue, (distance / network.walk_speed, 'board', position))
+
+    done = set()
+    arrivals = {}
+    while queue:
+        time, kind, node = heapq.heappop(queue)
+        if (kind, node) in done:
+            continue
+        done.add((kind, node))
+        if kind == 'board':
+            pattern = patterns.pattern_of_position(node)
+            end = int(patterns.stop_offsets[pattern + 1])
+            for position in range(node + 1, end):
+                arrival = time + float(patterns.stop_times[position] - patterns.stop_times[node])
+                if arrival <= time_limit:
+                    heapq.heappush(queue, (arrival, 'ride', position))
+        elif kind == 'ride':
+            stop_fid = stop_index.route_stop_stop_fid(int(patterns.stop_fids[node]))
+            if stop_fid is not None:
+                heapq.heappush(queue, (time, 'stop', stop_fid))
+        else:
+            arrivals[node] = time
+            for fid, cost in network.walk_from_stop(node, network.route_stops_set, time_limit - time):
+                wait = network.headways.expected_wait(*stop_index.rte_dir(fid))
+                position = patterns.position(fid)
+                if wait is not None and position is not None and time + cost + wait < time_limit:
+                    heapq.heappush(queue, (time + cost + wait, 'board', position))
+    return arrivals
+
+
+def test_matches_reference_search(network, origins):
+    reached = 0
+    for x, y in origins:
+        search = RaptorSearch(network, time_limit)
+        search.run(x, y)
+        expected = reference_arrivals(network, network.graph.snap(x, y), time_limit)
+        assert search.stop_arrivals.keys() == expected.keys()
+        for stop_fid, arrival in expected.items():
+            assert search.stop_arrivals[stop_fid] == pytest.approx(arrival)
+        reached += len(expected)
+    assert reached > 0
+
+
+def test_max_transfers_only_removes_journeys(network, origins):
+    for x, y in origins:
+        unlimited = RaptorSearch(network, time_limit)
+        unlimited.run(x, y)
+        direct = RaptorSearch(network, time_limit, max_transfers=0)
+        direct.run(x, y)
+        assert direct.rounds <= 1
+        for stop_fid, arrival in direct.stop_arrivals.items():
+            assert arrival >= unlimited.stop_arrivals[stop_fid] - 1e-9
+
+        # Without transfers only the route stops walked to from the origin are boarded
+        distances = network.graph.reach(network.graph.snap(x, y), time_limit * network.walk_speed)
+        walked = {fid: distance / network.walk_speed
+                  for fid, distance in network.graph.reached_points(network.route_stops_set, distances)
+                  if network.patterns.position(fid) is not None and distance / network.walk_speed < time_limit}
+        assert direct.boardings() == pytest.approx(walked)
+        assert direct.counters()['transfer_walks'] == 0
+
+        one_transfer = RaptorSearch(network, time_limit, max_transfers=1)
+        one_transfer.run(x, y)
+        assert one_transfer.rounds <= 2
+        assert set(direct.boardings()) <= set(one_transfer.boardings()) <= set(unlimited.boardings())
+        for fid, departure in one_transfer.boardings().items():
+            assert departure >= unlimited.boardings()[fid] - 1e-9
+
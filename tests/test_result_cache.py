@@ -0,0 +1,52 @@
+import pytest
+
+from RaptorSearch import RaptorSearch
+from ResultCache import ResultCache, build_search_record
+
+time_limit = 0.3
+smaller_limits = (0.05, 0.1, 0.2)
+
+
+# The record ServiceAreaSearch.RoundBasedSearch keeps for a search from a point
+def search_record(network, x, y, time_limit):
+    search = RaptorSearch(network, time_limit)
+    search.run(x, y)
+    distances = network.graph.reach(search.walking_seeds(), time_limit * network.walk_speed)
+    return build_search_record(time_limit, search.stop_arrivals, search.boardings(), search.ride_arrivals(),
+                               distances, search.counters())
+
+
+def assert_same_labels(record, expected):
+    for name in ('stop_arrivals', 'boardings', 'ride_arrivals', 'distances'):
+        labels = getattr(record, name)()
+        expected_labels = getattr(expected, name)()
+        assert labels.keys() == expected_labels.keys(), name
+        for key, value in expected_labels.items():
+            assert labels[key] == pytest.approx(value), name
+
+
+@pytest.mark.parametrize('smaller_limit', smaller_limits)
+def test_within_matches_direct_search(network, origins, smaller_limit):
+    for x, y in origins:
+        record = search_record(network, x, y, time_limit).within(smaller_limit, network.walk_speed)
+        assert record.time_limit == smaller_limit
+        assert_same_labels(record, search_record(network, x, y, smaller_limit))
+
+
+def test_within_larger_limit_is_unchanged(network, origins):
+    record = search_record(network, *origins[0], time_limit)
+    assert record.within(time_limit, network.walk_speed) is record
+    assert record.within(time_limit * 2, network.walk_speed) is record
+
+
+def test_cache_answers_smaller_limits_only(network, origins, tmp_path):
+    cache = ResultCache(2**20, 2**20, str(tmp_path))
+    record = search_record(network, *origins[0], time_limit)
+    cache.put(('origin', 0), record)
+    assert cache.get(('origin', 0), smaller_limits[0]) is record
+    assert cache.get(('origin', 0), time_limit * 2) is None
+
+    # A new session finds the record on disk
+    reopened = ResultCache(2**20, 2**20, str(tmp_path))
+    assert_same_labels(reopened.get(('origin', 0), time_limit), record)
+    assert (reopened.hits, reopened.misses) == (1, 0)
@@ -0,0 +1,35 @@
+import pytest
+
+from GeoPackage import GeoPackage, decode_wkb
+
+fids = [1, 2, 30]
+
+
+def read_layer(path, layer):
+    package = GeoPackage(path)
+    try:
+        names = [name for name, _ in package.fields(layer)]
+        return names, list(package.features(layer, names))
+    finally:
+        package.close()
+
+
+@pytest.mark.parametrize('simplify, quantize', [(0, 0), (1, 0.5)])
+def test_one_row_per_block_with_its_fields(engine, tmp_path, simplify, quantize):
+    path = str(tmp_path / 'areas.gpkg')
+    writer = engine.result_writer(path, 'areas', simplify, quantize)
+    writer.add('a', 15.0, engine.block_wkb(fids))
+    writer.add('b', 30.0, engine.block_wkb(fids[:1]))
+    writer.close()
+    assert (writer.areas, writer.written) == (2, 4)
+
+    blocks = {fid: (decode_wkb(wkb), values) for fid, wkb, values in engine.block_wkb(fids)}
+    names, rows = read_layer(path, 'areas')
+    assert names == ['origin', 'minutes'] + [name for name, _ in engine.block_layer_fields()]
+    expected = [('a', 15.0, fid) for fid in fids] + [('b', 30.0, fids[0])]
+    for (_, geometry, values), (origin, minutes, fid) in zip(rows, expected):
+        block_geometry, block_values = blocks[fid]
+        assert values == {'origin': origin, 'minutes': minutes, **block_values}
+        assert geometry[0] == 'MultiPolygon'
+        if not simplify and not quantize:
+            assert geometry == block_geometry
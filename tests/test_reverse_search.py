@@ -0,0 +1,52 @@
+import math
+
+import pytest
+
+from RaptorSearch import RaptorSearch, ReverseRaptorSearch
+
+time_limit = 0.25
+
+
+# Hours from a search's walking distances to a point snapped to the street graph
+def time_at(network, distances, seeds):
+    return min((distances.get(vertex, math.inf) + distance for vertex, distance in seeds),
+               default=math.inf) / network.walk_speed
+
+
+def walking_distances(network, search):
+    return network.graph.reach(search.walking_seeds(), time_limit * network.walk_speed)
+
+
+@pytest.mark.parametrize('max_transfers', [None, 0, 1])
+def test_matches_forward_searches(network, origins, max_transfers):
+    graph = network.graph
+    compared = 0
+    for destination in origins[:3]:
+        reverse = ReverseRaptorSearch(network, time_limit, max_transfers)
+        reverse.run(*destination)
+        reverse_distances = walking_distances(network, reverse)
+        for origin in origins[3:]:
+            forward = RaptorSearch(network, time_limit, max_transfers)
+            forward.run(*origin)
+            forward_time = time_at(network, walking_distances(network, forward), graph.snap(*destination))
+            reverse_time = time_at(network, reverse_distances, graph.snap(*origin))
+            if forward_time == math.inf:
+                assert reverse_time == math.inf
+            else:
+                assert reverse_time == pytest.approx(forward_time)
+                compared += 1
+    assert compared > 0
+
+
+def test_many_destinations_is_nearest_destination(network, origins):
+    destinations = origins[:3]
+    reverse = ReverseRaptorSearch(network, time_limit)
+    reverse.run_many(destinations)
+    combined = walking_distances(network, reverse)
+    singles = []
+    for destination in destinations:
+        single = ReverseRaptorSearch(network, time_limit)
+        single.run(*destination)
+        singles.append(walking_distances(network, single))
+    for vertex in set(combined).union(*singles):
+        assert combined.get(vertex, math.inf) == pytest.approx(min(s.get(vertex, math.inf) for s in singles))
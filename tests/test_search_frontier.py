@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+from SearchFrontier import SearchFrontier
+
+
+class Node:
+    def __init__(self, dictionary, id, time):
+        self.dictionary = dictionary
+        self.id = id
+        self.time = time
+
+
+# Pushes improving times for random ids of two dictionaries, popping now and then as a search does,
+#   and returns the nodes popped as (dictionary index, id, time)
+def run(frontier, seed, pushes=2000, ids=200):
+    rng = random.Random(seed)
+    dictionaries = ({}, {})
+    popped = []
+    superseded = 0
+
+    def pop():
+        node = frontier.pop()
+        if node is not None:
+            popped.append((dictionaries.index(node.dictionary), node.id, node.time))
+
+    for _ in range(pushes):
+        dictionary = rng.choice(dictionaries)
+        id = rng.randrange(ids)
+        time = rng.randint(0, 500) / 10   # coarse, so equal times test the first in first out ties
+        if time < dictionary.get(id, float('inf')):
+            if id in dictionary:
+                superseded += 1
+            dictionary[id] = time
+            frontier.push(Node(dictionary, id, time))
+        if rng.random() < 0.3:
+            pop()
+    while frontier:
+        pop()
+    return popped, superseded
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_decrease_key_pops_in_the_same_order_as_lazy_deletion(seed):
+    lazy = SearchFrontier()
+    lazy_popped, superseded = run(lazy, seed)
+    indexed = SearchFrontier(use_decrease_key=True)
+    indexed_popped, _ = run(indexed, seed)
+    assert indexed_popped == lazy_popped
+
+    # Every node still queued when superseded is popped stale by lazy deletion and never queued by decrease-key
+    assert indexed.stale_pops == 0
+    assert lazy.pops == lazy.pushes and lazy.pops - lazy.stale_pops == len(lazy_popped)
+    assert 0 < lazy.stale_pops <= superseded
+    assert indexed.pops == len(indexed_popped) < indexed.pushes == lazy.pushes
+    assert not indexed.positions
+
+
+def test_pops_earliest_first_in_first_out():
+    frontier = SearchFrontier(use_decrease_key=True)
+    times = {}
+    for id, time in [('a', 3), ('b', 1), ('c', 3), ('d', 2)]:
+        times[id] = time
+        frontier.push(Node(times, id, time))
+    times['c'] = 0.5
+    frontier.push(Node(times, 'c', 0.5))
+    times['b'] = 0.5   # pushed later than c at the same time
+    frontier.push(Node(times, 'b', 0.5))
+    assert [node.id for node in frontier.smallest(2)] == ['c', 'b']
+    assert [frontier.pop().id for _ in range(4)] == ['c', 'b', 'd', 'a']
+    assert frontier.pop() is None and not frontier
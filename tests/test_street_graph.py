@@ -0,0 +1,122 @@
+import collections
+import heapq
+import math
+
+import numpy as np
+import pytest
+
+from Benchmark import city_engine
+
+max_distance = 2000  # feet
+
+
+def edges_of(graph):
+    return (np.asarray(graph.edge_u).tolist(), np.asarray(graph.edge_v).tolist(),
+            np.asarray(graph.edge_length).tolist())
+
+
+# Unbounded Dijkstra over the edge list, ignoring the CSR adjacency
+def reference_distances(graph, seeds):
+    neighbours = collections.defaultdict(list)
+    for u, v, length in zip(*edges_of(graph)):
+        neighbours[u].append((v, length))
+        neighbours[v].append((u, length))
+    distances = {}
+    queue = [(d, v) for v, d in seeds]
+    heapq.heapify(queue)
+    while queue:
+        d, v = heapq.heappop(queue)
+        if v in distances:
+            continue
+        distances[v] = d
+        for w, length in neighbours[v]:
+            if w not in distances:
+                heapq.heappush(queue, (d + length, w))
+    return distances
+
+
+def test_reach_matches_reference(network, origins):
+    graph = network.graph
+    for x, y in origins:
+        seeds = graph.snap(x, y)
+        expected = {v: d for v, d in reference_distances(graph, seeds).items() if d <= max_distance}
+        distances = graph.reach(seeds, max_distance)
+        assert distances.keys() == expected.keys()
+        for vertex, d in expected.items():
+            assert distances[vertex] == pytest.approx(d)
+
+
+def test_snap_finds_the_nearest_point_on_any_edge(network, origins):
+    graph = network.graph
+    xs = np.asarray(graph.x)
+    ys = np.asarray(graph.y)
+    edge_u, edge_v, lengths = (np.asarray(a) for a in edges_of(graph))
+    points = origins + [(-500.0, 300.0), (float(xs.max()) + 40, float(ys.max()) + 900)]
+    for x, y in points:
+        # Distance to every edge
+        dx = xs[edge_v] - xs[edge_u]
+        dy = ys[edge_v] - ys[edge_u]
+        squared = np.maximum(dx * dx + dy * dy, 1e-12)
+        t = np.clip(((x - xs[edge_u]) * dx + (y - ys[edge_u]) * dy) / squared, 0, 1)
+        nearest = np.hypot(xs[edge_u] + t * dx - x, ys[edge_u] + t * dy - y).min()
+
+        (u, to_u), (v, to_v) = graph.snap(x, y)
+        edge = next(e for e in range(len(edge_u)) if {edge_u[e], edge_v[e]} == {u, v}
+                    and lengths[e] == pytest.approx(to_u + to_v))
+        along = to_u / lengths[edge] if lengths[edge] else 0
+        if edge_u[edge] != u:
+            along = 1 - along
+        snapped = (xs[edge_u[edge]] + along * (xs[edge_v[edge]] - xs[edge_u[edge]]),
+                   ys[edge_u[edge]] + along * (ys[edge_v[edge]] - ys[edge_u[edge]]))
+        assert math.hypot(snapped[0] - x, snapped[1] - y) == pytest.approx(nearest)
+
+
+# Length of each edge within max_distance of a search, a point at s along an edge being
+#   reached from edge_u at to_u + s and from edge_v at to_v + length - s
+def reference_coverage(graph, distances):
+    covered = {}
+    for edge, (u, v, length) in enumerate(zip(*edges_of(graph))):
+        from_u = min(max(max_distance - distances.get(u, math.inf), 0), length)
+        from_v = min(max(max_distance - distances.get(v, math.inf), 0), length)
+        if from_u or from_v:
+            covered[edge] = min(from_u + from_v, length)
+    return covered
+
+
+def test_reached_edges_cover_what_is_reached(network, origins):
+    graph = network.graph
+    lengths = edges_of(graph)[2]
+    for x, y in origins:
+        distances = graph.reach(graph.snap(x, y), max_distance)
+        covered = collections.defaultdict(float)
+        for edge, start, end in graph.reached_edges(distances, max_distance):
+            assert 0 <= start < end <= lengths[edge] + 1e-9
+            covered[edge] += end - start
+        expected = reference_coverage(graph, distances)
+        assert covered.keys() == expected.keys()
+        for edge, length in expected.items():
+            assert covered[edge] == pytest.approx(length)
+
+
+def test_snap_many_is_snap(network, origins):
+    graph = network.graph
+    rng = np.random.default_rng(2)
+    # Clusters of points sharing grid cells, points on vertices and points off the network
+    crowded = [(origins[0][0] + dx, origins[0][1] + dy) for dx, dy in rng.uniform(-30, 30, (20, 2)).tolist()]
+    vertices = list(zip(np.asarray(graph.x)[:5].tolist(), np.asarray(graph.y)[:5].tolist()))
+    points = origins + crowded + vertices + [(-500.0, 300.0), (1e6, 1e6)]
+    many = graph.snap_many([x for x, _ in points], [y for _, y in points])
+    assert many == [graph.snap(x, y) for x, y in points]
+    assert graph.snap_many([], []) == []
+
+
+def test_cached_graph_snaps_as_built(city, network, origins):
+    engine = city_engine(city)
+    try:
+        graph = engine.street_graph()
+        assert graph is not network.graph
+        xs = [x for x, _ in origins]
+        ys = [y for _, y in origins]
+        assert graph.snap_many(xs, ys) == network.graph.snap_many(xs, ys)
+    finally:
+        engine.close()
@@ -0,0 +1,60 @@
+import pytest
+
+from TransferTable import build_transfer_table
+
+
+def stop_fids(network):
+    return network.graph.arrays[f"{network.stops_set}:keys"].tolist()
+
+
+def walk(network, fid, name, max_cost):
+    graph = network.graph
+    distances = graph.reach(graph.point_seeds(network.stops_set, fid), max_cost * network.walk_speed)
+    return {target: distance / network.walk_speed for target, distance in graph.reached_points(name, distances)
+            if not (name == network.stops_set and target == fid)}
+
+
+@pytest.mark.parametrize('max_cost', [0.1, 0.25, 1.0])
+def test_transfers_match_street_walks(network, max_cost):
+    table = network.transfers
+    for name in table.target_set_names():
+        for fid in stop_fids(network):
+            transfers = table.transfers(fid, name, max_cost)
+            costs = [cost for _, cost in transfers]
+            assert costs == sorted(costs) and all(cost <= max_cost for cost in costs)
+            expected = walk(network, fid, name, max_cost)
+            assert dict(transfers) == pytest.approx(expected, rel=1e-6)
+
+
+def test_transfers_are_symmetric(network):
+    table = network.transfers
+    for fid in stop_fids(network):
+        for target, cost in table.transfers(fid, network.stops_set, 0.5):
+            assert dict(table.transfers(target, network.stops_set, 0.5))[fid] == pytest.approx(cost)
+
+
+def test_transfers_to_inverts_transfers(network):
+    table = network.transfers
+    expected = {}
+    for fid in stop_fids(network):
+        for target, cost in table.transfers(fid, network.route_stops_set, 0.3):
+            expected.setdefault(target, {})[fid] = cost
+    assert expected
+    for target, stops in expected.items():
+        transfers_to = table.transfers_to(target, network.route_stops_set, 0.3)
+        costs = [cost for _, cost in transfers_to]
+        assert costs == sorted(costs)
+        assert dict(transfers_to) == stops
+    assert table.transfers_to(-1, network.route_stops_set, 0.3) == []
+
+
+def test_table_is_bounded_by_what_it_covers(network):
+    table = build_transfer_table(network.graph, network.stops_set, [network.stops_set], 0.2 * network.walk_speed,
+                                 network.walk_speed)
+    assert table.covers(0.2) and not table.covers(0.21)
+    for fid in stop_fids(network):
+        # Asking beyond the bound still returns only what was walked within it
+        assert table.transfers(fid, network.stops_set, 1.0) == table.transfers(fid, network.stops_set, 0.2)
+        assert dict(table.transfers(fid, network.stops_set, 0.2)) == \
+               pytest.approx(walk(network, fid, network.stops_set, 0.2), rel=1e-6)
+    assert table.transfers(-1, network.stops_set, 0.2) == []
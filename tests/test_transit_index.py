@@ -0,0 +1,108 @@
+import math
+import os
+import sqlite3
+
+import pytest
+
+from Benchmark import city_engine, write_synthetic_city
+from TransitIndex import build_headway_table, build_stop_index
+
+
+def route_stops(engine):
+    return [(fid, geometry[1], f['stop_id'], f['rte'], f['dir'])
+            for fid, geometry, f in engine.features(engine.sources.route_stops, ['stop_id', 'rte', 'dir'])]
+
+
+# The route stops of each rte and dir in travel order, with the route's speed in feet per hour
+#   (every line of the synthetic city is straight, so travel order is distance from its first point)
+def reference_routes(engine):
+    routes = {}
+    for _, geometry, f in engine.features(engine.sources.routes, ['rte', 'dir', 'KILO_FT_PER_HOUR']):
+        routes[(f['rte'], f['dir'])] = (geometry[1][0][0], f['KILO_FT_PER_HOUR'] * 1000, [])
+    for fid, point, _, rte, dir in route_stops(engine):
+        routes[(rte, dir)][2].append((fid, point))
+    return {key: (speed, sorted(stops, key=lambda stop: math.dist(start, stop[1])))
+            for key, (start, speed, stops) in routes.items()}
+
+
+@pytest.mark.parametrize('max_time', [0.05, 0.2, 10])
+def test_ride_sums_segment_times(engine, network, max_time):
+    patterns = network.patterns
+    rides = 0
+    for speed, stops in reference_routes(engine).values():
+        for board, (fid, point) in enumerate(stops):
+            expected = []
+            time = 0
+            previous = point
+            for next_fid, next_point in stops[board + 1:]:
+                time += math.dist(previous, next_point) / speed
+                previous = next_point
+                if time > max_time + 1e-9:
+                    break
+                expected.append((next_fid, time))
+            ride = patterns.ride(fid, max_time)
+            assert [stop for stop, _ in ride] == [stop for stop, _ in expected]
+            assert [time for _, time in ride] == pytest.approx([time for _, time in expected])
+            rides += len(ride)
+    assert rides > 0
+    assert patterns.ride(-1, max_time) == []
+
+
+def test_headway_refresh_replaces_the_table_in_place():
+    headways = build_headway_table([(100, 0, 4), (100, 1, 2), (200, 0, 0), (100, 0, 8)])
+    assert headways.expected_wait(100, 0) == pytest.approx(0.125)   # the first row of a route is used
+    assert headways.expected_wait(100, 1) == pytest.approx(0.25)
+    assert headways.expected_wait(200, 0) is None and headways.trips_per_hour(200, 0) == 0
+    headways.refresh([(100, 0, 2), (200, 0, 6)])
+    assert headways.expected_wait(100, 0) == pytest.approx(0.25)
+    assert headways.expected_wait(200, 0) == pytest.approx(1 / 12)
+    assert headways.expected_wait(100, 1) is None
+
+
+def test_headways_follow_edits_to_the_routes_layer(tmp_path):
+    write_synthetic_city(str(tmp_path), 6, 1)
+    engine = city_engine(str(tmp_path))
+    try:
+        rows = engine.headway_rows()
+        rte, dir, trips = rows[0]
+        network = engine.network()
+        version = engine.network_version(network.headways)
+        assert network.headways.expected_wait(rte, dir) == pytest.approx(0.5 / trips)
+
+        connection = sqlite3.connect(os.path.join(str(tmp_path), 'city.gpkg'))
+        connection.execute("UPDATE trimet_routes SET TRIPS_PER_HOUR = ? WHERE rte = ? AND dir = ?",
+                           (trips * 2, rte, dir))
+        connection.commit()
+        connection.close()
+
+        # The network built before the edit sees it once its table is refreshed
+        network.headways.refresh(engine.headway_rows())
+        assert network.headways.expected_wait(rte, dir) == pytest.approx(0.25 / trips)
+        assert engine.headway_table().arrays['trips_per_hour'].tolist() == \
+               network.headways.arrays['trips_per_hour'].tolist()
+        assert engine.network_version(network.headways) != version
+    finally:
+        engine.close()
+
+
+def test_stop_index_round_trips_fids(engine, network):
+    stop_index = network.stop_index
+    stops = {f['stop_id']: fid for fid, _, f in engine.features(engine.sources.stops, ['stop_id'], geometry=False)}
+    for fid, _, stop_id, rte, dir in route_stops(engine):
+        assert stop_index.stop_id(fid) == stop_id
+        assert stop_index.rte_dir(fid) == (rte, dir)
+        assert stop_index.route_stop_stop_fid(fid) == stops[stop_id]
+        assert stop_index.stop_fid(stop_index.stop_id(fid)) == stops[stop_id]
+        assert stop_index.route_stop_path(fid, 0.5) == {'fid': fid, 'stop_id': stop_id, 'rte': rte, 'dir': dir,
+                                                        'cost': 0.5}
+    for stop_id, fid in stops.items():
+        assert stop_index.stop_fid(stop_id) == fid
+    for missing in (None, -1, 0, 10 ** 6):
+        assert stop_index.stop_id(missing) is None and stop_index.stop_fid(missing) is None
+
+
+def test_stop_index_skips_missing_identifiers():
+    stop_index = build_stop_index([(1, 10, 100, 0), (3, 12, 100, 0), (4, None, 200, 1)], [(7, 10), (8, 11)])
+    assert [stop_index.route_stop_stop_fid(fid) for fid in range(6)] == [None, 7, None, None, None, None]
+    assert stop_index.stop_id(3) == 12 and stop_index.stop_fid(12) is None
+    assert stop_index.stop_id(4) is None and stop_index.rte_dir(4) == (200, 1)
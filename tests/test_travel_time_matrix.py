@@ -0,0 +1,36 @@
+import csv
+import json
+import os
+
+import numpy as np
+
+from BlockIndex import unreached_minutes
+from TravelTimeMatrix import block_id_field, write_travel_time_matrix
+
+time_limit_minutes = 15
+
+
+def test_matrix_matches_per_origin_searches(engine, origins, tmp_path):
+    directory = str(tmp_path / 'matrix')
+    network = engine.network(blocks=True)
+    named = [(f"origin {row}", x, y) for row, (x, y) in enumerate(origins)]
+    block_ids = engine.block_field(block_id_field)
+    assert write_travel_time_matrix(directory, network, named, block_ids, time_limit_minutes / 60, 'raptor') == \
+           len(origins)
+
+    matrix = np.load(os.path.join(directory, 'travel_times.npy'))
+    fids = network.block_reach.fids
+    assert matrix.dtype == np.uint16 and matrix.shape == (len(origins), len(fids))
+    with open(os.path.join(directory, 'blocks.csv'), newline='') as f:
+        assert [(int(row['fid']), row[block_id_field]) for row in csv.DictReader(f)] == \
+               list(zip(fids.tolist(), block_ids))
+    with open(os.path.join(directory, 'matrix.json')) as f:
+        assert json.load(f)['unreached'] == unreached_minutes == 65535
+
+    # A block is within m whole minutes of an origin exactly when a search to m minutes reaches it
+    bands = [minutes / 60 for minutes in (5, 10, time_limit_minutes)]
+    for row, (x, y) in enumerate(origins):
+        assert (matrix[row][matrix[row] != unreached_minutes] <= time_limit_minutes).all()
+        for band, blocks in engine.search(x, y, bands[-1], bands=bands, network=network)[1]:
+            assert fids[matrix[row] <= round(band * 60)].tolist() == blocks
+    assert (matrix == unreached_minutes).any() and (matrix < unreached_minutes).any()
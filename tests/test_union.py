@@ -0,0 +1,41 @@
+import numpy as np
+
+from BatchSearch import search_origin
+from BlockIndex import unreached_minutes
+
+bands = [6 / 60, 15 / 60]  # whole minutes, so block_minutes tell which bands reach a block
+
+
+def test_union_is_the_union_of_each_origin(engine, origins):
+    network = engine.network()
+    _, blocks = engine.union(origins, bands[-1], bands=bands, network=network)
+    singles = [engine.search(x, y, bands[-1], bands=bands, network=network)[1] for x, y in origins]
+    for band, (union_band, fids) in enumerate(blocks):
+        assert union_band == bands[band]
+        assert fids == sorted(set().union(*(single[band][1] for single in singles)))
+    assert blocks[-1][1]
+
+
+def test_labels_are_the_nearest_origin_and_split_the_union(engine, origins):
+    network = engine.network(blocks=True)
+    result, blocks = engine.union(origins, bands[-1], bands=bands, labeled=True, network=network)
+    minutes = np.array([search_origin(network, index, network.graph.snap(x, y), bands[-1], 'raptor',
+                                      block_times=True).block_minutes for index, (x, y) in enumerate(origins)])
+    nearest = minutes.min(axis=0)
+    fids = network.block_reach.fids
+
+    labeled = engine.source_blocks(bands, result)
+    for band, sources, (_, union_fids), (_, groups) in zip(bands, result.block_sources, blocks, labeled):
+        within = nearest <= round(band * 60)
+        assert np.array_equal(sources >= 0, within)
+        # Every block is labeled with an origin reaching it as soon as any origin does
+        reached = np.flatnonzero(within)
+        assert (minutes[sources[reached], reached] == nearest[reached]).all()
+
+        # The groups are disjoint and together make up the union
+        grouped = [fid for _, group in groups for fid in group]
+        assert len(grouped) == len(set(grouped))
+        assert sorted(grouped) == union_fids == fids[within].tolist()
+        assert [label for label, _ in groups] == sorted({int(label) for label in sources[reached]})
+    assert len(labeled[-1][1]) > 1
+    assert (nearest[nearest != unreached_minutes] <= bands[-1] * 60).all()
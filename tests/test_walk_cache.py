@@ -0,0 +1,91 @@
+import pytest
+
+from RaptorSearch import RaptorSearch
+from WalkCache import WalkCache, _walk_bytes
+
+
+def stop_fids(network):
+    return network.graph.arrays[f"{network.stops_set}:keys"].tolist()
+
+
+def direct_walk(network, fid, max_time):
+    graph = network.graph
+    distances = graph.reach(graph.point_seeds(network.stops_set, fid), max_time * network.walk_speed)
+    return distances, [(key, distance / network.walk_speed)
+                       for key, distance in graph.reached_points(network.route_stops_set, distances)]
+
+
+def test_walks_match_the_street_graph(network):
+    cache = WalkCache(network.graph, network.walk_speed)
+    for fid in stop_fids(network)[:5]:
+        for max_time in (0.2, 0.1, 0.3):
+            distances, reached = direct_walk(network, fid, max_time)
+            walked = cache.reachable(network.stops_set, fid, network.route_stops_set, max_time)
+            assert [key for key, _ in walked] == [key for key, _ in reached]
+            assert [time for _, time in walked] == pytest.approx([time for _, time in reached])
+
+            max_distance = max_time * network.walk_speed
+            spans = cache.edge_spans(network.stops_set, fid, max_time)
+            covered = network.graph.covered_edges(*spans, max_distance)
+            assert sorted(zip(*(a.tolist() for a in covered))) == \
+                   pytest.approx(sorted(network.graph.reached_edges(distances, max_distance)))
+
+
+def test_hit_rate_and_counters(network):
+    cache = WalkCache(network.graph, network.walk_speed)
+    fid = stop_fids(network)[0]
+    cache.reachable(network.stops_set, fid, network.route_stops_set, 0.1)    # miss
+    cache.reachable(network.stops_set, fid, network.route_stops_set, 0.05)   # hit, cut from the cached walk
+    cache.edge_spans(network.stops_set, fid, 0.1)                             # hit
+    cache.reachable(network.stops_set, fid, network.route_stops_set, 0.15)   # extended to 0.2
+    cache.reachable(network.stops_set, fid, network.route_stops_set, 0.2)    # hit
+    assert cache.counters() == {'walk_cache_hits': 3, 'walk_cache_misses': 1,
+                                'walk_cache_extensions': 1, 'walk_cache_evictions': 0}
+    assert cache.hit_rate() == pytest.approx(3 / 5)
+    assert cache.walks[(network.stops_set, fid)][0] == 0.2
+
+
+def test_extension_is_capped_at_the_limit(network):
+    cache = WalkCache(network.graph, network.walk_speed)
+    fid = stop_fids(network)[0]
+    cache.reachable(network.stops_set, fid, network.route_stops_set, 0.1)
+    cache.reachable(network.stops_set, fid, network.route_stops_set, 0.15, limit=0.16)
+    assert cache.walks[(network.stops_set, fid)][0] == 0.16
+
+
+def test_least_recently_used_walks_are_evicted(network):
+    fids = stop_fids(network)[:4]
+    sizes = {}
+    for fid in fids:
+        probe = WalkCache(network.graph, network.walk_speed)
+        probe.reachable(network.stops_set, fid, network.route_stops_set, 0.1)
+        sizes[fid] = _walk_bytes(probe.walks[(network.stops_set, fid)])
+
+    # Room for the first three walks only
+    cache = WalkCache(network.graph, network.walk_speed, memory_limit=sum(sizes[fid] for fid in fids[:3]))
+    for fid in fids[:3]:
+        cache.reachable(network.stops_set, fid, network.route_stops_set, 0.1)
+    cache.reachable(network.stops_set, fids[0], network.route_stops_set, 0.1)    # fids[1] is now the oldest
+    cache.reachable(network.stops_set, fids[3], network.route_stops_set, 0.1)
+    kept = [fid for _, fid in cache.walks]
+    assert fids[1] not in kept and fids[0] in kept and fids[3] in kept
+    assert cache.evictions >= 1
+    assert cache.memory_bytes == sum(_walk_bytes(walk) for walk in cache.walks.values())
+    assert cache.memory_bytes <= cache.memory_limit
+
+
+def test_walked_edge_spans_match_a_direct_walk(network, origins):
+    time_limit = 0.25
+    max_distance = time_limit * network.walk_speed
+    previous, network.walk_cache = network.walk_cache, WalkCache(network.graph, network.walk_speed)
+    try:
+        for x, y in origins[:3]:
+            search = RaptorSearch(network, time_limit)
+            search.run(x, y)
+            spans = network.walked_edge_spans(*search.walk_sources(), time_limit)
+            covered = network.graph.covered_edges(*spans, max_distance)
+            distances = network.graph.reach(search.walking_seeds(), max_distance)
+            assert sorted(zip(*(a.tolist() for a in covered))) == \
+                   pytest.approx(sorted(network.graph.reached_edges(distances, max_distance)))
+    finally:
+        network.walk_cache = previous